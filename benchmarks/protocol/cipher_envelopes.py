@@ -0,0 +1,99 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+
+CIPHER_ENVELOPES = ["fernet", "aes-gcm"]
+
+
+def benchmark(envelope: str, n_participants: int = 25, key_sharing: str = "key"):
+    """
+    Measure the size of the round 2 messages and the time to encrypt and decrypt the ciphers of one client
+    """
+    settings = SecureAggregationSettings(
+        cipher_envelope=envelope, key_sharing=key_sharing
+    )
+    client_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    user_ids = [f"user_{c}" for c in range(n_participants)]
+    client_keys = []
+    client_key_broadcasts = []
+    for user_id in user_ids:
+        keys, msg = client_protocol.setup()
+        client_keys.append(keys)
+        client_key_broadcasts.append(
+            BroadCastClientKeys(client_id=user_id, broadcast=msg)
+        )
+    server_key_broadcast = server_protocol.broadcast_keys(
+        "benchmark", 0, client_key_broadcasts
+    )
+
+    share_messages = []
+    start = perf_counter()
+    for user_id, keys in zip(user_ids, client_keys):
+        _, share_message = client_protocol.process_key_broadcast(
+            user_id, keys, server_key_broadcast, k=3
+        )
+        share_messages.append(share_message)
+    encryption_time = (perf_counter() - start) / n_participants
+
+    cipher_broadcast = server_protocol.broadcast_cyphers(user_ids[0], share_messages)
+    start = perf_counter()
+    client_protocol._decrypt_ciphers(
+        user_ids[0],
+        client_keys[0],
+        cipher_broadcast.ciphers,
+        server_key_broadcast.participants,
+    )
+    decryption_time = perf_counter() - start
+
+    results = {
+        "envelope": envelope,
+        "key_sharing": key_sharing,
+        "n_participants": n_participants,
+        "share_keys_message_bytes": len(share_messages[0].json()),
+        "client_key_share_time": encryption_time,
+        "client_decrypt_time": decryption_time,
+    }
+    print(results)
+    return results
+
+
+def benchmark_cipher_envelopes():
+    results = []
+    for n_participants in [25, 100]:
+        for key_sharing in ["key", "seed"]:
+            for envelope in CIPHER_ENVELOPES:
+                results.append(
+                    benchmark(
+                        envelope, n_participants=n_participants, key_sharing=key_sharing
+                    )
+                )
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index=["n_participants", "key_sharing"],
+            columns="envelope",
+            values="share_keys_message_bytes",
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/cipher_envelopes_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_cipher_envelopes()
@@ -0,0 +1,81 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+
+CIPHER_SUITES = ["secp384r1", "x25519"]
+
+
+def benchmark(cipher_suite: str, n_participants: int = 50, n_sampled: int = 5):
+    """
+    Measure the key setup for all participants and the key sharing step for a sample of the participants.
+    """
+    settings = SecureAggregationSettings(cipher_suite=cipher_suite)
+    client_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    start = perf_counter()
+    client_keys = []
+    client_key_broadcasts = []
+    for c in range(n_participants):
+        keys, msg = client_protocol.setup()
+        client_keys.append(keys)
+        client_key_broadcasts.append(
+            BroadCastClientKeys(client_id=f"user_{c}", broadcast=msg)
+        )
+    setup_time = perf_counter() - start
+
+    server_key_broadcast = server_protocol.broadcast_keys(
+        "benchmark", 0, client_key_broadcasts
+    )
+
+    start = perf_counter()
+    for c in range(n_sampled):
+        client_protocol.process_key_broadcast(
+            f"user_{c}", client_keys[c], server_key_broadcast, k=3
+        )
+    key_share_time = perf_counter() - start
+
+    results = {
+        "cipher_suite": cipher_suite,
+        "n_participants": n_participants,
+        "client_setup_time": setup_time / n_participants,
+        "client_key_share_time": key_share_time / n_sampled,
+        "key_broadcast_bytes": len(server_key_broadcast.json()),
+    }
+    print(results)
+    return results
+
+
+def benchmark_cipher_suites():
+    results = []
+    for n_participants in [50, 200, 1000]:
+        for cipher_suite in CIPHER_SUITES:
+            results.append(benchmark(cipher_suite, n_participants=n_participants))
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index="n_participants",
+            columns="cipher_suite",
+            values="client_key_share_time",
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/cipher_suites_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_cipher_suites()
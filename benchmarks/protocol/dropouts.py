@@ -0,0 +1,142 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+
+DROPOUT_RATES = [0.01, 0.1, 0.3]
+PROCESSES = [1, 2, 4]
+
+
+def benchmark(
+    n_clients: int = 100,
+    input_size: int = 100000,
+    dropout_rate: float = 0.1,
+    processes=None,
+):
+    """
+    Run a single round of the protocol in which a share of the clients drops out after sharing their keys and measure
+    the server aggregation time for different numbers of recovery processes
+    """
+    processes = processes if processes else PROCESSES
+    settings = SecureAggregationSettings()
+    client_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    user_ids = [f"user_{c}" for c in range(n_clients)]
+    client_keys = []
+    client_key_broadcasts = []
+    for user_id in user_ids:
+        keys, msg = client_protocol.setup()
+        client_keys.append(keys)
+        client_key_broadcasts.append(
+            BroadCastClientKeys(client_id=user_id, broadcast=msg)
+        )
+    server_key_broadcast = server_protocol.broadcast_keys(
+        "benchmark", 0, client_key_broadcasts
+    )
+
+    seeds = []
+    share_messages = []
+    for user_id, keys in zip(user_ids, client_keys):
+        seed, share_message = client_protocol.process_key_broadcast(
+            user_id, keys, server_key_broadcast, k=settings.threshold
+        )
+        seeds.append(seed)
+        share_messages.append(share_message)
+
+    # spread the dropped out clients over the participant list
+    n_dropped = max(1, round(dropout_rate * n_clients))
+    dropped = {user_ids[i] for i in np.linspace(0, n_clients - 1, n_dropped, dtype=int)}
+
+    cipher_router = server_protocol.route_ciphers(share_messages)
+    inputs = []
+    cipher_broadcasts = {}
+    masked_inputs = []
+    for user_id, keys, seed in zip(user_ids, client_keys, seeds):
+        cipher_broadcasts[user_id] = cipher_router.broadcast(user_id)
+        if user_id in dropped:
+            continue
+        user_input = np.random.random(input_size)
+        inputs.append(user_input)
+        masked_inputs.append(
+            client_protocol.process_cipher_broadcast(
+                user_id=user_id,
+                keys=keys,
+                cipher_broadcast=cipher_broadcasts[user_id],
+                participants=server_key_broadcast.participants,
+                input=user_input,
+                seed=seed,
+            )
+        )
+
+    unmask_broadcast = server_protocol.broadcast_unmask_participants(masked_inputs)
+    unmask_shares = [
+        client_protocol.process_unmask_broadcast(
+            user_id=user_id,
+            keys=keys,
+            cipher_broadcast=cipher_broadcasts[user_id],
+            unmask_broadcast=unmask_broadcast,
+            participants=server_key_broadcast.participants,
+        )
+        for user_id, keys in zip(user_ids, client_keys)
+        if user_id not in dropped
+    ]
+
+    expected = np.sum(inputs, axis=0)
+    results = []
+    for n_processes in processes:
+        start = perf_counter()
+        output = server_protocol.aggregate_masked_inputs(
+            client_key_broadcasts=client_key_broadcasts,
+            masked_inputs=masked_inputs,
+            unmask_shares=unmask_shares,
+            n_processes=n_processes,
+        )
+        server_aggregation_time = perf_counter() - start
+        assert np.allclose(output.params, expected)
+
+        result = {
+            "n_clients": n_clients,
+            "input_size": input_size,
+            "dropout_rate": dropout_rate,
+            "n_dropped": n_dropped,
+            "n_processes": n_processes,
+            "server_aggregation_time": server_aggregation_time,
+        }
+        print(result)
+        results.append(result)
+    return results
+
+
+def benchmark_dropouts():
+    results = []
+    for dropout_rate in DROPOUT_RATES:
+        results.extend(benchmark(dropout_rate=dropout_rate))
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index="dropout_rate",
+            columns="n_processes",
+            values="server_aggregation_time",
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/dropouts_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_dropouts()
@@ -0,0 +1,81 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+
+WORKERS = [1, 2, 4, 8]
+
+
+def benchmark(n_participants: int = 100, workers=None, cipher_suite="secp384r1"):
+    """
+    Measure the key sharing step of a single client for different numbers of encryption threads
+    """
+    workers = workers if workers else WORKERS
+    settings = SecureAggregationSettings(cipher_suite=cipher_suite)
+    setup_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    client_keys = []
+    client_key_broadcasts = []
+    for c in range(n_participants):
+        keys, msg = setup_protocol.setup()
+        client_keys.append(keys)
+        client_key_broadcasts.append(
+            BroadCastClientKeys(client_id=f"user_{c}", broadcast=msg)
+        )
+    server_key_broadcast = server_protocol.broadcast_keys(
+        "benchmark", 0, client_key_broadcasts
+    )
+
+    results = []
+    for n_workers in workers:
+        # a new client for each run, so no shared keys are cached from previous runs
+        client_protocol = ClientProtocol(settings=settings)
+        start = perf_counter()
+        client_protocol.process_key_broadcast(
+            "user_0", client_keys[0], server_key_broadcast, k=3, n_workers=n_workers
+        )
+        key_share_time = perf_counter() - start
+
+        result = {
+            "cipher_suite": cipher_suite,
+            "n_participants": n_participants,
+            "n_workers": n_workers,
+            "client_key_share_time": key_share_time,
+        }
+        print(result)
+        results.append(result)
+    return results
+
+
+def benchmark_key_share_workers():
+    results = []
+    for n_participants in [100, 250, 500, 1000]:
+        results.extend(benchmark(n_participants=n_participants))
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index="n_participants",
+            columns="n_workers",
+            values="client_key_share_time",
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/key_share_workers_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_key_share_workers()
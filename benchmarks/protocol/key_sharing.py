@@ -0,0 +1,97 @@
+import os
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
+from pht_federated.protocols.secure_aggregation.secrets.ciphers import (
+    generate_encrypted_cipher,
+)
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    generate_key_seed,
+)
+from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
+    combine_key_shares,
+    create_secret_shares,
+)
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    serialize_private_key,
+)
+
+
+def benchmark(key_sharing: str, cipher_suite: str, n: int = 50, k: int = 3):
+    """
+    Measure the cipher size, the time to encrypt the ciphers of all participants and the time to recover the sharing
+    key, when sharing the serialized sharing key or the seed it is derived from.
+    """
+    keys = ClientKeys(
+        cipher_suite=cipher_suite,
+        sharing_key_seed=generate_key_seed() if key_sharing == "seed" else None,
+    )
+    recipient_keys = ClientKeys(cipher_suite=cipher_suite)
+    sharing_secret = (
+        keys.hex_sharing_key_seed if key_sharing == "seed" else keys.hex_sharing_key
+    )
+
+    start = perf_counter()
+    shares = create_secret_shares(sharing_secret, os.urandom(4).hex(), n, k)
+    share_time = perf_counter() - start
+
+    start = perf_counter()
+    ciphers = [
+        generate_encrypted_cipher(
+            "sender",
+            keys.cipher_key,
+            "recipient",
+            recipient_keys.cipher_key_public,
+            key_share,
+            seed_share,
+        )
+        for key_share, seed_share in zip(shares.key_shares, shares.seed_shares)
+    ]
+    encryption_time = perf_counter() - start
+
+    start = perf_counter()
+    recovered_key = combine_key_shares(
+        shares.key_shares[:k], k=k, cipher_suite=cipher_suite, key_sharing=key_sharing
+    )
+    recovery_time = perf_counter() - start
+    assert serialize_private_key(recovered_key) == keys.hex_sharing_key
+
+    results = {
+        "key_sharing": key_sharing,
+        "cipher_suite": cipher_suite,
+        "n": n,
+        "key_segments": len(shares.key_shares[0].segments),
+        "cipher_bytes": len(ciphers[0]) // 2,
+        "share_time": share_time,
+        "encryption_time": encryption_time / n,
+        "recovery_time": recovery_time,
+    }
+    print(results)
+    return results
+
+
+def benchmark_key_sharing():
+    results = []
+    for cipher_suite in ["secp384r1", "x25519"]:
+        for key_sharing in ["key", "seed"]:
+            results.append(benchmark(key_sharing, cipher_suite))
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index="cipher_suite", columns="key_sharing", values="cipher_bytes"
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/key_sharing_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_key_sharing()
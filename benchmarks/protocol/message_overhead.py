@@ -0,0 +1,115 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    ShareKeysMessage,
+    UnmaskShares,
+)
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+    ServerUnmaskBroadCast,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+
+
+def benchmark(n_participants: int = 500, cipher_suite: str = "x25519"):
+    """
+    Measure the time one client spends in the key sharing and unmasking steps and the time to parse the messages of
+    these steps, which is dominated by building and validating the message models for many participants
+    """
+    settings = SecureAggregationSettings(
+        cipher_suite=cipher_suite, cipher_envelope="aes-gcm", shamir_engine="numpy"
+    )
+    client_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    user_ids = [f"user_{c}" for c in range(n_participants)]
+    client_keys = []
+    client_key_broadcasts = []
+    for user_id in user_ids:
+        keys, msg = client_protocol.setup()
+        client_keys.append(keys)
+        client_key_broadcasts.append(
+            BroadCastClientKeys(client_id=user_id, broadcast=msg)
+        )
+
+    start = perf_counter()
+    server_key_broadcast = server_protocol.broadcast_keys(
+        "benchmark", 0, client_key_broadcasts
+    )
+    server_key_broadcast_time = perf_counter() - start
+
+    # the first client shares its keys, the ciphers of the others are addressed to it as well
+    start = perf_counter()
+    seed, share_message = client_protocol.process_key_broadcast(
+        user_ids[0], client_keys[0], server_key_broadcast, k=3
+    )
+    client_key_share_time = perf_counter() - start
+
+    start = perf_counter()
+    ShareKeysMessage.parse_raw(share_message.json())
+    share_keys_parse_time = perf_counter() - start
+
+    share_messages = [share_message]
+    for user_id, keys in zip(user_ids[1:], client_keys[1:]):
+        share_messages.append(
+            client_protocol.process_key_broadcast(
+                user_id, keys, server_key_broadcast, k=3
+            )[1]
+        )
+    cipher_broadcast = server_protocol.route_ciphers(share_messages).broadcast(
+        user_ids[0]
+    )
+    unmask_broadcast = ServerUnmaskBroadCast(
+        participants=[{"user_id": user_id} for user_id in user_ids]
+    )
+
+    start = perf_counter()
+    unmask_shares = client_protocol.process_unmask_broadcast(
+        user_ids[0],
+        client_keys[0],
+        cipher_broadcast,
+        unmask_broadcast,
+        server_key_broadcast.participants,
+    )
+    client_unmask_time = perf_counter() - start
+
+    start = perf_counter()
+    UnmaskShares.parse_raw(unmask_shares.json())
+    unmask_shares_parse_time = perf_counter() - start
+
+    results = {
+        "cipher_suite": cipher_suite,
+        "n_participants": n_participants,
+        "server_key_broadcast_time": server_key_broadcast_time,
+        "client_key_share_time": client_key_share_time,
+        "share_keys_parse_time": share_keys_parse_time,
+        "client_unmask_time": client_unmask_time,
+        "unmask_shares_parse_time": unmask_shares_parse_time,
+    }
+    print(results)
+    return results
+
+
+def benchmark_message_overhead():
+    results = []
+    for n_participants in [100, 500, 1000]:
+        results.append(benchmark(n_participants=n_participants))
+
+    results_df = pd.DataFrame(results)
+    print(results_df)
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/message_overhead_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_message_overhead()
@@ -0,0 +1,59 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation.secrets.masking import (
+    create_generator,
+    generate_random_seed,
+    integer_seed_from_hex,
+)
+
+PRG_ENGINES = ["mt19937", "pcg64", "philox", "aes-ctr"]
+
+
+def benchmark(prg: str, n_params: int = 1000000, iterations: int = 5) -> dict:
+    """
+    Measure the throughput of expanding a seed into a float64 mask of n_params items
+    """
+    expand_time = 0
+    for i in range(iterations):
+        seed = integer_seed_from_hex(generate_random_seed())
+        start = perf_counter()
+        mask = create_generator(seed, prg=prg).random(n_params)
+        expand_time += perf_counter() - start
+        del mask
+
+    expand_time = expand_time / iterations
+    results = {
+        "prg": prg,
+        "n_params": n_params,
+        "expand_time": expand_time,
+        "gb_per_second": n_params * 8 / expand_time / 1e9,
+    }
+    print(
+        f"{prg} - {n_params} params: {results['expand_time']:.4f}s "
+        f"({results['gb_per_second']:.2f} GB/s)"
+    )
+    return results
+
+
+def benchmark_prg_engines():
+    sizes = [10**6, 10**7, 10**8]
+    results = []
+    for prg in PRG_ENGINES:
+        for n_params in sizes:
+            results.append(benchmark(prg, n_params=n_params, iterations=3))
+
+    results_df = pd.DataFrame(results)
+    print(results_df.pivot(index="n_params", columns="prg", values="gb_per_second"))
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/prg_throughput_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_prg_engines()
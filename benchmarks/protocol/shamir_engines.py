@@ -0,0 +1,65 @@
+import os
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
+from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
+    SHAMIR_ENGINES,
+    combine_key_shares,
+    combine_seed_shares,
+    create_secret_shares,
+)
+
+
+def benchmark(engine: str, n: int = 50, k: int = 3, repeats: int = 5):
+    """
+    Measure splitting the sharing key and seed of a client into n shares and combining them from k shares
+    """
+    keys = ClientKeys()
+    seed = os.urandom(4).hex()
+
+    start = perf_counter()
+    for _ in range(repeats):
+        shares = create_secret_shares(keys.hex_sharing_key, seed, n, k, engine=engine)
+    split_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(repeats):
+        combine_key_shares(shares.key_shares[:k], k=k, engine=engine)
+        combine_seed_shares(shares.seed_shares[:k], engine=engine)
+    combine_time = perf_counter() - start
+
+    results = {
+        "engine": engine,
+        "n": n,
+        "k": k,
+        "split_time": split_time / repeats,
+        "combine_time": combine_time / repeats,
+        "share_bytes": len(shares.key_shares[0].json())
+        + len(shares.seed_shares[0].json()),
+    }
+    print(results)
+    return results
+
+
+def benchmark_shamir_engines():
+    results = []
+    for n in [10, 50, 200]:
+        for engine in SHAMIR_ENGINES:
+            results.append(benchmark(engine, n=n, k=max(3, n // 2)))
+
+    results_df = pd.DataFrame(results)
+    print(results_df.pivot(index="n", columns="engine", values="split_time"))
+    print(results_df.pivot(index="n", columns="engine", values="combine_time"))
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/shamir_engines_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_shamir_engines()
@@ -0,0 +1,135 @@
+import math
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+
+
+def benchmark(n_clients: int = 100, input_size: int = 10000, graph_degree=None):
+    """
+    Run a single round of the protocol without dropouts and measure the time spent per client and on the server
+    """
+    settings = SecureAggregationSettings(graph_degree=graph_degree)
+    client_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    user_ids = [f"user_{c}" for c in range(n_clients)]
+    client_keys = []
+    client_key_broadcasts = []
+    for user_id in user_ids:
+        keys, msg = client_protocol.setup()
+        client_keys.append(keys)
+        client_key_broadcasts.append(
+            BroadCastClientKeys(client_id=user_id, broadcast=msg)
+        )
+    server_key_broadcast = server_protocol.broadcast_keys(
+        "benchmark", 0, client_key_broadcasts
+    )
+
+    start = perf_counter()
+    seeds = []
+    share_messages = []
+    for user_id, keys in zip(user_ids, client_keys):
+        seed, share_message = client_protocol.process_key_broadcast(
+            user_id, keys, server_key_broadcast, k=3
+        )
+        seeds.append(seed)
+        share_messages.append(share_message)
+    client_key_share_time = perf_counter() - start
+
+    start = perf_counter()
+    cipher_router = server_protocol.route_ciphers(share_messages)
+    cipher_broadcasts = [cipher_router.broadcast(user_id) for user_id in user_ids]
+    server_cipher_distribution_time = perf_counter() - start
+
+    start = perf_counter()
+    masked_inputs = [
+        client_protocol.process_cipher_broadcast(
+            user_id=user_id,
+            keys=keys,
+            cipher_broadcast=cipher_broadcast,
+            participants=server_key_broadcast.participants,
+            input=np.zeros(input_size),
+            seed=seed,
+        )
+        for user_id, keys, cipher_broadcast, seed in zip(
+            user_ids, client_keys, cipher_broadcasts, seeds
+        )
+    ]
+    client_masked_input_time = perf_counter() - start
+
+    unmask_broadcast = server_protocol.broadcast_unmask_participants(masked_inputs)
+    start = perf_counter()
+    unmask_shares = [
+        client_protocol.process_unmask_broadcast(
+            user_id=user_id,
+            keys=keys,
+            cipher_broadcast=cipher_broadcast,
+            unmask_broadcast=unmask_broadcast,
+            participants=server_key_broadcast.participants,
+        )
+        for user_id, keys, cipher_broadcast in zip(
+            user_ids, client_keys, cipher_broadcasts
+        )
+    ]
+    client_unmask_time = perf_counter() - start
+
+    start = perf_counter()
+    output = server_protocol.aggregate_masked_inputs(
+        client_key_broadcasts=client_key_broadcasts,
+        masked_inputs=masked_inputs,
+        unmask_shares=unmask_shares,
+    )
+    server_aggregation_time = perf_counter() - start
+    assert np.allclose(output.params, 0)
+
+    results = {
+        "n_clients": n_clients,
+        "graph": "complete" if graph_degree is None else "sparse",
+        "graph_degree": graph_degree if graph_degree else n_clients - 1,
+        "client_key_share_time": client_key_share_time / n_clients,
+        "client_masked_input_time": client_masked_input_time / n_clients,
+        "client_process_unmask_broadcast_time": client_unmask_time / n_clients,
+        "server_cipher_distribution_time": server_cipher_distribution_time,
+        "server_aggregation_time": server_aggregation_time,
+        "client_key_cache_hit_rate": client_protocol.key_cache.hit_rate,
+    }
+    print(results)
+    return results
+
+
+def benchmark_graph_degree():
+    clients = [10, 25, 50, 100, 200]
+    results = []
+    for n_clients in clients:
+        print(f"\nRunning protocol with {n_clients} clients")
+        # logarithmic number of neighbours for the sparse graph
+        sparse_degree = 2 * math.ceil(math.log2(n_clients))
+        results.append(benchmark(n_clients=n_clients))
+        results.append(benchmark(n_clients=n_clients, graph_degree=sparse_degree))
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index="n_clients", columns="graph", values="client_masked_input_time"
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/sparse_graph_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_graph_degree()
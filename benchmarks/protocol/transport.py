@@ -0,0 +1,74 @@
+import os.path
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    MaskedInput,
+)
+
+ENCODINGS = {
+    "json": (lambda message: message.json(), MaskedInput.parse_raw),
+    "base64": (lambda message: message.base64_json(), MaskedInput.parse_raw),
+    "binary": (lambda message: message.binary(), MaskedInput.parse_binary),
+}
+
+
+def benchmark(input_size: int, encoding: str, mask_mode: str = "float"):
+    """
+    Measure the size of a masked input message and the time to encode and decode it
+    """
+    if mask_mode == "float":
+        values = np.random.random(input_size)
+    else:
+        values = np.random.randint(0, 2**63, input_size, dtype=np.dtype(mask_mode))
+    message = MaskedInput(user_id="user_0", masked_input=values)
+    encode, decode = ENCODINGS[encoding]
+
+    start = perf_counter()
+    encoded = encode(message)
+    encode_time = perf_counter() - start
+
+    start = perf_counter()
+    decoded = decode(encoded)
+    decode_time = perf_counter() - start
+    assert np.array_equal(np.asarray(decoded.masked_input), values)
+
+    results = {
+        "input_size": input_size,
+        "mask_mode": mask_mode,
+        "encoding": encoding,
+        "message_bytes": len(encoded),
+        "encode_time": encode_time,
+        "decode_time": decode_time,
+    }
+    print(results)
+    return results
+
+
+def benchmark_transport():
+    results = []
+    for input_size in [10000, 1000000, 10000000]:
+        for mask_mode in ["float", "uint64"]:
+            for encoding in ENCODINGS:
+                results.append(benchmark(input_size, encoding, mask_mode=mask_mode))
+
+    results_df = pd.DataFrame(results)
+    print(
+        results_df.pivot(
+            index=["input_size", "mask_mode"],
+            columns="encoding",
+            values="decode_time",
+        )
+    )
+
+    date = datetime.now().strftime("%Y-%m-%d")
+    results_df.to_csv(f"results/transport_benchmark_{date}.csv", index=False)
+
+
+if __name__ == "__main__":
+    if not os.path.isdir("results"):
+        os.mkdir("results")
+    benchmark_transport()
@@ -1,6 +1,6 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 
 from pht_federated.aggregator.api import dependencies
@@ -12,10 +12,12 @@ from pht_federated.aggregator.schemas.protocol import (
     AggregationProtocolCreate,
     AggregationProtocolUpdate,
     KeyShareResponse,
+    MaskedInputResponse,
     ProtocolSettings,
     ProtocolSettingsUpdate,
     ProtocolStatus,
     RegistrationResponse,
+    UnmaskSharesResponse,
 )
 from pht_federated.aggregator.services.secure_aggregation.service import (
     secure_aggregation,
@@ -24,6 +26,9 @@ from pht_federated.protocols.secure_aggregation.models import (
     client_messages,
     server_messages,
 )
+from pht_federated.protocols.secure_aggregation.models.binary import (
+    BINARY_MEDIA_TYPE,
+)
 
 router = APIRouter()
 
@@ -102,6 +107,7 @@ def update_protocol(
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     protocol = protocols.update(db, db_obj=protocol, obj_in=protocol_update)
+    secure_aggregation.status_cache.invalidate(protocol_id)
     return protocol
 
 
@@ -114,7 +120,9 @@ def delete_protocol(
         raise HTTPException(
             status_code=404, detail=f"Protocol - {protocol_id} - not found"
         )
+    secure_aggregation.evict_rounds(db, protocol_id)
     protocol = protocols.remove(db, id=protocol_id)
+    secure_aggregation.status_cache.invalidate(protocol_id)
     return protocol
 
 
@@ -137,6 +145,12 @@ def advance_protocol(protocol_id: str, db: Session = Depends(dependencies.get_db
 def get_protocol_status(
     protocol_id: str, db: Session = Depends(dependencies.get_db), round_id: int = None
 ) -> dict:
+    # the status of the active round is served from the cache without querying the database
+    if not round_id:
+        status = secure_aggregation.cached_status(protocol_id)
+        if status:
+            return status
+
     protocol = protocols.get(db, protocol_id)
     if not protocol:
         raise HTTPException(
@@ -203,14 +217,17 @@ def register_for_protocol(
 )
 def get_key_broadcasts(
     protocol_id: str, db: Session = Depends(dependencies.get_db)
-) -> List[client_messages.ClientKeyBroadCast]:
+) -> server_messages.ServerKeyBroadcast:
     protocol = protocols.get(db, protocol_id)
     if not protocol:
         raise HTTPException(
             status_code=404, detail=f"Protocol - {protocol_id} - not found"
         )
 
-    key_broadcasts = secure_aggregation.aggregate_key_broadcasts(db, protocol)
+    try:
+        key_broadcasts = secure_aggregation.aggregate_key_broadcasts(db, protocol)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return key_broadcasts
 
 
@@ -231,3 +248,117 @@ def upload_key_shares(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return response
+
+
+@router.get(
+    "/{protocol_id}/ciphers", response_model=server_messages.ServerCipherBroadcast
+)
+def get_ciphers(
+    protocol_id: str, client_id: str, db: Session = Depends(dependencies.get_db)
+) -> server_messages.ServerCipherBroadcast:
+    protocol = protocols.get(db, protocol_id)
+    if not protocol:
+        raise HTTPException(
+            status_code=404, detail=f"Protocol - {protocol_id} - not found"
+        )
+
+    try:
+        response = secure_aggregation.broadcast_ciphers(db, protocol, client_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return response
+
+
+async def parse_masked_input(request: Request) -> client_messages.MaskedInput:
+    """
+    Parse a masked input uploaded as JSON or as binary message
+    """
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith(BINARY_MEDIA_TYPE):
+            return client_messages.MaskedInput.parse_binary(body)
+        return client_messages.MaskedInput.parse_raw(body)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.post("/{protocol_id}/maskedInput", response_model=MaskedInputResponse)
+def upload_masked_input(
+    protocol_id: str,
+    masked_input: client_messages.MaskedInput = Depends(parse_masked_input),
+    db: Session = Depends(dependencies.get_db),
+):
+    protocol = protocols.get(db, protocol_id)
+    if not protocol:
+        raise HTTPException(
+            status_code=404, detail=f"Protocol - {protocol_id} - not found"
+        )
+
+    try:
+        response = secure_aggregation.process_masked_input(db, masked_input, protocol)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return response
+
+
+@router.get(
+    "/{protocol_id}/unmaskBroadcast",
+    response_model=server_messages.ServerUnmaskBroadCast,
+)
+def get_unmask_broadcast(
+    protocol_id: str, db: Session = Depends(dependencies.get_db)
+) -> server_messages.ServerUnmaskBroadCast:
+    protocol = protocols.get(db, protocol_id)
+    if not protocol:
+        raise HTTPException(
+            status_code=404, detail=f"Protocol - {protocol_id} - not found"
+        )
+
+    try:
+        response = secure_aggregation.broadcast_unmask_participants(db, protocol)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return response
+
+
+@router.post("/{protocol_id}/unmaskShares", response_model=UnmaskSharesResponse)
+def upload_unmask_shares(
+    protocol_id: str,
+    unmask_shares: client_messages.UnmaskShares,
+    db: Session = Depends(dependencies.get_db),
+):
+    protocol = protocols.get(db, protocol_id)
+    if not protocol:
+        raise HTTPException(
+            status_code=404, detail=f"Protocol - {protocol_id} - not found"
+        )
+
+    try:
+        response = secure_aggregation.process_unmask_shares(db, unmask_shares, protocol)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return response
+
+
+@router.get("/{protocol_id}/results")
+def get_results(
+    protocol_id: str,
+    request: Request,
+    round_id: int = None,
+    db: Session = Depends(dependencies.get_db),
+) -> Response:
+    protocol = protocols.get(db, protocol_id)
+    if not protocol:
+        raise HTTPException(
+            status_code=404, detail=f"Protocol - {protocol_id} - not found"
+        )
+
+    try:
+        results = secure_aggregation.round_results(db, protocol, round_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # the aggregated parameters are sent as binary message if the client accepts it
+    if BINARY_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(content=results.binary(), media_type=BINARY_MEDIA_TYPE)
+    return Response(content=results.json(), media_type="application/json")
@@ -7,8 +7,11 @@ from sqlalchemy import (
     Column,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
 )
 from sqlalchemy.dialects.postgresql import UUID
@@ -70,6 +73,16 @@ class ProtocolSettings(Base):
     auto_advance_min = Column(Integer, default=5)
     min_participants = Column(Integer, default=3)
     max_participants = Column(Integer, default=50)
+    cipher_suite = Column(String, default="secp384r1")
+    key_encoding = Column(String, default="hex")
+    key_sharing = Column(String, default="key")
+    cipher_envelope = Column(String, default="fernet")
+    prg = Column(String, default="mt19937")
+    mask_mode = Column(String, default="float")
+    fixed_point_scale = Column(Float, default=2**16)
+    shamir_engine = Column(String, default="pycryptodome")
+    graph_degree = Column(Integer, nullable=True)
+    threshold = Column(Integer, default=3)
 
 
 class ProtocolRound(Base):
@@ -89,12 +102,31 @@ class ProtocolRound(Base):
     client_key_shares = relationship(
         "ClientKeyShares", back_populates="round", cascade="all, delete, delete-orphan"
     )
+    client_masked_inputs = relationship(
+        "ClientMaskedInput",
+        back_populates="round",
+        cascade="all, delete, delete-orphan",
+    )
+    client_unmask_shares = relationship(
+        "ClientUnmaskShares",
+        back_populates="round",
+        cascade="all, delete, delete-orphan",
+    )
+    # running sum of the masked inputs received in the round, as packed array in the dtype of the masking mode
+    masked_sum = Column(LargeBinary, nullable=True)
+    manifest = Column(JSON, nullable=True)
+    # unmasked sum of the inputs once the round has been aggregated, as packed array
+    result = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime, default=datetime.now())
     updated_at = Column(DateTime, nullable=True)
 
 
 class ClientKeyBroadcast(Base):
     __tablename__ = "client_key_broadcasts"
+    # the progress of a round is counted and looked up by client
+    __table_args__ = (
+        Index("ix_client_key_broadcasts_round_client", "round_id", "client_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     client_id = Column(String)
     created_at = Column(DateTime, default=datetime.now())
@@ -103,13 +135,46 @@ class ClientKeyBroadcast(Base):
     cipher_public_key = Column(String)
     sharing_public_key = Column(String)
     key_signature = Column(String, nullable=True)
+    key_encoding = Column(String, default="hex")
 
 
 class ClientKeyShares(Base):
     __tablename__ = "client_key_shares"
+    # the progress of a round is counted and looked up by client
+    __table_args__ = (
+        Index("ix_client_key_shares_round_client", "round_id", "client_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     client_id = Column(String)
     created_at = Column(DateTime, default=datetime.now())
     round_id = Column(ForeignKey("protocol_rounds.id", ondelete="CASCADE"))
     round = relationship("ProtocolRound", back_populates="client_key_shares")
     ciphers = Column(JSON)
+
+
+class ClientMaskedInput(Base):
+    __tablename__ = "client_masked_inputs"
+    # the progress of a round is counted and looked up by client
+    __table_args__ = (
+        Index("ix_client_masked_inputs_round_client", "round_id", "client_id"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(String)
+    created_at = Column(DateTime, default=datetime.now())
+    round_id = Column(ForeignKey("protocol_rounds.id", ondelete="CASCADE"))
+    round = relationship("ProtocolRound", back_populates="client_masked_inputs")
+
+
+class ClientUnmaskShares(Base):
+    __tablename__ = "client_unmask_shares"
+    # the progress of a round is counted and looked up by client
+    __table_args__ = (
+        Index("ix_client_unmask_shares_round_client", "round_id", "client_id"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(String)
+    created_at = Column(DateTime, default=datetime.now())
+    round_id = Column(ForeignKey("protocol_rounds.id", ondelete="CASCADE"))
+    round = relationship("ProtocolRound", back_populates="client_unmask_shares")
+    key_shares = Column(JSON)
+    seed_shares = Column(JSON)
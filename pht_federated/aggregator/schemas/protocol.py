@@ -2,7 +2,7 @@ import uuid
 from datetime import datetime
 from typing import List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from pht_federated.aggregator.schemas.discovery import DataDiscovery
 from pht_federated.aggregator.schemas.proposal import Proposal
@@ -10,6 +10,15 @@ from pht_federated.protocols.secure_aggregation.models.client_messages import (
     ClientKeyBroadCast,
     ShareKeysMessage,
 )
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    CipherEnvelope,
+    CipherSuite,
+    KeyEncoding,
+    KeySharing,
+    MaskMode,
+    PRGEngine,
+    ShamirEngine,
+)
 
 
 class ProtocolSettingsBase(BaseModel):
@@ -21,6 +30,18 @@ class ProtocolSettingsBase(BaseModel):
     auto_advance_min: Optional[int] = 5
     min_participants: Optional[int] = 3
     max_participants: Optional[int] = 50
+    cipher_suite: Optional[CipherSuite] = "secp384r1"
+    key_encoding: Optional[KeyEncoding] = "hex"
+    key_sharing: Optional[KeySharing] = "key"
+    cipher_envelope: Optional[CipherEnvelope] = "fernet"
+    prg: Optional[PRGEngine] = "mt19937"
+    mask_mode: Optional[MaskMode] = "float"
+    fixed_point_scale: Optional[float] = 2**16
+    shamir_engine: Optional[ShamirEngine] = "pycryptodome"
+    # number of neighbours per client in the communication graph, None for the complete graph
+    graph_degree: Optional[int] = Field(None, ge=1)
+    # minimum number of shares needed to recover the secrets of a dropped client
+    threshold: Optional[int] = Field(3, ge=1)
 
 
 class ProtocolSettingsCreate(ProtocolSettingsBase):
@@ -108,7 +129,17 @@ class RoundInputResponse(BaseModel):
 
 class RegistrationResponse(RoundInputResponse):
     currently_registered: int
+    # id identifying the client in the messages of the round
+    client_id: Optional[str]
 
 
 class KeyShareResponse(RoundInputResponse):
     key_shares_submitted: int
+
+
+class MaskedInputResponse(RoundInputResponse):
+    masked_inputs_submitted: int
+
+
+class UnmaskSharesResponse(RoundInputResponse):
+    unmask_shares_submitted: int
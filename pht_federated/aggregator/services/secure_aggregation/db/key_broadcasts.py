@@ -1,3 +1,4 @@
+import uuid
 from typing import List
 
 from sqlalchemy.orm import Session
@@ -6,6 +7,9 @@ from pht_federated.aggregator.models import protocol as models
 from pht_federated.protocols.secure_aggregation.models.client_messages import (
     ClientKeyBroadCast,
 )
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
 
 
 def get_key_broadcasts_for_round(
@@ -16,24 +20,49 @@ def get_key_broadcasts_for_round(
         .filter(
             models.ClientKeyBroadcast.round_id == round_id,
         )
+        # the neighbourhoods of the clients depend on the order of the broadcasts
+        .order_by(models.ClientKeyBroadcast.id)
         .all()
     )
 
 
+def get_client_key_broadcasts(db: Session, round_id: int) -> List[BroadCastClientKeys]:
+    """
+    Get the key broadcasts of a round together with the ids of the clients that submitted them
+    :param db: sqlalchemy session
+    :param round_id: id of the round
+    :return: list of client key broadcasts in the order of registration
+    """
+    # clients without a client id are identified by the id of their registration
+    return [
+        BroadCastClientKeys(
+            client_id=key_broadcast.client_id
+            if key_broadcast.client_id
+            else str(key_broadcast.id),
+            broadcast=ClientKeyBroadCast.from_orm(key_broadcast),
+        )
+        for key_broadcast in get_key_broadcasts_for_round(db, round_id)
+    ]
+
+
 def store_key_broadcast(
     db: Session,
     round: models.ProtocolRound,
     key_broadcast: ClientKeyBroadCast,
-):
+) -> models.ClientKeyBroadcast:
     """
     Store a key broadcast in the database for the given
     :param db:
     :param round:
     :param key_broadcast:
-    :return:
+    :return: the stored key broadcast with the id assigned to the client
     """
+    # uuids are not coerced to integers when the client ids are parsed from a key broadcast
     db_broadcast = models.ClientKeyBroadcast(
-        round_id=round.id, **key_broadcast.dict(exclude_none=True)
+        round_id=round.id,
+        client_id=str(uuid.uuid4()),
+        **key_broadcast.dict(exclude_none=True),
     )
     db.add(db_broadcast)
     db.commit()
+    return db_broadcast
@@ -0,0 +1,54 @@
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from pht_federated.aggregator.models import protocol as models
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    MaskedInput,
+)
+from pht_federated.protocols.secure_aggregation.models.util import pack_array
+
+
+def store_masked_input(
+    db: Session,
+    db_round: models.ProtocolRound,
+    masked_input: MaskedInput,
+    masked_sum: np.ndarray,
+    manifest: Optional[BlockManifest] = None,
+) -> models.ClientMaskedInput:
+    """
+    Store that a client submitted its masked input, together with the running sum of the round it has been added to in
+    the same transaction. The masked values are only part of the sum, the masks are removed from the sum alone.
+    :param db: sqlalchemy session
+    :param db_round: round the masked input was submitted for
+    :param masked_input: masked input message of the client
+    :param masked_sum: running sum of the masked inputs of the round including the masked input
+    :param manifest: block manifest of the masked inputs of the round
+    :return: the stored masked input
+    """
+    db_masked_input = models.ClientMaskedInput(
+        client_id=masked_input.user_id, round_id=db_round.id
+    )
+    db_round.masked_sum = pack_array(masked_sum)
+    db_round.manifest = manifest.dict() if manifest else None
+    db.add(db_masked_input)
+    db.add(db_round)
+    db.commit()
+
+    return db_masked_input
+
+
+def get_masked_input_clients(db: Session, round_id: int) -> List[str]:
+    """
+    Get the ids of the clients that submitted masked inputs in a round in the order of submission, without loading
+    the masked values
+    """
+    rows = (
+        db.query(models.ClientMaskedInput.client_id)
+        .filter(models.ClientMaskedInput.round_id == round_id)
+        .order_by(models.ClientMaskedInput.id)
+        .all()
+    )
+    return [row.client_id for row in rows]
@@ -0,0 +1,95 @@
+from typing import NamedTuple, Type, Union
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from pht_federated.aggregator.models import protocol as models
+
+# tables of the messages submitted by the clients in the steps of a round
+RoundInputModel = Type[
+    Union[
+        models.ClientKeyBroadcast,
+        models.ClientKeyShares,
+        models.ClientMaskedInput,
+        models.ClientUnmaskShares,
+    ]
+]
+
+
+class RoundProgress(NamedTuple):
+    """
+    Number of clients that submitted their messages in each step of a round
+    """
+
+    registered: int
+    key_shares: int
+    masked_inputs: int
+    unmask_shares: int
+
+
+def _count_query(model: RoundInputModel, round_id: int):
+    return (
+        select(func.count(model.id)).where(model.round_id == round_id).scalar_subquery()
+    )
+
+
+def count_round_inputs(db: Session, model: RoundInputModel, round_id: int) -> int:
+    """
+    Count the messages submitted in a round, without loading them
+    :param db: sqlalchemy session
+    :param model: table of the messages
+    :param round_id: id of the round
+    :return: number of messages submitted in the round
+    """
+    return db.execute(select(_count_query(model, round_id))).scalar_one()
+
+
+def count_key_broadcasts(db: Session, round_id: int) -> int:
+    return count_round_inputs(db, models.ClientKeyBroadcast, round_id)
+
+
+def count_key_shares(db: Session, round_id: int) -> int:
+    return count_round_inputs(db, models.ClientKeyShares, round_id)
+
+
+def count_masked_inputs(db: Session, round_id: int) -> int:
+    return count_round_inputs(db, models.ClientMaskedInput, round_id)
+
+
+def count_unmask_shares(db: Session, round_id: int) -> int:
+    return count_round_inputs(db, models.ClientUnmaskShares, round_id)
+
+
+def has_submitted(
+    db: Session, model: RoundInputModel, round_id: int, client_id: str
+) -> bool:
+    """
+    Check if a client submitted a message in a round, without loading the messages
+    :param db: sqlalchemy session
+    :param model: table of the messages
+    :param round_id: id of the round
+    :param client_id: id of the client
+    :return: whether the client submitted a message
+    """
+    query = select(model.id).where(
+        model.round_id == round_id, model.client_id == client_id
+    )
+    return db.execute(select(query.exists())).scalar_one()
+
+
+def round_progress(db: Session, round_id: int) -> RoundProgress:
+    """
+    Count the messages submitted in all steps of a round with a single query
+    :param db: sqlalchemy session
+    :param round_id: id of the round
+    :return: progress of the round
+    """
+    counts = db.execute(
+        select(
+            _count_query(models.ClientKeyBroadcast, round_id),
+            _count_query(models.ClientKeyShares, round_id),
+            _count_query(models.ClientMaskedInput, round_id),
+            _count_query(models.ClientUnmaskShares, round_id),
+        )
+    ).one()
+    return RoundProgress(*counts)
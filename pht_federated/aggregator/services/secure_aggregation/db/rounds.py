@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Union
+from typing import List, Union
 
 from sqlalchemy.orm import Session
 
@@ -72,3 +72,30 @@ def get_active_round(
     :return: active round
     """
     return db.get(ProtocolRound, protocol.active_round)
+
+
+def get_round_for_update(db: Session, round_id: int) -> Union[ProtocolRound, None]:
+    """
+    Get a round and lock it until the end of the transaction, to serialize concurrent updates of its running sum
+    :param db: sqlalchemy session
+    :param round_id: id of the round
+    :return: the locked round
+    """
+    return (
+        db.query(ProtocolRound)
+        .filter(ProtocolRound.id == round_id)
+        .populate_existing()
+        .with_for_update()
+        .first()
+    )
+
+
+def get_round_ids(db: Session, protocol_id: str) -> List[int]:
+    """
+    Get the ids of all rounds of a protocol, without loading the rounds
+    :param db: sqlalchemy session
+    :param protocol_id: id of the protocol
+    :return: ids of the rounds
+    """
+    rows = db.query(ProtocolRound.id).filter(ProtocolRound.protocol_id == protocol_id)
+    return [row.id for row in rows]
@@ -0,0 +1,47 @@
+import json
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from pht_federated.aggregator.models import protocol as models
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    UnmaskShares,
+)
+
+
+def store_unmask_shares(
+    db: Session, unmask_shares: UnmaskShares, round_id: int
+) -> models.ClientUnmaskShares:
+    """
+    Add the unmask shares of a client to the current transaction, the caller commits them together with the
+    aggregation of the round they complete
+    :param db: sqlalchemy session
+    :param unmask_shares: unmask shares of the client
+    :param round_id: id of the round
+    :return: the unmask shares to be stored
+    """
+    shares = json.loads(unmask_shares.json(include={"key_shares", "seed_shares"}))
+    db_unmask_shares = models.ClientUnmaskShares(
+        client_id=unmask_shares.user_id, round_id=round_id, **shares
+    )
+    db.add(db_unmask_shares)
+    db.flush()
+
+    return db_unmask_shares
+
+
+def get_unmask_shares_for_round(db: Session, round_id: int) -> List[UnmaskShares]:
+    rows = (
+        db.query(models.ClientUnmaskShares)
+        .filter(models.ClientUnmaskShares.round_id == round_id)
+        .order_by(models.ClientUnmaskShares.id)
+        .all()
+    )
+    return [
+        UnmaskShares(
+            user_id=row.client_id,
+            key_shares=row.key_shares,
+            seed_shares=row.seed_shares,
+        )
+        for row in rows
+    ]
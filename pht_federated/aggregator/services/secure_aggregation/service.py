@@ -1,26 +1,56 @@
+from typing import List, Optional
+
 from loguru import logger
 from sqlalchemy.orm import Session
 
 from pht_federated.aggregator.models import protocol as models
 from pht_federated.aggregator.schemas import protocol as schemas
 from pht_federated.aggregator.services.secure_aggregation import logging
-from pht_federated.aggregator.services.secure_aggregation.db import rounds
+from pht_federated.aggregator.services.secure_aggregation.db import progress, rounds
 from pht_federated.aggregator.services.secure_aggregation.db.key_broadcasts import (
-    get_key_broadcasts_for_round,
+    get_client_key_broadcasts,
     store_key_broadcast,
 )
 from pht_federated.aggregator.services.secure_aggregation.db.key_shares import (
     get_key_shares_for_round,
     store_key_shares,
 )
-from pht_federated.aggregator.services.secure_aggregation.steps import registration
+from pht_federated.aggregator.services.secure_aggregation.db.masked_inputs import (
+    get_masked_input_clients,
+)
+from pht_federated.aggregator.services.secure_aggregation.db.unmask_shares import (
+    store_unmask_shares,
+)
+from pht_federated.aggregator.services.secure_aggregation.steps import (
+    aggregation,
+    registration,
+)
+from pht_federated.aggregator.storage.cache.rounds import RoundCache
+from pht_federated.aggregator.storage.cache.status import (
+    StatusCache,
+    create_status_cache,
+)
 from pht_federated.protocols.secure_aggregation.models.client_messages import (
     ClientKeyBroadCast,
+    MaskedInput,
     ShareKeysMessage,
+    UnmaskShares,
 )
 from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    AggregatedParameters,
+    BroadCastClientKeys,
+    Round4Participant,
+    ServerCipherBroadcast,
     ServerKeyBroadcast,
+    ServerUnmaskBroadCast,
 )
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+from pht_federated.protocols.secure_aggregation.server.incremental import (
+    IncrementalAggregator,
+)
+from pht_federated.protocols.secure_aggregation.server.routing import CipherRouter
 from pht_federated.protocols.secure_aggregation.server.server_protocol import (
     ServerProtocol,
 )
@@ -31,8 +61,17 @@ class SecureAggregation:
     Service to manage Server side functions of the secure aggregation protocol
     """
 
-    def __init__(self):
+    def __init__(self, status_cache: StatusCache = None):
+        """
+        :param status_cache: cache of the protocol status, backed by redis if configured
+        """
         self.protocol = ServerProtocol()
+        # ciphers of the rounds whose key share collection has closed, indexed by recipient, by round id
+        self._cipher_routers: RoundCache[CipherRouter] = RoundCache()
+        # key broadcasts of the rounds whose registration has closed and the running sums of their masked inputs
+        self._key_broadcasts: RoundCache[List[BroadCastClientKeys]] = RoundCache()
+        self._aggregators: RoundCache[IncrementalAggregator] = RoundCache()
+        self.status_cache = status_cache if status_cache else create_status_cache()
 
     def advance_round(
         self, db: Session, protocol: models.AggregationProtocol
@@ -56,10 +95,29 @@ class SecureAggregation:
             if protocol.status != "active":
                 protocol.status = "active"
                 db.add(protocol)
+            if current_round.step == 3:
+                # the unmask shares have been collected, remove the masks from the running sum of the round. If the
+                # shares can not be combined, the round stays in step 3 without the shares of the current request
+                aggregator = self._round_aggregator(
+                    db, current_round, aggregation.protocol_settings(protocol)
+                )
+                try:
+                    aggregation.aggregate_round(db, current_round, aggregator)
+                except Exception:
+                    db.rollback()
+                    # the running sum may have been unmasked in place
+                    self._aggregators.evict([current_round.id])
+                    raise
             current_round.step += 1
             db.add(current_round)
             db.commit()
             db.refresh(current_round)
+            if current_round.step == 2:
+                # the key shares of the round are complete, index the ciphers once for all cipher broadcasts
+                self._cipher_router(db, current_round)
+            elif current_round.step > 3:
+                self._evict_round_caches([current_round.id])
+            self._update_status_cache(db, protocol)
             return current_round
         else:
             logging.protocol_error(
@@ -86,18 +144,29 @@ class SecureAggregation:
         if db_round.step == 0:
             # check if the minimum number of key broadcasts is reached
             return (
-                len(get_key_broadcasts_for_round(db, db_round.id))
+                progress.count_key_broadcasts(db, db_round.id)
                 >= settings.min_participants
             )
 
         elif db_round.step == 1:
-            raise NotImplementedError("Not implemented yet")
+            # check if the minimum number of clients shared their keys
+            return (
+                progress.count_key_shares(db, db_round.id) >= settings.min_participants
+            )
 
         elif db_round.step == 2:
-            raise NotImplementedError("Not implemented yet")
+            # check if the minimum number of masked inputs is reached
+            return (
+                progress.count_masked_inputs(db, db_round.id)
+                >= settings.min_participants
+            )
 
         elif db_round.step == 3:
-            raise NotImplementedError("Not implemented yet")
+            # check if the minimum number of unmask shares is reached
+            return (
+                progress.count_unmask_shares(db, db_round.id)
+                >= settings.min_participants
+            )
 
         else:
             raise ValueError("Invalid step number")
@@ -117,6 +186,7 @@ class SecureAggregation:
         logger.info(
             f"Protocol - {db_protocol.id} - Starting new round ({db_round.round})"
         )
+        self._update_status_cache(db, db_protocol)
         return db_round
 
     def process_registration(
@@ -135,6 +205,12 @@ class SecureAggregation:
         :param protocol: protocol object
         :return:
         """
+        settings: models.ProtocolSettings = protocol.settings
+        if settings and key_broadcast.key_encoding != settings.key_encoding:
+            raise ValueError(
+                f"Invalid key encoding: {key_broadcast.key_encoding}, the protocol uses {settings.key_encoding}"
+            )
+
         db_round = rounds.get_active_round(db, protocol)
 
         # if no round exists and the protocol is not finished or cancelled, start a new round
@@ -161,34 +237,37 @@ class SecureAggregation:
                     f"Registration for round already finished. Creating new round ({db_round.round})",
                 )
             # store the key broadcast
-            store_key_broadcast(db, next_round, key_broadcast)
+            db_broadcast = store_key_broadcast(db, next_round, key_broadcast)
 
-            next_round_participants = get_key_broadcasts_for_round(db, next_round.id)
+            next_round_participants = progress.count_key_broadcasts(db, next_round.id)
 
             response = schemas.RegistrationResponse(
                 round_id=next_round.id,
                 protocol_id=protocol.id,
                 message=f"Registration for current round closed. Registered for the next round {next_round.round}",
-                currently_registered=len(next_round_participants),
+                currently_registered=next_round_participants,
+                client_id=db_broadcast.client_id,
             )
 
         else:
             # store the key broadcast
-            store_key_broadcast(db, db_round, key_broadcast)
-            participants = get_key_broadcasts_for_round(db, db_round.id)
+            db_broadcast = store_key_broadcast(db, db_round, key_broadcast)
+            participants = progress.count_key_broadcasts(db, db_round.id)
             logging.protocol_info(
                 protocol.id,
-                f"Registered client no. {len(participants)} for round {db_round.round}",
+                f"Registered client no. {participants} for round {db_round.round}",
             )
             response = schemas.RegistrationResponse(
                 round_id=db_round.id,
                 protocol_id=protocol.id,
                 message="Successfully registered for round {}".format(db_round.round),
-                currently_registered=len(participants),
+                currently_registered=participants,
+                client_id=db_broadcast.client_id,
             )
 
             registration.update_protocol_on_registration(db, protocol)
 
+        self._update_status_cache(db, protocol)
         return response
 
     def protocol_status(
@@ -206,25 +285,69 @@ class SecureAggregation:
             f"Status: {protocol.status}, Current round: {current_round.round}",
         )
 
-        key_broadcasts = get_key_broadcasts_for_round(db, current_round.id)
+        status = self._round_status(db, protocol, current_round)
+        if current_round.id == protocol.active_round:
+            self.status_cache.set_status(status)
+        logging.protocol_debug(
+            protocol.id, f"Protocol status: \n{status.json(indent=2)}"
+        )
+        return status
+
+    def evict_rounds(self, db: Session, protocol_id: str):
+        """
+        Remove the cached data of the rounds of a protocol, e.g. before the protocol is deleted
+        :param db: sqlalchemy session
+        :param protocol_id: id of the protocol
+        """
+        self._evict_round_caches(rounds.get_round_ids(db, protocol_id))
+
+    def _evict_round_caches(self, round_ids: List[int]):
+        self._cipher_routers.evict(round_ids)
+        self._key_broadcasts.evict(round_ids)
+        self._aggregators.evict(round_ids)
+
+    def cached_status(self, protocol_id: str) -> Optional[schemas.ProtocolStatus]:
+        """
+        Get the status of the active round of a protocol from the cache, without querying the database
+        :param protocol_id: id of the protocol
+        :return: the cached status or None if it is not cached
+        """
+        return self.status_cache.get_status(protocol_id)
+
+    def _round_status(
+        self,
+        db: Session,
+        protocol: models.AggregationProtocol,
+        db_round: models.ProtocolRound,
+    ) -> schemas.ProtocolStatus:
         # get the round status
+        round_progress = progress.round_progress(db, db_round.id)
         round_status = schemas.RoundStatus(
-            step=current_round.step,
-            registered=len(key_broadcasts),
+            step=db_round.step, **round_progress._asdict()
         )
 
         # get the protocol status
-        status = schemas.ProtocolStatus(
+        return schemas.ProtocolStatus(
             protocol_id=protocol.id,
             status=protocol.status,
             num_rounds=protocol.num_rounds,
             active_round=protocol.active_round,
             round_status=round_status,
         )
-        logging.protocol_debug(
-            protocol.id, f"Protocol status: \n{status.json(indent=2)}"
+
+    def _update_status_cache(self, db: Session, protocol: models.AggregationProtocol):
+        """
+        Write the status of the active round of a protocol through to the cache after it changed
+        :param db: sqlalchemy session
+        :param protocol: protocol object
+        """
+        db_round = (
+            rounds.get_active_round(db, protocol) if protocol.active_round else None
         )
-        return status
+        if not db_round:
+            self.status_cache.invalidate(protocol.id)
+            return
+        self.status_cache.set_status(self._round_status(db, protocol, db_round))
 
     def aggregate_key_broadcasts(
         self, db: Session, protocol: models.AggregationProtocol
@@ -240,11 +363,7 @@ class SecureAggregation:
         if not current_round:
             raise ValueError("No active round found")
 
-        key_broadcasts = get_key_broadcasts_for_round(db, current_round.id)
-        key_broadcasts = [
-            ClientKeyBroadCast.from_orm(key_broadcast)
-            for key_broadcast in key_broadcasts
-        ]
+        key_broadcasts = get_client_key_broadcasts(db, current_round.id)
 
         server_broad_cast = ServerKeyBroadcast(
             protocol_id=protocol.id,
@@ -273,27 +392,274 @@ class SecureAggregation:
         if db_round.step != 1:
             raise ValueError("Invalid round step")
 
+        if not progress.has_submitted(
+            db, models.ClientKeyBroadcast, db_round.id, key_shares.client_id
+        ):
+            raise ValueError(
+                f"Client {key_shares.client_id} is not registered for round {db_round.round}"
+            )
+        if progress.has_submitted(
+            db, models.ClientKeyShares, db_round.id, key_shares.client_id
+        ):
+            raise ValueError(f"Client {key_shares.client_id} already shared its keys")
+
         # store the key shares
         db_share = store_key_shares(db, key_shares, db_round.id)
 
         assert db_share
 
-        # check if the requirements for advancing to the next round are met
-        if self._check_advance_requirements(db, protocol, db_round):
-            self.advance_round(db, protocol)
-
-        key_shares = get_key_shares_for_round(db, db_round.id)
+        n_key_shares = progress.count_key_shares(db, db_round.id)
         logger.info(
-            f"Protocol - {protocol.id} - Received {len(key_shares)} key shares for round {db_round.round}"
+            f"Protocol - {protocol.id} - Received {n_key_shares} key shares for round {db_round.round}"
         )
 
+        # all registered clients shared their keys, advance to the collection of the masked inputs
+        if n_key_shares == progress.count_key_broadcasts(db, db_round.id):
+            self.advance_round(db, protocol)
+        else:
+            self._update_status_cache(db, protocol)
+
         response = schemas.KeyShareResponse(
             round_id=db_round.id,
             message=f"Successfully submitted key shares for round {db_round.round}",
             protocol_id=protocol.id,
-            key_shares_submitted=len(key_shares),
+            key_shares_submitted=n_key_shares,
         )
         return response
 
+    def broadcast_ciphers(
+        self, db: Session, protocol: models.AggregationProtocol, client_id: str
+    ) -> ServerCipherBroadcast:
+        """
+        Get the ciphers addressed to a client in the active round of the given protocol
+        :param db: sqlalchemy session
+        :param protocol: protocol object
+        :param client_id: id of the client the ciphers are addressed to
+        :return: cipher broadcast for the client
+        """
+        db_round = rounds.get_active_round(db, protocol)
+        if not db_round:
+            raise ValueError("No active round found")
+        if db_round.step < 2:
+            raise ValueError("Key shares for the round are still being collected")
+
+        return self._cipher_router(db, db_round).broadcast(client_id)
+
+    def process_masked_input(
+        self,
+        db: Session,
+        masked_input: MaskedInput,
+        protocol: models.AggregationProtocol,
+    ) -> schemas.MaskedInputResponse:
+        """
+        Add the masked input of a client to the running sum of the active round
+        :param db: sqlalchemy session
+        :param masked_input: masked input message of the client
+        :param protocol: protocol object
+        :return:
+        """
+        db_round = rounds.get_active_round(db, protocol)
+        if not db_round:
+            raise ValueError("No active round found")
+        # lock the round, the running sum is updated by each upload
+        db_round = rounds.get_round_for_update(db, db_round.id)
+        if db_round.step != 2:
+            db.rollback()
+            raise ValueError("Invalid round step")
+
+        if not progress.has_submitted(
+            db, models.ClientKeyShares, db_round.id, masked_input.user_id
+        ):
+            db.rollback()
+            raise ValueError(
+                f"Client {masked_input.user_id} did not share keys in round {db_round.round}"
+            )
+        aggregator = self._round_aggregator(
+            db, db_round, aggregation.protocol_settings(protocol)
+        )
+        try:
+            n_inputs = aggregation.add_masked_input(
+                db, db_round, masked_input, aggregator
+            )
+        except ValueError:
+            # invalid masked inputs are rejected before they are added to the sum
+            db.rollback()
+            raise
+        except Exception:
+            db.rollback()
+            # the masked input may have been added to the cached sum without being stored
+            self._aggregators.evict([db_round.id])
+            raise
+        logging.protocol_info(
+            protocol.id,
+            f"Received {n_inputs} masked inputs for round {db_round.round}",
+        )
+
+        # all clients that shared their keys submitted a masked input, advance to the collection of the unmask shares
+        if n_inputs == progress.count_key_shares(db, db_round.id):
+            self.advance_round(db, protocol)
+        else:
+            self._update_status_cache(db, protocol)
+
+        return schemas.MaskedInputResponse(
+            round_id=db_round.id,
+            message=f"Successfully submitted masked input for round {db_round.round}",
+            protocol_id=protocol.id,
+            masked_inputs_submitted=n_inputs,
+        )
+
+    def broadcast_unmask_participants(
+        self, db: Session, protocol: models.AggregationProtocol
+    ) -> ServerUnmaskBroadCast:
+        """
+        Get the clients whose masked inputs are part of the sum of the active round, their masks are removed with the
+        unmask shares of the other clients
+        :param db: sqlalchemy session
+        :param protocol: protocol object
+        :return: unmask broadcast of the round
+        """
+        db_round = rounds.get_active_round(db, protocol)
+        if not db_round:
+            raise ValueError("No active round found")
+        if db_round.step < 3:
+            raise ValueError("Masked inputs for the round are still being collected")
+
+        participants = [
+            Round4Participant(user_id=client_id)
+            for client_id in get_masked_input_clients(db, db_round.id)
+        ]
+        return ServerUnmaskBroadCast(participants=participants)
+
+    def process_unmask_shares(
+        self,
+        db: Session,
+        unmask_shares: UnmaskShares,
+        protocol: models.AggregationProtocol,
+    ) -> schemas.UnmaskSharesResponse:
+        """
+        Store the unmask shares of a client, once all participants of the unmasking round submitted their shares the
+        round is aggregated
+        :param db: sqlalchemy session
+        :param unmask_shares: unmask shares of the client
+        :param protocol: protocol object
+        :return:
+        """
+        db_round = rounds.get_active_round(db, protocol)
+        if not db_round:
+            raise ValueError("No active round found")
+        # lock the round, the shares are stored in the same transaction as the aggregation they complete
+        db_round = rounds.get_round_for_update(db, db_round.id)
+        if db_round.step != 3:
+            db.rollback()
+            raise ValueError("Invalid round step")
+
+        if not progress.has_submitted(
+            db, models.ClientMaskedInput, db_round.id, unmask_shares.user_id
+        ):
+            db.rollback()
+            raise ValueError(
+                f"Client {unmask_shares.user_id} did not submit a masked input in round {db_round.round}"
+            )
+        if progress.has_submitted(
+            db, models.ClientUnmaskShares, db_round.id, unmask_shares.user_id
+        ):
+            db.rollback()
+            raise ValueError(
+                f"Client {unmask_shares.user_id} already submitted unmask shares"
+            )
+
+        store_unmask_shares(db, unmask_shares, db_round.id)
+        n_unmask_shares = progress.count_unmask_shares(db, db_round.id)
+        logging.protocol_info(
+            protocol.id,
+            f"Received {n_unmask_shares} unmask shares for round {db_round.round}",
+        )
+
+        # all participants of the unmasking round submitted their shares, aggregate the round, if the aggregation
+        # fails the shares are rolled back and can be submitted again
+        if n_unmask_shares == progress.count_masked_inputs(db, db_round.id):
+            self.advance_round(db, protocol)
+        else:
+            db.commit()
+            self._update_status_cache(db, protocol)
+
+        return schemas.UnmaskSharesResponse(
+            round_id=db_round.id,
+            message=f"Successfully submitted unmask shares for round {db_round.round}",
+            protocol_id=protocol.id,
+            unmask_shares_submitted=n_unmask_shares,
+        )
+
+    def round_results(
+        self, db: Session, protocol: models.AggregationProtocol, round_id: int = None
+    ) -> AggregatedParameters:
+        """
+        Get the aggregated parameters of a round of the given protocol
+        :param db: sqlalchemy session
+        :param protocol: protocol object
+        :param round_id: id of the round, defaults to the active round
+        :return: aggregated parameters of the round
+        """
+        db_round = db.get(
+            models.ProtocolRound, round_id if round_id else protocol.active_round
+        )
+        if not db_round or db_round.protocol_id != protocol.id:
+            raise ValueError("No active round found")
+        return aggregation.round_results(db_round)
+
+    def _round_aggregator(
+        self,
+        db: Session,
+        db_round: models.ProtocolRound,
+        settings: SecureAggregationSettings,
+    ) -> IncrementalAggregator:
+        """
+        Get the aggregator holding the running sum of the masked inputs of a round. The aggregator is kept between the
+        uploads and only restored from the database if it misses stored masked inputs, e.g. added by another worker
+        process. The key broadcasts of the round are loaded once.
+        :param db: sqlalchemy session
+        :param db_round: round object, locked if masked inputs are added
+        :param settings: settings of the protocol
+        :return: aggregator of the round
+        """
+        aggregator = self._aggregators.get(db_round.id)
+        if aggregator is not None and aggregator.n_inputs == (
+            progress.count_masked_inputs(db, db_round.id)
+        ):
+            return aggregator
+
+        client_key_broadcasts = self._key_broadcasts.get(db_round.id)
+        if client_key_broadcasts is None:
+            client_key_broadcasts = get_client_key_broadcasts(db, db_round.id)
+            self._key_broadcasts.set(db_round.id, client_key_broadcasts)
+        aggregator = aggregation.round_aggregator(
+            db, db_round, settings, client_key_broadcasts
+        )
+        self._aggregators.set(db_round.id, aggregator)
+        return aggregator
+
+    def _cipher_router(
+        self, db: Session, db_round: models.ProtocolRound
+    ) -> CipherRouter:
+        """
+        Get the index of the ciphers of a round by their recipient, built from the stored key shares on first use
+        :param db: sqlalchemy session
+        :param db_round: round object
+        :return: cipher router of the round
+        """
+        router = self._cipher_routers.get(db_round.id)
+        if router is None:
+            key_shares = get_key_shares_for_round(db, db_round.id)
+            router = self.protocol.route_ciphers(
+                [
+                    ShareKeysMessage(
+                        client_id=key_share.client_id, ciphers=key_share.ciphers
+                    )
+                    for key_share in key_shares
+                ]
+            )
+            self._cipher_routers.set(db_round.id, router)
+        return router
+
 
 secure_aggregation = SecureAggregation()
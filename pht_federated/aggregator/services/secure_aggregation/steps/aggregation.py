@@ -0,0 +1,134 @@
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from pht_federated.aggregator.models import protocol as models
+from pht_federated.aggregator.services.secure_aggregation.db.key_broadcasts import (
+    get_client_key_broadcasts,
+)
+from pht_federated.aggregator.services.secure_aggregation.db.masked_inputs import (
+    get_masked_input_clients,
+    store_masked_input,
+)
+from pht_federated.aggregator.services.secure_aggregation.db.unmask_shares import (
+    get_unmask_shares_for_round,
+)
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    MaskedInput,
+)
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    AggregatedParameters,
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+from pht_federated.protocols.secure_aggregation.models.util import (
+    pack_array,
+    unpack_array,
+)
+from pht_federated.protocols.secure_aggregation.server import IncrementalAggregator
+
+
+def protocol_settings(
+    protocol: models.AggregationProtocol,
+) -> SecureAggregationSettings:
+    """
+    Get the settings the clients of a protocol mask and share their keys with
+    :param protocol: protocol object
+    :return: secure aggregation settings of the protocol
+    """
+    settings: models.ProtocolSettings = protocol.settings
+    if not settings:
+        return SecureAggregationSettings()
+    return SecureAggregationSettings(
+        **{
+            field: getattr(settings, field)
+            for field in SecureAggregationSettings.__fields__
+        }
+    )
+
+
+def round_aggregator(
+    db: Session,
+    db_round: models.ProtocolRound,
+    settings: SecureAggregationSettings,
+    client_key_broadcasts: List[BroadCastClientKeys] = None,
+) -> IncrementalAggregator:
+    """
+    Continue the aggregation of a round from the running sum stored with the round
+    :param db: sqlalchemy session
+    :param db_round: round object
+    :param settings: settings of the protocol
+    :param client_key_broadcasts: key broadcasts of the round, loaded from the database if not given
+    :return: aggregator of the round
+    """
+    if client_key_broadcasts is None:
+        client_key_broadcasts = get_client_key_broadcasts(db, db_round.id)
+    return IncrementalAggregator.restore(
+        client_key_broadcasts,
+        masked_sum=unpack_array(db_round.masked_sum) if db_round.masked_sum else None,
+        participants=get_masked_input_clients(db, db_round.id),
+        settings=settings,
+        manifest=BlockManifest(**db_round.manifest) if db_round.manifest else None,
+    )
+
+
+def add_masked_input(
+    db: Session,
+    db_round: models.ProtocolRound,
+    masked_input: MaskedInput,
+    aggregator: IncrementalAggregator,
+) -> int:
+    """
+    Add the masked input of a client to the running sum of the round and store the updated sum. The round needs to be
+    locked, so concurrent uploads are added to the sum one after another. The masked values are not stored, only that
+    the client submitted them.
+    :param db: sqlalchemy session
+    :param db_round: locked round object
+    :param masked_input: masked input message of the client
+    :param aggregator: aggregator holding the current running sum of the round, see round_aggregator
+    :return: number of masked inputs in the running sum
+    """
+    aggregator.add_masked_input(masked_input)
+    store_masked_input(
+        db,
+        db_round,
+        masked_input,
+        masked_sum=aggregator.masked_sum,
+        manifest=aggregator.manifest,
+    )
+    return aggregator.n_inputs
+
+
+def aggregate_round(
+    db: Session, db_round: models.ProtocolRound, aggregator: IncrementalAggregator
+) -> AggregatedParameters:
+    """
+    Remove the masks from the running sum of the round with the stored unmask shares and add the aggregated
+    parameters to the round, the caller commits them together with the advancement of the round
+    :param db: sqlalchemy session
+    :param db_round: round object
+    :param aggregator: aggregator holding the running sum of all masked inputs of the round
+    :return: aggregated parameters of the round
+    """
+    aggregated = aggregator.finalize(get_unmask_shares_for_round(db, db_round.id))
+
+    db_round.result = pack_array(aggregated.params)
+    db.add(db_round)
+    return aggregated
+
+
+def round_results(db_round: models.ProtocolRound) -> AggregatedParameters:
+    """
+    Get the aggregated parameters stored with a round
+    :param db_round: round object
+    :return: aggregated parameters of the round
+    """
+    if db_round.result is None:
+        raise ValueError(f"Round {db_round.round} has not been aggregated yet")
+    return AggregatedParameters(
+        params=unpack_array(db_round.result),
+        manifest=db_round.manifest,
+    )
@@ -2,8 +2,8 @@ from sqlalchemy.orm import Session
 
 from pht_federated.aggregator.models import protocol as models
 from pht_federated.aggregator.services.secure_aggregation import logging
-from pht_federated.aggregator.services.secure_aggregation.db.key_broadcasts import (
-    get_key_broadcasts_for_round,
+from pht_federated.aggregator.services.secure_aggregation.db.progress import (
+    count_key_broadcasts,
 )
 
 
@@ -20,8 +20,10 @@ def update_protocol_on_registration(
     active_round = db.get(models.ProtocolRound, protocol.active_round)
 
     if active_round.step == 0:
-        key_broadcasts = get_key_broadcasts_for_round(db, active_round.id)
-        if settings.auto_advance and len(key_broadcasts) >= settings.auto_advance_min:
+        if (
+            settings.auto_advance
+            and count_key_broadcasts(db, active_round.id) >= settings.auto_advance_min
+        ):
             logging.protocol_info(
                 protocol.id,
                 f"Auto advancing round {active_round.id} to step 1 - Key sharing",
@@ -0,0 +1,64 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Generic, Iterable, Optional, TypeVar
+
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+# number of rounds whose derived data is kept per cache
+DEFAULT_ROUND_CACHE_SIZE = 32
+
+T = TypeVar("T")
+
+
+class RoundCache(Generic[T]):
+    """
+    Least recently used cache of data derived from the stored messages of a protocol round, e.g. the ciphers of a round
+    indexed by recipient. Each server process keeps its own entries, so only data that can be rebuilt from the
+    database is cached and a miss in another worker process rebuilds it.
+    """
+
+    def __init__(self, maxsize: int = None):
+        """
+        :param maxsize: maximum number of cached rounds, the least recently used round is evicted first
+        """
+        self.maxsize = (
+            maxsize
+            if maxsize
+            else int(os.getenv("AGGREGATOR_ROUND_CACHE_SIZE", DEFAULT_ROUND_CACHE_SIZE))
+        )
+        self._entries: "OrderedDict[int, T]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, round_id: int) -> Optional[T]:
+        with self._lock:
+            value = self._entries.get(round_id)
+            if value is not None:
+                self._entries.move_to_end(round_id)
+            return value
+
+    def set(self, round_id: int, value: T):
+        with self._lock:
+            self._entries[round_id] = value
+            self._entries.move_to_end(round_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, round_ids: Iterable[int]):
+        """
+        Remove the entries of the given rounds, e.g. when they are finished or deleted
+        :param round_ids: ids of the rounds
+        """
+        with self._lock:
+            for round_id in round_ids:
+                self._entries.pop(round_id, None)
+
+    def __contains__(self, round_id: int) -> bool:
+        with self._lock:
+            return round_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
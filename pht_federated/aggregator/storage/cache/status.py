@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple, Union
+
+import redis
+from dotenv import find_dotenv, load_dotenv
+from loguru import logger
+
+from pht_federated.aggregator.schemas.protocol import ProtocolStatus
+
+load_dotenv(find_dotenv())
+
+# seconds a cached status is served, bounds how long a status written out of order by concurrent requests is visible
+DEFAULT_STATUS_TTL = 10
+
+
+class StatusCache(ABC):
+    """
+    Cache of the status of the active round of each protocol, written through by the secure aggregation service on
+    every change, so the status polls of the clients are served without querying the database
+    """
+
+    @abstractmethod
+    def get_status(
+        self, protocol_id: Union[str, uuid.UUID]
+    ) -> Optional[ProtocolStatus]:
+        """
+        Get the cached status of a protocol
+        :param protocol_id: id of the protocol
+        :return: the status or None if it is not cached
+        """
+
+    @abstractmethod
+    def set_status(self, status: ProtocolStatus):
+        """
+        Cache the status of a protocol
+        :param status: current status of the protocol
+        """
+
+    @abstractmethod
+    def invalidate(self, protocol_id: Union[str, uuid.UUID]):
+        """
+        Remove the cached status of a protocol
+        :param protocol_id: id of the protocol
+        """
+
+    @staticmethod
+    def key(protocol_id: Union[str, uuid.UUID]) -> str:
+        return f"pht:protocol:{protocol_id}:status"
+
+
+class InMemoryStatusCache(StatusCache):
+    """
+    Status cache of a single server process, used for tests and if no redis server is configured. Each process keeps
+    its own entries, with multiple workers a worker serves its cached status for up to the ttl after another worker
+    changed it, so it is only used with a single worker.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_STATUS_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get_status(self, protocol_id) -> Optional[ProtocolStatus]:
+        with self._lock:
+            entry = self._entries.get(self.key(protocol_id))
+        if entry is None:
+            return None
+        expires, value = entry
+        if time.monotonic() > expires:
+            return None
+        return ProtocolStatus.parse_raw(value)
+
+    def set_status(self, status: ProtocolStatus):
+        with self._lock:
+            self._entries[self.key(status.protocol_id)] = (
+                time.monotonic() + self.ttl,
+                status.json(),
+            )
+
+    def invalidate(self, protocol_id):
+        with self._lock:
+            self._entries.pop(self.key(protocol_id), None)
+
+
+class RedisStatusCache(StatusCache):
+    """
+    Status cache shared by all server processes in redis. Errors of the redis connection are logged and treated as
+    cache misses, the status is then read from the database.
+    """
+
+    def __init__(
+        self, url: str = None, ttl: int = DEFAULT_STATUS_TTL, client: redis.Redis = None
+    ):
+        """
+        :param url: url of the redis server, e.g. redis://localhost:6379/0
+        :param ttl: seconds a cached status is served
+        :param client: optional redis client to use instead of connecting to the url
+        """
+        if client is None and url is None:
+            raise ValueError("Either a redis url or a client is required")
+        self.ttl = ttl
+        self.client = client if client is not None else redis.Redis.from_url(url)
+
+    def get_status(self, protocol_id) -> Optional[ProtocolStatus]:
+        try:
+            value = self.client.get(self.key(protocol_id))
+        except redis.RedisError as e:
+            logger.warning(
+                f"Failed to read cached status of protocol {protocol_id}: {e}"
+            )
+            return None
+        return ProtocolStatus.parse_raw(value) if value is not None else None
+
+    def set_status(self, status: ProtocolStatus):
+        try:
+            self.client.set(self.key(status.protocol_id), status.json(), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(
+                f"Failed to cache status of protocol {status.protocol_id}: {e}"
+            )
+
+    def invalidate(self, protocol_id):
+        try:
+            self.client.delete(self.key(protocol_id))
+        except redis.RedisError as e:
+            logger.warning(
+                f"Failed to invalidate cached status of protocol {protocol_id}: {e}"
+            )
+
+
+def create_status_cache() -> StatusCache:
+    """
+    Create the status cache, backed by redis if a redis url is configured. Without redis the status is cached in
+    memory, which is refused if the server runs multiple worker processes.
+    """
+    ttl = int(os.getenv("AGGREGATOR_STATUS_TTL", DEFAULT_STATUS_TTL))
+    if os.getenv("AGGREGATOR_REDIS_URL"):
+        return RedisStatusCache(os.getenv("AGGREGATOR_REDIS_URL"), ttl=ttl)
+    # number of uvicorn worker processes
+    if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        raise ValueError(
+            "AGGREGATOR_REDIS_URL is required to share the status cache between multiple workers"
+        )
+    return InMemoryStatusCache(ttl=ttl)
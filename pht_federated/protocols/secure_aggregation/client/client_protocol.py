@@ -1,8 +1,9 @@
-from typing import List, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Mapping, Tuple, Union
 
 import numpy as np
 
-from pht_federated.protocols.secure_aggregation.models import HexString
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
 from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
 from pht_federated.protocols.secure_aggregation.models.client_messages import (
     ClientKeyBroadCast,
@@ -24,33 +25,103 @@ from pht_federated.protocols.secure_aggregation.models.server_messages import (
     ServerUnmaskBroadCast,
     UserCipher,
 )
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
 from pht_federated.protocols.secure_aggregation.secrets.ciphers import (
     decrypt_cipher,
     generate_encrypted_cipher,
 )
+from pht_federated.protocols.secure_aggregation.secrets.graph import neighbourhood
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    SharedKeyCache,
+    generate_key_seed,
+)
 from pht_federated.protocols.secure_aggregation.secrets.masking import (
+    apply_mask_chunked,
     create_mask,
+    encode_fixed_point,
     generate_random_seed,
 )
 from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
     create_secret_shares,
 )
-from pht_federated.protocols.secure_aggregation.secrets.util import load_public_key
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    ParticipantKeys,
+    get_participant_keys,
+    load_participant_keys,
+)
+
+
+def _map_ordered(
+    func: Callable, items: list, n_workers: int = 1, executor: Executor = None
+) -> list:
+    """
+    Apply a function to all items, concurrently if an executor or more than one worker is given. The results are
+    returned in the order of the items.
+    :param func: function to apply
+    :param items: list of items
+    :param n_workers: number of threads to use when no executor is given
+    :param executor: optional executor, takes precedence over n_workers
+    :return: list of the results
+    """
+    if executor is not None:
+        return list(executor.map(func, items))
+    if n_workers > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(func, items))
+    return [func(item) for item in items]
 
 
 class ClientProtocol:
-    @staticmethod
-    def setup() -> Tuple[ClientKeys, ClientKeyBroadCast]:
+    def __init__(self, settings: SecureAggregationSettings = None):
+        """
+        :param settings: settings of the protocol, need to match the settings used by the server
         """
-        Generate a new key pair and create a broadcast message to the server containing the corresponding public keys
+        self.settings = settings if settings else SecureAggregationSettings()
+        # shared keys derived during a round, cleared after the unmask shares are created
+        self.key_cache = SharedKeyCache()
+        # parsed public keys of the participants of the current round
+        self._participant_keys = {}
+        self._participant_keys_source = None
+
+    def setup(self) -> Tuple[ClientKeys, ClientKeyBroadCast]:
+        """
+        Generate a new key pair of the protocol's cipher suite and create a broadcast message to the server containing
+        the corresponding public keys
 
         :return: Tuple of client keys containing a cipher and sharing key as well as the broadcast message to be
         sent to the server
         """
 
         # todo get signing key and verification keys from CA
-        keys = ClientKeys()
-        return keys, keys.key_broadcast()
+        # in seed mode the sharing key is derived from a random seed, which is shared instead of the key
+        sharing_key_seed = (
+            generate_key_seed() if self.settings.key_sharing == "seed" else None
+        )
+        keys = ClientKeys(
+            cipher_suite=self.settings.cipher_suite, sharing_key_seed=sharing_key_seed
+        )
+        return keys, keys.key_broadcast(key_encoding=self.settings.key_encoding)
+
+    def participant_keys(
+        self, participants: List[BroadCastClientKeys]
+    ) -> Dict[str, ParticipantKeys]:
+        """
+        Get the lookup table of the parsed public keys of the participants. The table is parsed once per round and
+        reused in the following steps as long as the participants and their keys do not change.
+
+        :param participants: the participants and their public keys received from the server
+        :return: dictionary of the parsed keys by client id
+        """
+        source = [
+            (p.client_id, p.broadcast.cipher_public_key, p.broadcast.sharing_public_key)
+            for p in participants
+        ]
+        if source != self._participant_keys_source:
+            self._participant_keys = load_participant_keys(participants)
+            self._participant_keys_source = source
+        return self._participant_keys
 
     def process_key_broadcast(
         self,
@@ -58,6 +129,8 @@ class ClientProtocol:
         keys: ClientKeys,
         broadcast: ServerKeyBroadcast,
         k: int = 3,
+        n_workers: int = 1,
+        executor: Executor = None,
     ) -> Tuple[str, ShareKeysMessage]:
         """
         Process a key broadcast message from the server. It contains the public keys of the participants for one
@@ -67,6 +140,8 @@ class ClientProtocol:
         :param keys: the client keys (whose public keys have been broadcast to the server)
         :param broadcast: the server key broadcast containing a list of client public keys
         :param k: the minimum number of required participants
+        :param n_workers: number of threads encrypting the ciphers
+        :param executor: optional executor to encrypt the ciphers with, takes precedence over n_workers
         :return: A Tuple containing the hex representation of the newly generated random seed and the share keys message
         containing encrypted ciphers for each other user
         """
@@ -74,27 +149,58 @@ class ClientProtocol:
             raise ValueError("Not enough participants")
         self._validate_broadcast(broadcast)
 
+        # the secrets are only shared with the neighbours in the communication graph
+        peers = neighbourhood(
+            client_id, broadcast.participants, self.settings.graph_degree
+        )
+        if len(peers) < k:
+            raise ValueError(
+                f"Not enough neighbours in the communication graph - ({len(peers)}/{k})"
+            )
+
         # generate a new random seed
         seed = generate_random_seed()
         # generate the secret shares
+        sharing_secret = (
+            keys.hex_sharing_key_seed
+            if self.settings.key_sharing == "seed"
+            else keys.hex_sharing_key
+        )
         secret_shares = create_secret_shares(
-            keys.hex_sharing_key, seed, n=len(broadcast.participants), k=k
+            sharing_secret,
+            seed,
+            n=len(peers),
+            k=k,
+            engine=self.settings.shamir_engine,
         )
         # encrypt the secret shares with the cipher public keys and generate a message to the server with the
         # encrypted shares
-        response = self.share_keys(client_id, keys, secret_shares, broadcast)
+        response = self.share_keys(
+            client_id,
+            keys,
+            secret_shares,
+            broadcast.copy(update={"participants": peers}),
+            cache=self.key_cache,
+            participant_keys=self.participant_keys(broadcast.participants),
+            envelope=self.settings.cipher_envelope,
+            n_workers=n_workers,
+            executor=executor,
+        )
 
         return seed, response
 
-    @staticmethod
     def process_cipher_broadcast(
+        self,
         user_id: str,
         keys: ClientKeys,
         cipher_broadcast: ServerCipherBroadcast,
         participants: List[BroadCastClientKeys],
-        input: np.ndarray,
+        input: Union[np.ndarray, Mapping[str, np.ndarray]],
         seed: str,
         k: int = 3,
+        n_workers: int = 1,
+        chunk_size: int = None,
+        manifest: BlockManifest = None,
     ) -> MaskedInput:
         """
         Process the ciphers broadcast from the server in round 2 of the protocol, along with the clients input and
@@ -105,9 +211,15 @@ class ClientProtocol:
         :param keys: key pair of the client matching the iteration of the protocol
         :param cipher_broadcast: server key broadcast containing the public keys of the other participants
         :param participants: list of  participants and their public keys received from the server
-        :param input: the client's protocol input
+        :param input: the client's protocol input, a flat vector or a dictionary of named tensors that are masked as
+            blocks of a single vector
         :param seed: the random seed generated in the previous round
         :param k: minimum number of participants
+        :param n_workers: number of threads used to generate the shared masks with the other participants
+        :param chunk_size: if given, the input is masked block-wise in chunks of this size without materializing the
+            full masks
+        :param manifest: optional layout of the named tensors in the masked input, derived from the tensors if not
+            given. With a flat vector as input, the vector has to be laid out according to the manifest.
 
         :return: Pydantic model containing the masked input
         """
@@ -118,6 +230,39 @@ class ClientProtocol:
                 f"Not enough ciphers collected - ({len(cipher_broadcast.ciphers)}/{k})"
             )
 
+        # the named tensors are masked as blocks at contiguous offsets of a single vector
+        if isinstance(input, Mapping):
+            if manifest is None:
+                manifest = BlockManifest.from_tensors(input)
+            input = manifest.flatten(input)
+        elif manifest is not None and len(input) != manifest.size:
+            raise ValueError(
+                f"Input of size {len(input)} does not match the size of the manifest {manifest.size}"
+            )
+
+        participant_keys = self.participant_keys(participants)
+        # only generate shared masks with the neighbours in the communication graph
+        participants = neighbourhood(user_id, participants, self.settings.graph_degree)
+
+        if chunk_size:
+            masked_input = apply_mask_chunked(
+                input,
+                user_id=user_id,
+                user_keys=keys,
+                participants=participants,
+                seed=seed,
+                chunk_size=chunk_size,
+                prg=self.settings.prg,
+                mode=self.settings.mask_mode,
+                scale=self.settings.fixed_point_scale,
+                n_workers=n_workers,
+                cache=self.key_cache,
+                participant_keys=participant_keys,
+            )
+            return MaskedInput(
+                user_id=user_id, masked_input=masked_input, manifest=manifest
+            )
+
         # generate the mask for the round 2 participants
         mask = create_mask(
             user_id=user_id,
@@ -125,11 +270,23 @@ class ClientProtocol:
             participants=participants,
             n_params=len(input),
             seed=seed,
+            prg=self.settings.prg,
+            n_workers=n_workers,
+            mode=self.settings.mask_mode,
+            cache=self.key_cache,
+            participant_keys=participant_keys,
         )
-        # add the mask to the input
-        masked_input = mask + input
+        # add the mask to the input, in the integer modes the input is fixed point encoded and the mask added mod 2^n
+        if self.settings.mask_mode == "float":
+            masked_input = mask + input
+        else:
+            masked_input = mask + encode_fixed_point(
+                input, self.settings.mask_mode, self.settings.fixed_point_scale
+            )
 
-        return MaskedInput(user_id=user_id, masked_input=list(masked_input))
+        return MaskedInput(
+            user_id=user_id, masked_input=masked_input, manifest=manifest
+        )
 
     def process_unmask_broadcast(
         self,
@@ -139,6 +296,8 @@ class ClientProtocol:
         unmask_broadcast: ServerUnmaskBroadCast,
         participants: List[BroadCastClientKeys],
         k: int = 3,
+        n_workers: int = 1,
+        executor: Executor = None,
     ) -> UnmaskShares:
         """
         Process the unmask broadcast from the server in round 3 of the protocol and generate the user unmask shares
@@ -151,6 +310,8 @@ class ClientProtocol:
         :param unmask_broadcast: the unmask broadcast received from the server in round 3
         :param participants: the participants and their public keys received from the server
         :param k: the minimum number of participants
+        :param n_workers: number of threads decrypting the ciphers
+        :param executor: optional executor to decrypt the ciphers with, takes precedence over n_workers
         :return: UnmaskShares to be sent to the server containing the seed shares and the sharing key shares
         according to the participants of the previous rounds.
         """
@@ -160,40 +321,51 @@ class ClientProtocol:
                 f"Not enough participants - ({len(unmask_broadcast.participants)}/{k})"
             )
 
+        participant_keys = self.participant_keys(participants)
+        participants = neighbourhood(user_id, participants, self.settings.graph_degree)
+
         # decrypt the encrypted ciphers received in round 2
         shares = self._decrypt_ciphers(
             user_id=user_id,
             keys=keys,
             participants=participants,
             ciphers=cipher_broadcast.ciphers,
+            cache=self.key_cache,
+            participant_keys=participant_keys,
+            n_workers=n_workers,
+            executor=executor,
         )
 
-        round_1_participants = set([p.client_id for p in participants])
-        round_2_participants = set([p.sender for p in cipher_broadcast.ciphers])
+        # users that submitted a masked input and the neighbours that dropped out before, built once for all shares
+        round_2_participants = {p.user_id for p in unmask_broadcast.participants}
+        dropped_participants = {
+            p.client_id for p in participants if p.client_id not in round_2_participants
+        }
 
         unmask_shares = UnmaskShares.construct(
             user_id=user_id, seed_shares=[], key_shares=[]
         )
         for share in shares:
-            # add decrypted key share to unmask shares if users dropped out before round 2
-            if (
-                share.sender in round_1_participants
-                and share.sender not in round_2_participants
-            ):
-                unmask_key_share = UnmaskKeyShare(
-                    user_id=share.sender, key_share=share.key_share
-                )
-                unmask_shares.key_shares.append(unmask_key_share)
-            # otherwise, add the seed share
+            # add the seed share of users whose masked input is part of the sum
             if share.sender in round_2_participants:
-                unmask_seed_share = UnmaskSeedShare(
+                unmask_seed_share = UnmaskSeedShare.construct(
                     user_id=share.sender, seed_share=share.seed_share
                 )
                 unmask_shares.seed_shares.append(unmask_seed_share)
+            # add decrypted key share to unmask shares if users dropped out before round 2, never both shares of
+            # the same user, otherwise its masked input could be unmasked
+            elif share.sender in dropped_participants:
+                unmask_key_share = UnmaskKeyShare.construct(
+                    user_id=share.sender, key_share=share.key_share
+                )
+                unmask_shares.key_shares.append(unmask_key_share)
             else:
                 raise ValueError(f"Unknown share sender {share.sender}")
-        # return validated shares
-        return UnmaskShares(**unmask_shares.dict())
+
+        # the round is finished for the client, the derived keys are no longer needed
+        self.key_cache.clear()
+        # the shares have been validated when the ciphers were decrypted
+        return unmask_shares
 
     @staticmethod
     def _decrypt_ciphers(
@@ -201,6 +373,10 @@ class ClientProtocol:
         keys: ClientKeys,
         ciphers: List[UserCipher],
         participants: List[BroadCastClientKeys],
+        cache: SharedKeyCache = None,
+        participant_keys: Dict[str, ParticipantKeys] = None,
+        n_workers: int = 1,
+        executor: Executor = None,
     ) -> List[Cipher]:
         """
         Decrypt the list of ciphers received from the server in round 2 using a symmetric key obtained via key
@@ -210,7 +386,11 @@ class ClientProtocol:
         :param keys: the key pair of the client matching the iteration of the protocol
         :param ciphers: a list of encrypted ciphers received from the server in round 2
         :param participants: the participants and their public keys received from the server
-        :return: a list of decrypted ciphers
+        :param cache: optional cache of derived shared keys
+        :param participant_keys: optional lookup table of the participants' parsed public keys
+        :param n_workers: number of threads decrypting the ciphers
+        :param executor: optional executor to decrypt the ciphers with, takes precedence over n_workers
+        :return: a list of decrypted ciphers, in the order of the encrypted ciphers
 
         """
 
@@ -220,28 +400,31 @@ class ClientProtocol:
                 f"Participants: {len(participants)}"
             )
 
-        decrypted_ciphers = []
-        for i, cipher in enumerate(ciphers):
+        # index the participants once to look up the senders
+        senders = {p.client_id: p for p in participants}
+        for cipher in ciphers:
             if cipher.receiver != user_id:
                 raise ValueError(
                     f"Cipher receiver must be the user id. Cipher receiver: {cipher.receiver}, user: {user_id}"
                 )
-            sender_broadcast = [
-                p for p in participants if p.client_id == cipher.sender
-            ][0]
-            sender_public_key = load_public_key(
-                sender_broadcast.broadcast.cipher_public_key
-            )
-            decrypted_cypher = decrypt_cipher(
+            if cipher.sender not in senders:
+                raise ValueError(f"Unknown cipher sender {cipher.sender}")
+
+        def _decrypt(cipher: UserCipher) -> Cipher:
+            sender_public_key = get_participant_keys(
+                senders[cipher.sender], participant_keys
+            ).cipher_public_key
+            return decrypt_cipher(
                 recipient=user_id,
                 recipient_key=keys.cipher_key,
                 sender_key=sender_public_key,
                 encrypted_cypher=cipher.cipher,
                 sender=cipher.sender,
+                cache=cache,
+                envelope=cipher.envelope,
             )
-            decrypted_ciphers.append(decrypted_cypher)
 
-        return decrypted_ciphers
+        return _map_ordered(_decrypt, ciphers, n_workers, executor)
 
     @staticmethod
     def share_keys(
@@ -249,6 +432,11 @@ class ClientProtocol:
         client_keys: ClientKeys,
         secret_shares: SecretShares,
         broadcast: ServerKeyBroadcast,
+        cache: SharedKeyCache = None,
+        participant_keys: Dict[str, ParticipantKeys] = None,
+        envelope: str = "fernet",
+        n_workers: int = 1,
+        executor: Executor = None,
     ) -> ShareKeysMessage:
         """
         Generate a key share message to be sent to the server. Containing encrypted ciphers for each of the other
@@ -259,37 +447,53 @@ class ClientProtocol:
         :param client_keys: the key pair of the client matching the iteration of the protocol
         :param secret_shares: secret shares of the private sharing key of the user and the user's private seed
         :param broadcast: key broadcast message received from the server
-        :return: ShareKeysMessage containing the encrypted ciphers for each other participant
+        :param cache: optional cache of derived shared keys
+        :param participant_keys: optional lookup table of the participants' parsed public keys
+        :param envelope: fernet or aes-gcm envelope of the encrypted ciphers
+        :param n_workers: number of threads encrypting the ciphers
+        :param executor: optional executor to encrypt the ciphers with, takes precedence over n_workers
+        :return: ShareKeysMessage containing the encrypted ciphers for each other participant, in the order of the
+            participants
         """
 
         if len(secret_shares.key_shares) != len(broadcast.participants):
             raise ValueError("Number of shares does not match number of participants")
 
-        ciphers = []
-        for key_share, seed_share, participant in zip(
-            secret_shares.key_shares, secret_shares.seed_shares, broadcast.participants
-        ):
-            # Skip generating the cypher for yourself
-            if participant.client_id == client_id:
-                pass
-            else:
-                # generate the encrypted cipher
-                cipher = generate_encrypted_cipher(
-                    sender=client_id,
-                    private_key=client_keys.cipher_key,
-                    recipient=participant.client_id,
-                    recipient_key=load_public_key(
-                        participant.broadcast.cipher_public_key
-                    ),
-                    seed_share=seed_share,
-                    key_share=key_share,
-                )
-                encrypted_cipher = EncryptedCipher(
-                    cipher=HexString(cipher), recipient=participant.client_id
-                )
-                ciphers.append(encrypted_cipher)
+        # Skip generating the cypher for yourself
+        recipients = [
+            (participant, key_share, seed_share)
+            for key_share, seed_share, participant in zip(
+                secret_shares.key_shares,
+                secret_shares.seed_shares,
+                broadcast.participants,
+            )
+            if participant.client_id != client_id
+        ]
+
+        def _encrypt(recipient) -> EncryptedCipher:
+            participant, key_share, seed_share = recipient
+            # generate the encrypted cipher
+            cipher = generate_encrypted_cipher(
+                sender=client_id,
+                private_key=client_keys.cipher_key,
+                recipient=participant.client_id,
+                recipient_key=get_participant_keys(
+                    participant, participant_keys
+                ).cipher_public_key,
+                seed_share=seed_share,
+                key_share=key_share,
+                cache=cache,
+                envelope=envelope,
+            )
+            # the cipher has been encoded by the envelope, no need to validate it again
+            return EncryptedCipher.construct(
+                cipher=cipher, recipient=participant.client_id, envelope=envelope
+            )
+
+        # the ciphers are encrypted concurrently in the order of the recipients
+        ciphers = _map_ordered(_encrypt, recipients, n_workers, executor)
 
-        return ShareKeysMessage(client_id=client_id, ciphers=ciphers)
+        return ShareKeysMessage.construct(client_id=client_id, ciphers=ciphers)
 
     @staticmethod
     def _validate_broadcast(broadcast: ServerKeyBroadcast):
@@ -1 +1 @@
-from .util import HexString  # noqa: F401
+from .util import Base64String, HexString, NumericVector, encode_array  # noqa: F401
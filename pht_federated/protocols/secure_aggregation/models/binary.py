@@ -0,0 +1,75 @@
+import json
+import struct
+from typing import ClassVar, Union
+
+import numpy as np
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+from pht_federated.protocols.secure_aggregation.models.util import (
+    ARRAY_ALIGNMENT,
+    encode_array_base64,
+    pack_array,
+    unpack_array,
+)
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+# header of a binary encoded message: magic and the length of the JSON encoded fields besides the array, which are
+# followed by the binary encoded array aligned to 8 bytes
+MESSAGE_MAGIC = b"PHTM"
+MESSAGE_HEADER = struct.Struct("<4sI")
+
+
+def base64_json_encoder(obj):
+    """
+    JSON encoder encoding numeric arrays in the base64 form instead of lists
+    """
+    if isinstance(obj, np.ndarray):
+        return encode_array_base64(obj)
+    return pydantic_encoder(obj)
+
+
+class BinaryArrayMessage(BaseModel):
+    """
+    Base class of messages carrying a large numeric vector. Besides JSON with the vector as list of numbers, the
+    messages can be transported as JSON with the vector as base64 encoded buffer or as binary message with the raw
+    little endian values, both of which are decoded without converting the values one by one.
+    """
+
+    array_field: ClassVar[str]
+
+    def base64_json(self, **kwargs) -> str:
+        """
+        Encode the message as JSON with the vector as base64 encoded buffer
+        """
+        return self.json(encoder=base64_json_encoder, **kwargs)
+
+    def binary(self) -> bytes:
+        """
+        Encode the message as binary message, the fields besides the vector are JSON encoded
+        :return: the binary message
+        """
+        fields = self.json(exclude={self.array_field}).encode("utf-8")
+        header = MESSAGE_HEADER.pack(MESSAGE_MAGIC, len(fields)) + fields
+        header += b"\0" * (-len(header) % ARRAY_ALIGNMENT)
+        return header + pack_array(np.asarray(getattr(self, self.array_field)))
+
+    @classmethod
+    def parse_binary(cls, buffer: Union[bytes, bytearray, memoryview]):
+        """
+        Decode a binary message, the vector is a view of the buffer
+        :param buffer: the binary message
+        :return: the decoded message
+        """
+        buffer = memoryview(buffer)
+        if len(buffer) < MESSAGE_HEADER.size:
+            raise ValueError("Buffer is too short to contain a message header")
+        magic, fields_length = MESSAGE_HEADER.unpack_from(buffer)
+        if magic != MESSAGE_MAGIC:
+            raise ValueError("Buffer does not contain a binary encoded message")
+
+        offset = MESSAGE_HEADER.size + fields_length
+        fields = json.loads(bytes(buffer[MESSAGE_HEADER.size : offset]))
+        offset += -offset % ARRAY_ALIGNMENT
+        fields[cls.array_field] = unpack_array(buffer[offset:])
+        return cls(**fields)
@@ -0,0 +1,137 @@
+from typing import Dict, List, Mapping, Tuple
+
+import numpy as np
+from pydantic import BaseModel, validator
+
+
+class ParameterBlock(BaseModel):
+    """
+    A named tensor of the protocol input, e.g. one entry of a model's state dict
+    """
+
+    name: str
+    shape: List[int]
+    dtype: str = "float64"
+
+    @validator("shape")
+    def validate_shape(cls, v):
+        if any(dim < 0 for dim in v):
+            raise ValueError(f"Block dimensions must not be negative, found {v}")
+        return v
+
+    @validator("dtype")
+    def validate_dtype(cls, v):
+        try:
+            dtype = np.dtype(v)
+        except TypeError:
+            raise ValueError(f"{v} is not a valid dtype")
+        if dtype.kind not in "fiu":
+            raise ValueError(f"Only numeric block dtypes allowed, found {v}")
+        return dtype.name
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64))
+
+
+class BlockManifest(BaseModel):
+    """
+    Layout of named parameter blocks in the flat vector that is masked and aggregated in one round of the protocol.
+    The blocks are stored at contiguous offsets in the order of the manifest.
+    """
+
+    blocks: List[ParameterBlock]
+
+    @validator("blocks")
+    def validate_unique_names(cls, v):
+        names = [block.name for block in v]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Block names must be unique, found {names}")
+        return v
+
+    @classmethod
+    def from_tensors(cls, tensors: Mapping[str, np.ndarray]) -> "BlockManifest":
+        """
+        Create the manifest of a dictionary of tensors, in the order of the dictionary
+        :param tensors: dictionary of named numeric arrays
+        :return: manifest of the tensors
+        """
+        blocks = []
+        for name, tensor in tensors.items():
+            tensor = np.asarray(tensor)
+            blocks.append(
+                ParameterBlock(
+                    name=name, shape=list(tensor.shape), dtype=tensor.dtype.name
+                )
+            )
+        return cls(blocks=blocks)
+
+    @property
+    def size(self) -> int:
+        return sum(block.size for block in self.blocks)
+
+    def offsets(self) -> List[Tuple[int, int]]:
+        """
+        Get the start and end offsets of the blocks in the flat vector
+        """
+        offsets = []
+        start = 0
+        for block in self.blocks:
+            offsets.append((start, start + block.size))
+            start += block.size
+        return offsets
+
+    def flatten(
+        self, tensors: Mapping[str, np.ndarray], out: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        Copy the tensors into a flat vector at the offsets of their blocks
+        :param tensors: dictionary of the named tensors of the manifest
+        :param out: optional buffer of the size of the manifest to copy the tensors to
+        :return: flat float64 vector containing all blocks
+        """
+        names = {block.name for block in self.blocks}
+        if set(tensors) != names:
+            raise ValueError(
+                f"Tensors {sorted(tensors)} do not match the blocks of the manifest {sorted(names)}"
+            )
+        if out is None:
+            out = np.empty(self.size, dtype=np.float64)
+        elif len(out) != self.size:
+            raise ValueError(
+                f"Buffer of size {len(out)} does not match the size of the manifest {self.size}"
+            )
+
+        for block, (start, end) in zip(self.blocks, self.offsets()):
+            tensor = np.asarray(tensors[block.name])
+            if list(tensor.shape) != block.shape:
+                raise ValueError(
+                    f"Tensor {block.name} of shape {list(tensor.shape)} does not match the block shape {block.shape}"
+                )
+            out[start:end] = tensor.reshape(-1)
+        return out
+
+    def unflatten(
+        self, values: np.ndarray, cast: bool = False
+    ) -> Dict[str, np.ndarray]:
+        """
+        Split a flat vector into the named tensors of the manifest. The tensors are views of the vector, unless they
+        are cast to the dtypes of the blocks.
+        :param values: flat vector of the size of the manifest
+        :param cast: whether to convert the tensors to the dtypes of the blocks, which copies blocks with a different
+            dtype than the vector
+        :return: dictionary of the named tensors in the order of the manifest
+        """
+        values = np.asarray(values)
+        if values.ndim != 1 or len(values) != self.size:
+            raise ValueError(
+                f"Vector of shape {values.shape} does not match the size of the manifest {self.size}"
+            )
+
+        tensors = {}
+        for block, (start, end) in zip(self.blocks, self.offsets()):
+            tensor = values[start:end].reshape(block.shape)
+            if cast:
+                tensor = tensor.astype(block.dtype, copy=False)
+            tensors[block.name] = tensor
+        return tensors
@@ -1,13 +1,12 @@
 from typing import List, Union
 
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.asymmetric.ec import (
     EllipticCurvePrivateKeyWithSerialization as ECPrivateKey,
 )
 from cryptography.hazmat.primitives.asymmetric.ec import (
     EllipticCurvePublicKeyWithSerialization as ECPubKey,
 )
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
 from pydantic import BaseModel
 
 from pht_federated.protocols.secure_aggregation.models import HexString
@@ -15,6 +14,20 @@ from pht_federated.protocols.secure_aggregation.models.client_messages import (
     ClientKeyBroadCast,
 )
 from pht_federated.protocols.secure_aggregation.secrets import create_key_shares
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    DEFAULT_CIPHER_SUITE,
+    PrivateKey,
+    PublicKey,
+    derive_private_key_from_seed,
+    generate_private_key,
+    key_cipher_suite,
+)
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    encode_public_key,
+    load_private_key,
+    serialize_private_key,
+    serialize_public_key,
+)
 
 
 class KeyShare(BaseModel):
@@ -31,17 +44,20 @@ class KeyShares(BaseModel):
 
 
 class ClientKeys:
-    cipher_key: ECPrivateKey
-    sharing_key: ECPrivateKey
+    cipher_key: PrivateKey
+    sharing_key: PrivateKey
     signing_key: ECPrivateKey = None
     verification_keys: List[ECPubKey] = None  # todo this needs certificates
+    sharing_key_seed: bytes = None
 
     def __init__(
         self,
-        cipher_key: Union[ECPrivateKey, str] = None,
-        sharing_key: Union[ECPrivateKey, str] = None,
+        cipher_key: Union[PrivateKey, str] = None,
+        sharing_key: Union[PrivateKey, str] = None,
         signing_key: Union[ECPrivateKey, str] = None,
         verification_keys: List[Union[ECPubKey, str]] = None,
+        cipher_suite: str = DEFAULT_CIPHER_SUITE,
+        sharing_key_seed: Union[bytes, str] = None,
     ):
 
         # validate signing and verification key arguments
@@ -58,21 +74,47 @@ class ClientKeys:
 
         # validate/generate cipher key
         if not cipher_key:
-            self.cipher_key = self._generate_private_key()
+            self.cipher_key = self._generate_private_key(cipher_suite)
         else:
             self.cipher_key = self._process_key_parameter(cipher_key)
 
         # validate/generate sharing key
-        if not sharing_key:
-            self.sharing_key = self._generate_private_key()
+        if sharing_key_seed:
+            if sharing_key:
+                raise ValueError(
+                    "Either a sharing key or a sharing key seed can be given"
+                )
+            if isinstance(sharing_key_seed, str):
+                sharing_key_seed = bytes.fromhex(sharing_key_seed)
+            self.sharing_key_seed = sharing_key_seed
+            self.sharing_key = derive_private_key_from_seed(
+                sharing_key_seed, key_cipher_suite(self.cipher_key)
+            )
+        elif not sharing_key:
+            self.sharing_key = self._generate_private_key(cipher_suite)
         else:
             self.sharing_key = self._process_key_parameter(sharing_key)
 
-    def key_broadcast(self) -> ClientKeyBroadCast:
+        # the suite of the keys, given keys take precedence over the cipher suite argument
+        self.cipher_suite = key_cipher_suite(self.cipher_key)
+        if key_cipher_suite(self.sharing_key) != self.cipher_suite:
+            raise ValueError("Cipher and sharing key must use the same cipher suite")
+
+    def key_broadcast(self, key_encoding: str = "hex") -> ClientKeyBroadCast:
+        """
+        Create the broadcast message containing the public keys
+        :param key_encoding: hex or compact encoding of the public keys
+        :return:
+        """
 
         broadcast_dict = {
-            "cipher_public_key": self.hex_cipher_key_public,
-            "sharing_public_key": self.hex_sharing_key_public,
+            "cipher_public_key": encode_public_key(
+                self.cipher_key_public, key_encoding
+            ),
+            "sharing_public_key": encode_public_key(
+                self.sharing_key_public, key_encoding
+            ),
+            "key_encoding": key_encoding,
         }
         if self.signing_key and self.verification_keys:
             # todo
@@ -86,14 +128,12 @@ class ClientKeys:
         shares = create_key_shares(self.hex_sharing_key, n, k)
         return shares
 
-    def _process_key_parameter(
-        self, input_key: Union[ECPrivateKey, str]
-    ) -> ECPrivateKey:
+    def _process_key_parameter(self, input_key: Union[PrivateKey, str]) -> PrivateKey:
         # parse from hex string
         if isinstance(input_key, str):
             return self._load_private_key_from_hex(input_key)
         # return instance directly
-        elif isinstance(input_key, ECPrivateKey):
+        elif isinstance(input_key, (ECPrivateKey, X25519PrivateKey)):
             return input_key
         else:
             raise ValueError(f"Invalid key format: {type(input_key)}")
@@ -106,6 +146,12 @@ class ClientKeys:
     def hex_sharing_key(self) -> str:
         return self._serialize_private_key_to_hex(self.sharing_key)
 
+    @property
+    def hex_sharing_key_seed(self) -> str:
+        if self.sharing_key_seed is None:
+            raise ValueError("The sharing key was not derived from a seed")
+        return self.sharing_key_seed.hex()
+
     @property
     def hex_cipher_key(self) -> str:
         return self._serialize_private_key_to_hex(self.cipher_key)
@@ -115,11 +161,11 @@ class ClientKeys:
         return self.signing_key.public_key()
 
     @property
-    def sharing_key_public(self) -> ECPubKey:
+    def sharing_key_public(self) -> PublicKey:
         return self.sharing_key.public_key()
 
     @property
-    def cipher_key_public(self) -> ECPubKey:
+    def cipher_key_public(self) -> PublicKey:
         return self.cipher_key.public_key()
 
     @property
@@ -135,27 +181,19 @@ class ClientKeys:
         return self._serialize_public_key_to_hex(self.cipher_key_public)
 
     @staticmethod
-    def _generate_private_key() -> ECPrivateKey:
-        return ec.generate_private_key(ec.SECP384R1())
+    def _generate_private_key(
+        cipher_suite: str = DEFAULT_CIPHER_SUITE,
+    ) -> PrivateKey:
+        return generate_private_key(cipher_suite)
 
     @staticmethod
-    def _load_private_key_from_hex(key: str):
-        private_key = serialization.load_pem_private_key(
-            bytes.fromhex(key), password=None
-        )
-        return private_key
+    def _load_private_key_from_hex(key: str) -> PrivateKey:
+        return load_private_key(key)
 
     @staticmethod
-    def _serialize_private_key_to_hex(key: ECPrivateKey) -> str:
-        return key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption(),
-        ).hex()
+    def _serialize_private_key_to_hex(key: PrivateKey) -> str:
+        return serialize_private_key(key)
 
     @staticmethod
-    def _serialize_public_key_to_hex(key: ECPubKey) -> str:
-        return key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo,
-        ).hex()
+    def _serialize_public_key_to_hex(key: PublicKey) -> str:
+        return serialize_public_key(key)
@@ -1,24 +1,33 @@
-from typing import List, Optional
+from typing import ClassVar, List, Optional
 
+import numpy as np
 from pydantic import BaseModel
 
+from pht_federated.protocols.secure_aggregation.models import (
+    NumericVector,
+    encode_array,
+)
+from pht_federated.protocols.secure_aggregation.models.binary import BinaryArrayMessage
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
 from pht_federated.protocols.secure_aggregation.models.secrets import (
     EncryptedCipher,
     KeyShare,
     SeedShare,
 )
+from pht_federated.protocols.secure_aggregation.models.settings import KeyEncoding
 
 
 class ClientKeyBroadCast(BaseModel):
     """
     The client key broadcast message is sent by the client to the server.
     The client broadcasts the public keys and an optional signature of the public keys.
-    Keys are encoded in hex format
+    Keys are encoded in hex format or in the compact base64 format
     """
 
     cipher_public_key: str
     sharing_public_key: str
     signature: Optional[str] = None
+    key_encoding: KeyEncoding = "hex"
 
     class Config:
         orm_mode = True
@@ -33,14 +42,21 @@ class ShareKeysMessage(BaseModel):
     ciphers: List[EncryptedCipher]
 
 
-class MaskedInput(BaseModel):
+class MaskedInput(BinaryArrayMessage):
     """
     The masked input message is sent by the client to the server.
-    The client sends the masked input to the server.
+    The client sends the masked input to the server. Float values or ring elements depending on the masking mode.
+    If the input consists of multiple named tensors, the manifest describes their layout in the masked input.
     """
 
+    array_field: ClassVar[str] = "masked_input"
+
     user_id: str
-    masked_input: List[float]
+    masked_input: NumericVector
+    manifest: Optional[BlockManifest] = None
+
+    class Config:
+        json_encoders = {np.ndarray: encode_array}
 
 
 class UnmaskKeyShare(BaseModel):
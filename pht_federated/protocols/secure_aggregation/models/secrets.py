@@ -1,9 +1,10 @@
 from typing import List
 
 import numpy as np
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
-from pht_federated.protocols.secure_aggregation.models import HexString
+from pht_federated.protocols.secure_aggregation.models import Base64String, HexString
+from pht_federated.protocols.secure_aggregation.models.settings import CipherEnvelope
 
 
 class KeyShare(BaseModel):
@@ -40,13 +41,25 @@ class Cipher(BaseModel):
     key_share: KeyShare
 
 
+def validate_encrypted_cipher(v, values) -> str:
+    """
+    Validate the encoding of an encrypted cipher, hex for fernet and base64 for AES-GCM envelopes
+    """
+    if values.get("envelope") == "aes-gcm":
+        return Base64String.validate(v)
+    return HexString.validate(v)
+
+
 class EncryptedCipher(BaseModel):
     """
     An encrypted cipher for a participant
     """
 
     recipient: str
-    cipher: HexString
+    envelope: CipherEnvelope = "fernet"
+    cipher: str
+
+    _validate_cipher = validator("cipher", allow_reuse=True)(validate_encrypted_cipher)
 
 
 class SharedMask(BaseModel):
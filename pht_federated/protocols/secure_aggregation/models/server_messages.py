@@ -1,12 +1,23 @@
 import uuid
-from typing import List, Optional, Union
+from typing import ClassVar, Dict, List, Optional, Union
 
-from pydantic import BaseModel
+import numpy as np
+from pydantic import BaseModel, validator
 
-from pht_federated.protocols.secure_aggregation.models import HexString
+from pht_federated.protocols.secure_aggregation.models import (
+    HexString,
+    NumericVector,
+    encode_array,
+)
+from pht_federated.protocols.secure_aggregation.models.binary import BinaryArrayMessage
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
 from pht_federated.protocols.secure_aggregation.models.client_messages import (
     ClientKeyBroadCast,
 )
+from pht_federated.protocols.secure_aggregation.models.secrets import (
+    validate_encrypted_cipher,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import CipherEnvelope
 
 
 class BroadCastClientKeys(BaseModel):
@@ -31,7 +42,10 @@ class UserCipher(BaseModel):
 
     sender: Union[int, str]
     receiver: Union[int, str]
-    cipher: HexString
+    envelope: CipherEnvelope = "fernet"
+    cipher: str
+
+    _validate_cipher = validator("cipher", allow_reuse=True)(validate_encrypted_cipher)
 
 
 class ServerCipherBroadcast(BaseModel):
@@ -55,9 +69,25 @@ class ServerUnmaskBroadCast(BaseModel):
     participants: List[Round4Participant]
 
 
-class AggregatedParameters(BaseModel):
+class AggregatedParameters(BinaryArrayMessage):
     """
     Broadcast the aggregated parameters of the protocol to the users
     """
 
-    params: List[float]
+    array_field: ClassVar[str] = "params"
+
+    params: NumericVector
+    manifest: Optional[BlockManifest] = None
+
+    def blocks(self, cast: bool = False) -> Dict[str, np.ndarray]:
+        """
+        Split the aggregated parameters into the named tensors of the manifest, as views of the parameters
+        :param cast: whether to convert the tensors to the dtypes of the blocks
+        :return: dictionary of the named aggregated tensors
+        """
+        if self.manifest is None:
+            raise ValueError("The aggregated parameters have no block manifest")
+        return self.manifest.unflatten(np.asarray(self.params), cast=cast)
+
+    class Config:
+        json_encoders = {np.ndarray: encode_array}
@@ -0,0 +1,43 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field
+
+# pseudo random generators available for expanding seeds into masks
+PRGEngine = Literal["mt19937", "pcg64", "philox", "aes-ctr"]
+# key agreement suite of the cipher and sharing keys
+CipherSuite = Literal["secp384r1", "x25519"]
+# encoding of the public keys in the key broadcasts, hex encoded PEM/raw keys or base64 encoded compressed points/raw
+# keys
+KeyEncoding = Literal["hex", "compact"]
+# secret shared to recover the sharing key of dropped clients, the serialized sharing key itself or the 32 byte seed the
+# sharing key is derived from
+KeySharing = Literal["key", "seed"]
+# encryption of the ciphers exchanged in round 2, hex encoded fernet tokens of the JSON cipher or base64 encoded AES-GCM
+# encrypted binary ciphers
+CipherEnvelope = Literal["fernet", "aes-gcm"]
+# float masks or masks over the integer rings mod 2^32 / 2^64 with fixed point encoded inputs
+MaskMode = Literal["float", "uint32", "uint64"]
+# shamir secret sharing over GF(2^128) with pycryptodome or vectorized over a prime field with numpy
+ShamirEngine = Literal["pycryptodome", "numpy"]
+
+
+class SecureAggregationSettings(BaseModel):
+    """
+    Settings of a secure aggregation protocol. Clients and server need to use the same settings, otherwise the masks
+    will not cancel out in the aggregated sum.
+    """
+
+    cipher_suite: CipherSuite = "secp384r1"
+    key_encoding: KeyEncoding = "hex"
+    key_sharing: KeySharing = "key"
+    cipher_envelope: CipherEnvelope = "fernet"
+    prg: PRGEngine = "mt19937"
+    mask_mode: MaskMode = "float"
+    fixed_point_scale: float = 2**16
+    shamir_engine: ShamirEngine = "pycryptodome"
+    # number of neighbours of each client in the communication graph, masks, secret shares and ciphers are only
+    # exchanged between neighbours. None for the complete graph.
+    graph_degree: Optional[int] = Field(None, ge=1)
+    # minimum number of key shares needed to recover the sharing key of a dropped client, has to match the threshold
+    # k the clients split their secrets with
+    threshold: int = Field(3, ge=1)
@@ -1,6 +1,23 @@
+import base64
+import binascii
+import struct
+from typing import Union
+
+import numpy as np
+
+# header of a binary encoded array: magic, length of the dtype string, number of dimensions, followed by the dtype
+# string, the shape and the raw little endian values aligned to 8 bytes
+ARRAY_MAGIC = b"PHTA"
+ARRAY_HEADER = struct.Struct("<4sBB")
+ARRAY_ALIGNMENT = 8
+# keys of the base64 encoded JSON form of an array
+BASE64_ARRAY_KEYS = {"dtype", "shape", "data"}
+
+
 class HexString(str):
     """
-    A byte string that is hex-encoded.
+    A byte string that is hex-encoded. The bytes decoded while validating the string are kept, so they are only
+    decoded once.
     """
 
     @classmethod
@@ -9,17 +26,188 @@ class HexString(str):
 
     @classmethod
     def validate(cls, v):
-        if not isinstance(v, str) or isinstance(v, bytes):
+        # already validated or created from bytes, instances created directly from a string are validated again
+        if isinstance(v, cls) and "_bytes" in v.__dict__:
+            return v
+        if isinstance(v, bytes):
+            return cls.from_bytes(v)
+        if not isinstance(v, str):
             raise ValueError(f"{v} only string and byte values allowed as input")
 
-        if isinstance(v, str):
-            try:
-                bytes.fromhex(v)
-                return cls(v)
-            except ValueError:
-                raise ValueError(f"{v} is not a valid hex string")
+        try:
+            value = bytes.fromhex(v)
+        except ValueError:
+            raise ValueError(f"{v} is not a valid hex string")
+        hex_string = cls(v)
+        hex_string._bytes = value
+        return hex_string
+
+    @classmethod
+    def from_bytes(cls, value: bytes) -> "HexString":
+        """
+        Create the hex string of a byte string, without decoding it again later
+        """
+        hex_string = cls(value.hex())
+        hex_string._bytes = bytes(value)
+        return hex_string
+
+    def get_bytes(self):
+        value = self.__dict__.get("_bytes")
+        if value is None:
+            value = self._bytes = bytes.fromhex(self)
+        return value
+
+
+class Base64String(str):
+    """
+    A byte string that is base64-encoded.
+    """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
         if isinstance(v, bytes):
-            return cls(v.hex())
+            return cls(base64.b64encode(v).decode("ascii"))
+        if not isinstance(v, str):
+            raise ValueError(f"{v} only string and byte values allowed as input")
+        try:
+            base64.b64decode(v, validate=True)
+            return cls(v)
+        except (binascii.Error, ValueError):
+            raise ValueError(f"{v} is not a valid base64 string")
 
     def get_bytes(self):
-        return bytes.fromhex(self)
+        return base64.b64decode(self)
+
+
+class NumericVector(list):
+    """
+    A list of numbers. Lists of integers, e.g. masked inputs in the integer ring masking modes, are kept as exact
+    python ints, otherwise all values are converted to floats. One dimensional numeric arrays are kept as contiguous
+    arrays without conversion, they are only converted to lists when serialized to JSON.
+    """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
+        if isinstance(v, dict) and set(v) == BASE64_ARRAY_KEYS:
+            v = decode_array_base64(v)
+        if isinstance(v, np.ndarray):
+            if v.ndim != 1 or not np.issubdtype(v.dtype, np.number):
+                raise ValueError(
+                    f"Only one dimensional numeric arrays allowed, found {v.dtype} array of shape {v.shape}"
+                )
+            return np.ascontiguousarray(v)
+
+        if not isinstance(v, (list, tuple)):
+            raise ValueError(f"{type(v)} only lists of numbers allowed as input")
+
+        if all(isinstance(x, int) and not isinstance(x, bool) for x in v):
+            return cls(v)
+        try:
+            return cls(float(x) for x in v)
+        except (TypeError, ValueError):
+            raise ValueError("Vector contains non numeric values")
+
+
+def encode_array(array: np.ndarray) -> list:
+    """
+    JSON encoder of numeric arrays
+    """
+    return array.tolist()
+
+
+def pack_array(array: np.ndarray) -> bytes:
+    """
+    Encode a numeric array as raw little endian buffer with a dtype and shape header
+    :param array: numeric array
+    :return: binary encoded array
+    """
+    array = np.asarray(array)
+    _check_array_dtype(array.dtype)
+    dtype = array.dtype.newbyteorder("<")
+    dtype_str = dtype.str.encode("ascii")
+
+    header = ARRAY_HEADER.pack(ARRAY_MAGIC, len(dtype_str), array.ndim)
+    header += dtype_str + struct.pack(f"<{array.ndim}Q", *array.shape)
+    header += b"\0" * (-len(header) % ARRAY_ALIGNMENT)
+    return header + np.ascontiguousarray(array, dtype=dtype).tobytes()
+
+
+def unpack_array(buffer: Union[bytes, bytearray, memoryview]) -> np.ndarray:
+    """
+    Decode a binary encoded array without copying the values, the array is a view of the buffer
+    :param buffer: binary encoded array
+    :return: the decoded array, read only if the buffer is immutable
+    """
+    buffer = memoryview(buffer)
+    if len(buffer) < ARRAY_HEADER.size:
+        raise ValueError("Buffer is too short to contain an array header")
+    magic, dtype_length, ndim = ARRAY_HEADER.unpack_from(buffer)
+    if magic != ARRAY_MAGIC:
+        raise ValueError("Buffer does not contain a binary encoded array")
+
+    offset = ARRAY_HEADER.size
+    try:
+        dtype = np.dtype(bytes(buffer[offset : offset + dtype_length]).decode("ascii"))
+    except (TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid dtype in array header")
+    _check_array_dtype(dtype)
+    offset += dtype_length
+    if len(buffer) < offset + 8 * ndim:
+        raise ValueError("Buffer is too short to contain the array shape")
+    shape = struct.unpack_from(f"<{ndim}Q", buffer, offset)
+    offset += 8 * ndim
+    offset += -offset % ARRAY_ALIGNMENT
+
+    count = int(np.prod(shape, dtype=np.int64))
+    if len(buffer) != offset + count * dtype.itemsize:
+        raise ValueError(
+            f"Buffer of {len(buffer) - offset} bytes does not match the array of shape {shape} and dtype {dtype}"
+        )
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def encode_array_base64(array: np.ndarray) -> dict:
+    """
+    JSON encoder of numeric arrays as base64 encoded little endian buffer, an alternative to lists for large arrays
+    """
+    array = np.asarray(array)
+    _check_array_dtype(array.dtype)
+    dtype = array.dtype.newbyteorder("<")
+    return {
+        "dtype": dtype.str,
+        "shape": list(array.shape),
+        "data": base64.b64encode(np.ascontiguousarray(array, dtype=dtype)).decode(
+            "ascii"
+        ),
+    }
+
+
+def decode_array_base64(encoded: dict) -> np.ndarray:
+    """
+    Decode an array in the base64 encoded JSON form, the array is a view of the decoded bytes
+    """
+    try:
+        dtype = np.dtype(encoded["dtype"])
+        shape = tuple(int(dim) for dim in encoded["shape"])
+        data = base64.b64decode(encoded["data"], validate=True)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError("Invalid base64 encoded array")
+    _check_array_dtype(dtype)
+    if len(data) != int(np.prod(shape, dtype=np.int64)) * dtype.itemsize:
+        raise ValueError(
+            f"Buffer of {len(data)} bytes does not match the array of shape {shape} and dtype {dtype}"
+        )
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+def _check_array_dtype(dtype: np.dtype):
+    if dtype.kind not in "fiu":
+        raise ValueError(f"Only numeric arrays can be encoded, found {dtype}")
@@ -1,6 +1,10 @@
 import base64
+import os
+import struct
 
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.asymmetric.ec import (
     EllipticCurvePrivateKeyWithSerialization as ECPrivateKey,
 )
@@ -8,15 +12,25 @@ from cryptography.hazmat.primitives.asymmetric.ec import (
     EllipticCurvePublicKeyWithSerialization as ECPubKey,
 )
 
+from pht_federated.protocols.secure_aggregation.models import HexString
 from pht_federated.protocols.secure_aggregation.models.secrets import (
     Cipher,
     KeyShare,
     SeedShare,
 )
 from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    SharedKeyCache,
     derive_shared_key,
 )
 
+CIPHER_ENVELOPES = ("fernet", "aes-gcm")
+GCM_NONCE_BYTES = 12
+# header of a packed cipher: length of the sender and recipient ids, shamir index of the key and seed share, length of
+# the seed share and number of key share segments
+CIPHER_HEADER = struct.Struct("<HHIIHH")
+# length of the segments of the key shares
+SEGMENT_BYTES = 16
+
 
 def generate_encrypted_cipher(
     sender: str,
@@ -25,6 +39,8 @@ def generate_encrypted_cipher(
     recipient_key: ECPubKey,
     key_share: KeyShare,
     seed_share: SeedShare,
+    cache: SharedKeyCache = None,
+    envelope: str = "fernet",
 ) -> str:
     """
     Create an encrypted cipher for the recipient. The cipher contains the recipient's secret shares of the sender's
@@ -37,13 +53,13 @@ def generate_encrypted_cipher(
     :param recipient_key: public key of the recipient
     :param key_share: a shamir share of the private sharing key addressed to the recipient
     :param seed_share: a shamir share of the random seed addressed to the recipient
-    :return: the encrypted serialized cipher in hex format
+    :param cache: optional cache of derived shared keys
+    :param envelope: fernet to encrypt the JSON cipher with fernet, aes-gcm to encrypt the packed binary cipher with
+        AES-GCM
+    :return: the encrypted serialized cipher in hex format for fernet and base64 format for aes-gcm envelopes
     """
     # derive the shared key with the public key of the recipient and private key of the sender
-    secret = derive_shared_key(private_key, recipient_key)
-
-    # Setup fernet with the key for symmetric encryption
-    fernet = Fernet(base64.b64encode(secret))
+    secret = derive_shared_key(private_key, recipient_key, cache=cache)
 
     # Set up the cipher and encrypt it
     cipher = Cipher(
@@ -52,6 +68,20 @@ def generate_encrypted_cipher(
         key_share=key_share,
         seed_share=seed_share,
     )
+
+    if envelope == "aes-gcm":
+        nonce = os.urandom(GCM_NONCE_BYTES)
+        encrypted_cypher = nonce + AESGCM(secret).encrypt(
+            nonce, pack_cipher(cipher), None
+        )
+        return base64.b64encode(encrypted_cypher).decode("ascii")
+    elif envelope != "fernet":
+        raise ValueError(
+            f"Unknown cipher envelope: {envelope}, available: {CIPHER_ENVELOPES}"
+        )
+
+    # Setup fernet with the key for symmetric encryption
+    fernet = Fernet(base64.b64encode(secret))
     cypher_bytes = cipher.json().encode("utf-8")
     encrypted_cypher = fernet.encrypt(cypher_bytes)
     del fernet
@@ -65,6 +95,8 @@ def decrypt_cipher(
     sender: str,
     sender_key: ECPubKey,
     encrypted_cypher: str,
+    cache: SharedKeyCache = None,
+    envelope: str = "fernet",
 ) -> Cipher:
     """
     Decrypts an encrypted cipher received from a peer via the server. The cipher is decrypted with a symmetric Fernet
@@ -75,21 +107,39 @@ def decrypt_cipher(
     :param recipient_key: the private key of the recipient
     :param sender: the user id of the sender
     :param sender_key: the public key of the sender
-    :param encrypted_cypher: the cipher encrypted by the sender for the recipient, in HEX format
+    :param encrypted_cypher: the cipher encrypted by the sender for the recipient, in HEX format for fernet and base64
+        format for aes-gcm envelopes
+    :param cache: optional cache of derived shared keys
+    :param envelope: fernet or aes-gcm, the envelope the cipher was encrypted with
     :return: the decrypted cipher
 
     """
     # derive the shared key with the public key of the recipient and private key of the sender
-    secret = derive_shared_key(recipient_key, sender_key)
+    secret = derive_shared_key(recipient_key, sender_key, cache=cache)
 
-    # Setup fernet with the key for symmetric encryption
-    fernet = Fernet(base64.b64encode(secret))
+    if envelope == "aes-gcm":
+        cypher_bytes = base64.b64decode(encrypted_cypher)
+        nonce = cypher_bytes[:GCM_NONCE_BYTES]
+        try:
+            cypher_bytes = AESGCM(secret).decrypt(
+                nonce, cypher_bytes[GCM_NONCE_BYTES:], None
+            )
+        except InvalidTag:
+            raise ValueError("Cipher could not be decrypted")
+        cipher = unpack_cipher(cypher_bytes)
+    elif envelope == "fernet":
+        # Setup fernet with the key for symmetric encryption
+        fernet = Fernet(base64.b64encode(secret))
 
-    # Decrypt the cypher
-    cypher_bytes = bytes.fromhex(encrypted_cypher)
-    cypher_bytes = fernet.decrypt(cypher_bytes)
-    # Parse the cypher
-    cipher = Cipher.parse_raw(cypher_bytes)
+        # Decrypt the cypher
+        cypher_bytes = bytes.fromhex(encrypted_cypher)
+        cypher_bytes = fernet.decrypt(cypher_bytes)
+        # Parse the cypher
+        cipher = Cipher.parse_raw(cypher_bytes)
+    else:
+        raise ValueError(
+            f"Unknown cipher envelope: {envelope}, available: {CIPHER_ENVELOPES}"
+        )
     # Check that the cypher is valid
     if not cipher.recipient == recipient:
         raise ValueError("Cipher recipient does not match the recipient")
@@ -97,3 +147,80 @@ def decrypt_cipher(
         raise ValueError("Cipher sender does not match the sender")
 
     return cipher
+
+
+def pack_cipher(cipher: Cipher) -> bytes:
+    """
+    Pack a cipher into its binary representation, a fixed size header followed by the utf-8 encoded sender and
+    recipient ids, the seed share and the segments of the key share
+    :param cipher: the cipher to pack
+    :return:
+    """
+    sender = cipher.sender.encode("utf-8")
+    recipient = cipher.recipient.encode("utf-8")
+    seed = cipher.seed_share.seed.get_bytes()
+    segments = [segment.get_bytes() for segment in cipher.key_share.segments]
+    if any(len(segment) != SEGMENT_BYTES for segment in segments):
+        raise ValueError(f"Key share segments must be {SEGMENT_BYTES} bytes long")
+
+    header = CIPHER_HEADER.pack(
+        len(sender),
+        len(recipient),
+        cipher.key_share.shamir_index,
+        cipher.seed_share.shamir_index,
+        len(seed),
+        len(segments),
+    )
+    return b"".join([header, sender, recipient, seed, *segments])
+
+
+def unpack_cipher(cipher_bytes: bytes) -> Cipher:
+    """
+    Parse a cipher from its binary representation
+    :param cipher_bytes: the packed cipher
+    :return:
+    """
+    try:
+        (
+            sender_length,
+            recipient_length,
+            key_index,
+            seed_index,
+            seed_length,
+            n_segments,
+        ) = CIPHER_HEADER.unpack_from(cipher_bytes)
+    except struct.error:
+        raise ValueError("Invalid cipher header")
+
+    expected_length = (
+        CIPHER_HEADER.size
+        + sender_length
+        + recipient_length
+        + seed_length
+        + n_segments * SEGMENT_BYTES
+    )
+    if len(cipher_bytes) != expected_length:
+        raise ValueError(
+            f"Invalid cipher length {len(cipher_bytes)}, expected {expected_length}"
+        )
+
+    view = memoryview(cipher_bytes)
+    offset = CIPHER_HEADER.size
+    sender = bytes(view[offset : offset + sender_length]).decode("utf-8")
+    offset += sender_length
+    recipient = bytes(view[offset : offset + recipient_length]).decode("utf-8")
+    offset += recipient_length
+    seed = HexString.from_bytes(view[offset : offset + seed_length])
+    offset += seed_length
+    segments = [
+        HexString.from_bytes(view[start : start + SEGMENT_BYTES])
+        for start in range(offset, len(cipher_bytes), SEGMENT_BYTES)
+    ]
+
+    # the fields have been validated while unpacking
+    return Cipher.construct(
+        sender=sender,
+        recipient=recipient,
+        seed_share=SeedShare.construct(shamir_index=seed_index, seed=seed),
+        key_share=KeyShare.construct(shamir_index=key_index, segments=segments),
+    )
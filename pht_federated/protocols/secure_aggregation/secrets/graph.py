@@ -0,0 +1,65 @@
+from typing import List, Optional
+
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+
+
+def neighbourhood(
+    client_id: str,
+    participants: List[BroadCastClientKeys],
+    degree: Optional[int] = None,
+) -> List[BroadCastClientKeys]:
+    """
+    Get the neighbourhood of a client in the communication graph of a protocol round, consisting of the client itself
+    and the participants it shares masks, secret shares and ciphers with. The graph is a circulant graph derived from
+    the order of the participants in the server key broadcast, each participant is connected to the ceil(degree / 2)
+    participants before and after it in the list (wrapping around at the ends).
+
+    :param client_id: the id of the client
+    :param participants: the participants of the round as broadcast by the server
+    :param degree: number of neighbours of each participant, if None or at least the number of other participants the
+        graph is complete
+    :return: the client and its neighbours in the order of the participant list
+    """
+    n = len(participants)
+    if degree is None or degree >= n - 1:
+        return list(participants)
+    if degree < 1:
+        raise ValueError(f"Graph degree must be at least 1, found {degree}")
+
+    index = _participant_index(client_id, participants)
+
+    half_degree = (degree + 1) // 2
+    indices = {index}
+    for offset in range(1, half_degree + 1):
+        indices.add((index + offset) % n)
+        indices.add((index - offset) % n)
+
+    return [participants[i] for i in sorted(indices)]
+
+
+def neighbours(
+    client_id: str,
+    participants: List[BroadCastClientKeys],
+    degree: Optional[int] = None,
+) -> List[BroadCastClientKeys]:
+    """
+    Get the neighbours of a client in the communication graph, excluding the client itself
+    :param client_id: the id of the client
+    :param participants: the participants of the round as broadcast by the server
+    :param degree: number of neighbours of each participant, None for the complete graph
+    :return: the neighbours of the client in the order of the participant list
+    """
+    return [
+        participant
+        for participant in neighbourhood(client_id, participants, degree)
+        if participant.client_id != client_id
+    ]
+
+
+def _participant_index(client_id: str, participants: List[BroadCastClientKeys]) -> int:
+    for i, participant in enumerate(participants):
+        if participant.client_id == client_id:
+            return i
+    raise ValueError(f"Client {client_id} is not a participant of the round")
@@ -1,30 +1,235 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.asymmetric.ec import (
     EllipticCurvePrivateKey,
     EllipticCurvePublicKey,
 )
+from cryptography.hazmat.primitives.asymmetric.x25519 import (
+    X25519PrivateKey,
+    X25519PublicKey,
+)
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+# key agreement suites, SECP384R1 keys are serialized as PEM and X25519 keys as raw 32 byte keys
+CIPHER_SUITES = ("secp384r1", "x25519")
+DEFAULT_CIPHER_SUITE = "secp384r1"
+# byte length of the secret seeds the sharing keys can be derived from
+KEY_SEED_BYTES = 32
+# order of the SECP384R1 base point
+SECP384R1_ORDER = int(
+    "ffffffffffffffffffffffffffffffffffffffffffffffffc7634d81f4372ddf581a0db248b0a77aecec196accc52973",
+    16,
+)
+
+PrivateKey = Union[EllipticCurvePrivateKey, X25519PrivateKey]
+PublicKey = Union[EllipticCurvePublicKey, X25519PublicKey]
+
+
+def generate_private_key(cipher_suite: str = DEFAULT_CIPHER_SUITE) -> PrivateKey:
+    """
+    Generate a new private key for the given cipher suite
+    :param cipher_suite: secp384r1 or x25519
+    :return:
+    """
+    if cipher_suite == "secp384r1":
+        return ec.generate_private_key(ec.SECP384R1())
+    elif cipher_suite == "x25519":
+        return X25519PrivateKey.generate()
+    else:
+        raise ValueError(
+            f"Unknown cipher suite: {cipher_suite}, available: {CIPHER_SUITES}"
+        )
+
+
+def generate_key_seed() -> str:
+    """
+    Generate a random hex encoded seed to derive a private key from
+    """
+    return os.urandom(KEY_SEED_BYTES).hex()
+
+
+def derive_private_key_from_seed(
+    seed: bytes, cipher_suite: str = DEFAULT_CIPHER_SUITE
+) -> PrivateKey:
+    """
+    Deterministically derive a private key from a secret seed. X25519 keys use the seed as private bytes, SECP384R1
+    keys are derived from the seed expanded with HKDF.
+    :param seed: secret seed of KEY_SEED_BYTES bytes
+    :param cipher_suite: secp384r1 or x25519
+    :return:
+    """
+    if len(seed) != KEY_SEED_BYTES:
+        raise ValueError(
+            f"Key seed must be {KEY_SEED_BYTES} bytes long. Found length {len(seed)}."
+        )
+    if cipher_suite == "x25519":
+        return X25519PrivateKey.from_private_bytes(seed)
+    elif cipher_suite == "secp384r1":
+        # expand to 64 bytes so reducing modulo the group order introduces no noticeable bias
+        expanded = HKDF(
+            algorithm=hashes.SHA256(),
+            length=64,
+            salt=None,
+            info=b"secp384r1 sharing key",
+        ).derive(seed)
+        private_value = int.from_bytes(expanded, "big") % (SECP384R1_ORDER - 1) + 1
+        return ec.derive_private_key(private_value, ec.SECP384R1())
+    else:
+        raise ValueError(
+            f"Unknown cipher suite: {cipher_suite}, available: {CIPHER_SUITES}"
+        )
+
+
+def key_cipher_suite(key: Union[PrivateKey, PublicKey]) -> str:
+    """
+    Get the cipher suite of a private or public key
+    """
+    if isinstance(key, (X25519PrivateKey, X25519PublicKey)):
+        return "x25519"
+    elif isinstance(key, (EllipticCurvePrivateKey, EllipticCurvePublicKey)):
+        return "secp384r1"
+    raise ValueError(f"Unsupported key type: {type(key)}")
+
+
+class SharedKeyCache:
+    """
+    Bounded LRU cache of keys derived via ECDH and HKDF. Entries are keyed by the fingerprints of both public keys of
+    the key pair, independent of which side holds the private key, as well as the length and info of the derived key.
+    The cache is meant to live for a single round of the protocol and should be cleared when the round ends, so that
+    shared secrets do not outlive it.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        :param maxsize: maximum number of derived keys to keep, the least recently used keys are evicted first
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def derive(
+        self,
+        private_key: PrivateKey,
+        public_key: PublicKey,
+        length: int = 32,
+        info: Optional[bytes] = None,
+    ) -> bytes:
+        """
+        Get the derived shared key from the cache or derive and store it
+        :param private_key: elliptic curve private key
+        :param public_key: elliptic curve public key
+        :param length: byte length of the derived key
+        :param info: optional context info of the key derivation
+        :return:
+        """
+        fingerprints = sorted(
+            [
+                public_key_fingerprint(private_key.public_key()),
+                public_key_fingerprint(public_key),
+            ]
+        )
+        cache_key = (*fingerprints, length, info)
+
+        with self._lock:
+            derived_key = self._keys.get(cache_key)
+            if derived_key is not None:
+                self._keys.move_to_end(cache_key)
+                self.hits += 1
+                return derived_key
+            self.misses += 1
+
+        derived_key = _derive_shared_key(private_key, public_key, length, info)
+
+        with self._lock:
+            self._keys[cache_key] = derived_key
+            if len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+        return derived_key
+
+    def clear(self):
+        """
+        Remove all cached keys, the hit and miss counters are kept
+        """
+        with self._lock:
+            self._keys.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "size": len(self._keys),
+        }
+
+    def __len__(self):
+        return len(self._keys)
 
 
 def derive_shared_key(
-    private_key: EllipticCurvePrivateKey,
-    public_key: EllipticCurvePublicKey,
+    private_key: PrivateKey,
+    public_key: PublicKey,
     length: int = 32,
+    info: Optional[bytes] = None,
+    cache: SharedKeyCache = None,
 ) -> bytes:
     """
-    Derive a shared key of the given length from an elliptic curve private key and a public key.
-    :param private_key: elliptic curve private key
-    :param public_key: elliptic curve public key
+    Derive a shared key of the given length from a private key and a public key of the same cipher suite.
+    :param private_key: SECP384R1 or X25519 private key
+    :param public_key: public key of the same suite
     :param length: byte length of the derived key
+    :param info: optional context info of the key derivation
+    :param cache: optional cache to look up and store the derived key
     :return:
     """
-    shared_key = private_key.exchange(ec.ECDH(), public_key)
+    if cache is not None:
+        return cache.derive(private_key, public_key, length=length, info=info)
+    return _derive_shared_key(private_key, public_key, length, info)
+
+
+def public_key_fingerprint(public_key: PublicKey) -> bytes:
+    """
+    SHA256 digest of the DER encoded public key
+    """
+    public_bytes = public_key.public_bytes(
+        Encoding.DER, PublicFormat.SubjectPublicKeyInfo
+    )
+    return hashlib.sha256(public_bytes).digest()
+
+
+def _derive_shared_key(
+    private_key: PrivateKey,
+    public_key: PublicKey,
+    length: int = 32,
+    info: Optional[bytes] = None,
+) -> bytes:
+    if isinstance(private_key, X25519PrivateKey):
+        shared_key = private_key.exchange(public_key)
+    else:
+        shared_key = private_key.exchange(ec.ECDH(), public_key)
 
     derived_key = HKDF(
         algorithm=hashes.SHA256(),
         length=length,
         salt=None,
-        info=None,
+        info=info,
     ).derive(shared_key)
     return derived_key
@@ -1,20 +1,41 @@
+import hashlib
 import os
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union
 
 import numpy as np
 from cryptography.hazmat.primitives.asymmetric.ec import (
     EllipticCurvePrivateKey,
     EllipticCurvePublicKey,
 )
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
 from pht_federated.protocols.secure_aggregation.models.server_messages import (
     BroadCastClientKeys,
 )
 from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    SharedKeyCache,
     derive_shared_key,
 )
-from pht_federated.protocols.secure_aggregation.secrets.util import load_public_key
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    ParticipantKeys,
+    get_participant_keys,
+)
+
+DEFAULT_PRG = "mt19937"
+DEFAULT_MASK_MODE = "float"
+DEFAULT_FIXED_POINT_SCALE = 2**16
+# number of items masked at once in the chunked masking functions
+DEFAULT_CHUNK_SIZE = 2**18
+
+MaskGenerator = Union[np.random.RandomState, np.random.Generator, "AESCTRGenerator"]
+
+# unsigned ring element type and the signed type used to decode it for the integer masking modes
+RING_DTYPES = {
+    "uint32": (np.dtype(np.uint32), np.dtype(np.int32)),
+    "uint64": (np.dtype(np.uint64), np.dtype(np.int64)),
+}
 
 
 def create_mask(
@@ -23,6 +44,11 @@ def create_mask(
     participants: List[BroadCastClientKeys],
     seed: str,
     n_params: int,
+    prg: str = DEFAULT_PRG,
+    n_workers: int = 1,
+    mode: str = DEFAULT_MASK_MODE,
+    cache: SharedKeyCache = None,
+    participant_keys: Dict[str, ParticipantKeys] = None,
 ) -> np.ndarray:
     """
     Generate a mask for a user based on the broadcast messages participants and the user's private random seed.
@@ -31,23 +57,43 @@ def create_mask(
     :param participants: participants public keys with which to generate the shared mask
     :param seed: hex random seed to expand into a private mask
     :param n_params: size of the mask
+    :param prg: name of the pseudo random generator used to expand the seeds
+    :param n_workers: number of threads used to generate the shared masks
+    :param mode: masking mode, float or one of the integer rings uint32/uint64
+    :param cache: optional cache of derived shared keys
+    :param participant_keys: optional lookup table of the participants' parsed public keys
     :return: numpy array of the mask
     """
-    private_mask = _generate_private_mask(seed, n_params)
-    mask = generate_user_masks(private_mask, user_id, user_keys, participants, n_params)
+    private_mask = _generate_private_mask(seed, n_params, prg=prg, mode=mode)
+    mask = generate_user_masks(
+        private_mask,
+        user_id,
+        user_keys,
+        participants,
+        n_params,
+        prg=prg,
+        n_workers=n_workers,
+        mode=mode,
+        cache=cache,
+        participant_keys=participant_keys,
+    )
 
     return mask
 
 
-def _generate_private_mask(seed: str, n_items: int) -> np.ndarray:
+def _generate_private_mask(
+    seed: str, n_items: int, prg: str = DEFAULT_PRG, mode: str = DEFAULT_MASK_MODE
+) -> np.ndarray:
     """
     Expand the seed into a private mask vector.
     :param seed: hex seed
     :param n_items: size of the mask
+    :param prg: name of the pseudo random generator
+    :param mode: masking mode
     :return:
     """
     seed = integer_seed_from_hex(seed)
-    return expand_seed(seed, n_items)
+    return expand_seed(seed, n_items, prg=prg, mode=mode)
 
 
 def generate_user_masks(
@@ -56,75 +102,423 @@ def generate_user_masks(
     user_keys: ClientKeys,
     participants: List[BroadCastClientKeys],
     n_params: int,
+    prg: str = DEFAULT_PRG,
+    n_workers: int = 1,
+    mode: str = DEFAULT_MASK_MODE,
+    cache: SharedKeyCache = None,
+    participant_keys: Dict[str, ParticipantKeys] = None,
 ) -> np.ndarray:
     """
     For each other participant, generate a shared mask with the user's private mask and the participant's public key.
+    With more than one worker the participants are split into batches, each thread sums the shared masks of its batch
+    into a partial sum and the partial sums are added to the private mask.
 
     :param private_mask: the private mask based on the user's seed
     :param user_id: the id of the user
     :param user_keys: the user's key pair
     :param participants: the public keys and id's of the other participants
     :param n_params: the size of the mask
+    :param prg: name of the pseudo random generator used to expand the shared seeds
+    :param n_workers: number of threads used to generate the shared masks
+    :param mode: masking mode
+    :param cache: optional cache of derived shared keys
+    :param participant_keys: optional lookup table of the participants' parsed public keys
     :return: numpy array of final mask containing the seed based mask and the shared masks from the other participants
     """
+    peers = _signed_peers(user_id, participants)
+
+    def _add_batch(out: np.ndarray, batch: List[Tuple[int, BroadCastClientKeys]]):
+        return _sum_shared_masks(
+            out, user_keys, batch, n_params, prg, mode, cache, participant_keys
+        )
+
+    return _reduce_in_batches(private_mask, peers, _add_batch, n_workers)
+
+
+def apply_mask_chunked(
+    input: np.ndarray,
+    user_id: str,
+    user_keys: ClientKeys,
+    participants: List[BroadCastClientKeys],
+    seed: str,
+    out: np.ndarray = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    prg: str = DEFAULT_PRG,
+    mode: str = DEFAULT_MASK_MODE,
+    scale: float = DEFAULT_FIXED_POINT_SCALE,
+    n_workers: int = 1,
+    cache: SharedKeyCache = None,
+    participant_keys: Dict[str, ParticipantKeys] = None,
+) -> np.ndarray:
+    """
+    Mask the input block-wise. For each chunk only the matching slice of the private and shared masks is generated
+    and the masked chunk is written to the output buffer, so the memory overhead is bounded by chunk_size * n_workers
+    instead of the size of the input.
+
+    :param input: the user's input vector
+    :param user_id: the id of the user
+    :param user_keys: the user's key pair
+    :param participants: the public keys and id's of the participants
+    :param seed: hex random seed of the private mask
+    :param out: optional buffer of the size of the input and the dtype of the masking mode to write the result to,
+        may be the input itself in float mode
+    :param chunk_size: number of items masked at once
+    :param prg: name of the pseudo random generator used to expand the seeds
+    :param mode: masking mode
+    :param scale: fixed point scale used to encode the input in the integer masking modes
+    :param n_workers: number of threads used to generate the mask chunks
+    :param cache: optional cache of derived shared keys
+    :param participant_keys: optional lookup table of the participants' parsed public keys
+    :return: the masked input
+    """
+    dtype = mask_dtype(mode)
+    if out is None:
+        out = np.empty(len(input), dtype=dtype)
+    elif out.shape != (len(input),) or out.dtype != dtype:
+        raise ValueError(
+            f"Output buffer must be a vector of size {len(input)} with dtype {dtype}"
+        )
+
+    streams = mask_streams(
+        user_id,
+        user_keys,
+        participants,
+        seed,
+        prg=prg,
+        cache=cache,
+        participant_keys=participant_keys,
+    )
+
+    for start in range(0, len(input), chunk_size):
+        chunk = out[start : start + chunk_size]
+        if mode == "float":
+            chunk[:] = input[start : start + chunk_size]
+        else:
+            chunk[:] = encode_fixed_point(
+                input[start : start + chunk_size], mode, scale
+            )
+        add_mask_streams(chunk, streams, mode=mode, n_workers=n_workers)
+
+    return out
+
+
+def mask_streams(
+    user_id: str,
+    user_keys: ClientKeys,
+    participants: List[BroadCastClientKeys],
+    seed: str,
+    prg: str = DEFAULT_PRG,
+    cache: SharedKeyCache = None,
+    participant_keys: Dict[str, ParticipantKeys] = None,
+) -> List[Tuple[int, MaskGenerator]]:
+    """
+    Create the generators of the private mask and the shared masks with the other participants, together with the
+    sign the generated masks are applied with.
+    :param user_id: the id of the user
+    :param user_keys: the user's key pair
+    :param participants: the public keys and id's of the participants
+    :param seed: hex random seed of the private mask
+    :param prg: name of the pseudo random generator
+    :param cache: optional cache of derived shared keys
+    :param participant_keys: optional lookup table of the participants' parsed public keys
+    :return: list of (sign, generator) tuples
+    """
+    streams = [(1, create_generator(integer_seed_from_hex(seed), prg=prg))]
+    for sign, participant in _signed_peers(user_id, participants):
+        public_key = get_participant_keys(
+            participant, participant_keys
+        ).sharing_public_key
+        shared_seed = shared_mask_seed(user_keys.sharing_key, public_key, cache=cache)
+        streams.append((sign, create_generator(shared_seed, prg=prg)))
+    return streams
+
+
+def add_mask_streams(
+    out: np.ndarray,
+    streams: List[Tuple[int, MaskGenerator]],
+    mode: str = DEFAULT_MASK_MODE,
+    n_workers: int = 1,
+) -> np.ndarray:
+    """
+    Draw the next len(out) items from each generator and add them with their sign to the output array.
+    :param out: array to accumulate the masks in
+    :param streams: list of (sign, generator) tuples
+    :param mode: masking mode
+    :param n_workers: number of threads drawing from the generators
+    :return: the output array
+    """
+
+    def _add_batch(batch_out: np.ndarray, batch: List[Tuple[int, MaskGenerator]]):
+        for sign, generator in batch:
+            mask = draw_mask(generator, len(batch_out), mode=mode)
+            if sign > 0:
+                batch_out += mask
+            else:
+                batch_out -= mask
+        return batch_out
+
+    return _reduce_in_batches(out, streams, _add_batch, n_workers)
+
+
+def _reduce_in_batches(
+    out: np.ndarray,
+    items: list,
+    add_batch: Callable[[np.ndarray, list], np.ndarray],
+    n_workers: int = 1,
+) -> np.ndarray:
+    """
+    Split the items into batches and accumulate each batch into a partial sum in its own thread, then add the partial
+    sums to the output array. Runs sequentially directly on the output array for a single worker.
+    :param out: output array
+    :param items: items to accumulate
+    :param add_batch: function accumulating a batch of items into the given array
+    :param n_workers: number of threads
+    :return: the output array
+    """
+    n_batches = min(n_workers, len(items))
+    if n_batches <= 1:
+        return add_batch(out, items)
+
+    batches = [items[i::n_batches] for i in range(n_batches)]
+
+    with ThreadPoolExecutor(max_workers=n_batches) as executor:
+        partial_sums = executor.map(
+            lambda batch: add_batch(np.zeros_like(out), batch), batches
+        )
+        for partial_sum in partial_sums:
+            out += partial_sum
+
+    return out
+
+
+def _signed_peers(
+    user_id: str, participants: List[BroadCastClientKeys]
+) -> List[Tuple[int, BroadCastClientKeys]]:
+    """
+    Get the other participants together with the sign their shared mask is applied with. Shared masks with
+    participants listed before the user are added, those with participants listed after the user are subtracted.
+    :param user_id: the id of the user
+    :param participants: the public keys and id's of the participants
+    :return: list of (sign, participant) tuples
+    """
     user_index = len(participants)
+    peers = []
     for i, participant in enumerate(participants):
         # set the user index when the id matches the broadcast id
         if participant.client_id == user_id:
             user_index = i
-
         else:
-            # load public key from broadcast
-            public_key = load_public_key(participant.broadcast.sharing_public_key)
             # multiplier for mask based on index in list
-            if i > user_index:
-                private_mask -= generate_shared_mask(
-                    user_keys.sharing_key, public_key, n_params
-                )
-            else:
-                private_mask += generate_shared_mask(
-                    user_keys.sharing_key, public_key, n_params
-                )
+            peers.append((-1 if i > user_index else 1, participant))
+    return peers
 
-    return private_mask
+
+def _sum_shared_masks(
+    out: np.ndarray,
+    user_keys: ClientKeys,
+    peers: List[Tuple[int, BroadCastClientKeys]],
+    n_params: int,
+    prg: str = DEFAULT_PRG,
+    mode: str = DEFAULT_MASK_MODE,
+    cache: SharedKeyCache = None,
+    participant_keys: Dict[str, ParticipantKeys] = None,
+) -> np.ndarray:
+    """
+    Add the signed shared masks with the given peers to the output array
+    :param out: array to accumulate the shared masks in
+    :param user_keys: the user's key pair
+    :param peers: list of (sign, participant) tuples
+    :param n_params: the size of the mask
+    :param prg: name of the pseudo random generator used to expand the shared seeds
+    :param mode: masking mode
+    :param cache: optional cache of derived shared keys
+    :param participant_keys: optional lookup table of the participants' parsed public keys
+    :return: the output array
+    """
+    for sign, participant in peers:
+        # look up the parsed public key of the participant
+        public_key = get_participant_keys(
+            participant, participant_keys
+        ).sharing_public_key
+        shared_mask = generate_shared_mask(
+            user_keys.sharing_key,
+            public_key,
+            n_params,
+            prg=prg,
+            mode=mode,
+            cache=cache,
+        )
+        if sign > 0:
+            out += shared_mask
+        else:
+            out -= shared_mask
+    return out
 
 
 def generate_shared_mask(
     private_key: EllipticCurvePrivateKey,
     public_key: EllipticCurvePublicKey,
     n_items: int,
+    prg: str = DEFAULT_PRG,
+    mode: str = DEFAULT_MASK_MODE,
+    cache: SharedKeyCache = None,
 ) -> np.ndarray:
     """
     Generate a shared mask between two users, with the random seed derived from a public and private key
     :param private_key: private key of the user
     :param public_key: public key of the other user
     :param n_items: size of the mask
+    :param prg: name of the pseudo random generator
+    :param mode: masking mode
+    :param cache: optional cache of derived shared keys
     :return:
     """
-    # derive the key and transform into random seed
-    shared_key = derive_shared_key(private_key, public_key, length=4)
-    seed = integer_seed_from_hex(shared_key.hex())
+    seed = shared_mask_seed(private_key, public_key, cache=cache)
 
     # generate the random vector
-    mask = expand_seed(seed, n_items=n_items)
+    mask = expand_seed(seed, n_items=n_items, prg=prg, mode=mode)
 
     return mask
 
 
-def expand_seed(seed: int, n_items: int) -> np.ndarray:
+def shared_mask_seed(
+    private_key: EllipticCurvePrivateKey,
+    public_key: EllipticCurvePublicKey,
+    cache: SharedKeyCache = None,
+) -> int:
+    """
+    Derive the integer seed of the shared mask between two users from a private and a public key
+    :param private_key: private key of the user
+    :param public_key: public key of the other user
+    :param cache: optional cache of derived shared keys
+    :return: integer seed
+    """
+    # derive the key and transform into random seed
+    shared_key = derive_shared_key(private_key, public_key, length=4, cache=cache)
+    return integer_seed_from_hex(shared_key.hex())
+
+
+def expand_seed(
+    seed: int, n_items: int, prg: str = DEFAULT_PRG, mode: str = DEFAULT_MASK_MODE
+) -> np.ndarray:
     """
     Expand the seed into a random vector of the given size.
-    :param seed:
-    :param n_items:
+    :param seed: integer seed
+    :param n_items: size of the vector
+    :param prg: name of the pseudo random generator
+    :param mode: masking mode, float values in [0, 1) or uniform ring elements for uint32/uint64
     :return:
     """
-    np.random.seed(seed)
+    generator = create_generator(seed, prg=prg)
 
-    mask = np.random.random(n_items)
+    mask = draw_mask(generator, n_items, mode=mode)
 
     return mask
 
 
+def draw_mask(
+    generator: MaskGenerator, n_items: int, mode: str = DEFAULT_MASK_MODE
+) -> np.ndarray:
+    """
+    Draw the next n_items mask values from the generator
+    :param generator: pseudo random generator
+    :param n_items: number of values
+    :param mode: masking mode, float values in [0, 1) or uniform ring elements for uint32/uint64
+    :return:
+    """
+    if mode == "float":
+        return generator.random(n_items)
+
+    dtype = mask_dtype(mode)
+    # interpret the generator output as little endian ring elements
+    random_bytes = generator.bytes(n_items * dtype.itemsize)
+    return np.frombuffer(random_bytes, dtype=dtype.newbyteorder("<")).astype(dtype)
+
+
+def mask_dtype(mode: str = DEFAULT_MASK_MODE) -> np.dtype:
+    """
+    Get the dtype of masks and masked inputs for the masking mode
+    :param mode: masking mode
+    :return: float64 for float masks, the unsigned integer type for the integer ring modes
+    """
+    if mode == "float":
+        return np.dtype(np.float64)
+    elif mode in RING_DTYPES:
+        return RING_DTYPES[mode][0]
+    else:
+        raise ValueError(f"Unknown masking mode: {mode}")
+
+
+def encode_fixed_point(
+    values: np.ndarray, mode: str, scale: float = DEFAULT_FIXED_POINT_SCALE
+) -> np.ndarray:
+    """
+    Encode float values as fixed point ring elements. Values are scaled, rounded and wrapped into the unsigned ring,
+    negative values are represented by their two's complement.
+    :param values: float values to encode
+    :param mode: integer masking mode, uint32 or uint64
+    :param scale: fixed point scale, the resolution of the encoding is 1 / scale
+    :return: array of ring elements
+    """
+    dtype = mask_dtype(mode)
+    scaled = np.round(np.asarray(values, dtype=np.float64) * scale)
+    return scaled.astype(np.int64).astype(dtype)
+
+
+def decode_fixed_point(
+    values: np.ndarray, mode: str, scale: float = DEFAULT_FIXED_POINT_SCALE
+) -> np.ndarray:
+    """
+    Decode fixed point ring elements into float values.
+    :param values: ring elements, e.g. the unmasked sum of encoded inputs
+    :param mode: integer masking mode, uint32 or uint64
+    :param scale: fixed point scale used for encoding
+    :return: float array
+    """
+    unsigned, signed = RING_DTYPES[mode]
+    return np.asarray(values, dtype=unsigned).view(signed) / scale
+
+
+class AESCTRGenerator:
+    """
+    Counter mode pseudo random generator, producing the AES keystream of a key derived from the seed.
+    """
+
+    def __init__(self, seed: int):
+        seed_bytes = seed.to_bytes((seed.bit_length() + 7) // 8 or 1, "big")
+        key = hashlib.sha256(seed_bytes).digest()
+        self._encryptor = Cipher(algorithms.AES(key), modes.CTR(b"\0" * 16)).encryptor()
+
+    def bytes(self, length: int) -> bytes:
+        return self._encryptor.update(bytes(length))
+
+    def random(self, size: int) -> np.ndarray:
+        # use the upper 53 bits of each 64 bit block as the mantissa of a float in [0, 1)
+        blocks = np.frombuffer(self.bytes(8 * size), dtype="<u8")
+        return (blocks >> np.uint64(11)) * (1.0 / 2**53)
+
+
+def create_generator(seed: int, prg: str = DEFAULT_PRG) -> MaskGenerator:
+    """
+    Create an independent pseudo random generator for the seed. The generator does not touch numpy's global random
+    state, so masks can be expanded concurrently.
+    :param seed: integer seed
+    :param prg: name of the pseudo random generator. One of mt19937, pcg64, philox or aes-ctr
+    :return: generator exposing random(size) and bytes(length)
+    """
+    if prg == "mt19937":
+        # same stream as seeding the global numpy generator
+        return np.random.RandomState(seed)
+    elif prg == "pcg64":
+        return np.random.Generator(np.random.PCG64(seed))
+    elif prg == "philox":
+        return np.random.Generator(np.random.Philox(seed))
+    elif prg == "aes-ctr":
+        return AESCTRGenerator(seed)
+    else:
+        raise ValueError(f"Unknown pseudo random generator: {prg}")
+
+
 def generate_random_seed() -> str:
     return os.urandom(4).hex()
 
@@ -1,26 +1,42 @@
-from typing import List, Tuple
+from typing import Dict, Hashable, List, Tuple
 
 from Crypto.Protocol.SecretSharing import Shamir
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric.ec import (
-    EllipticCurvePrivateKeyWithSerialization as ECPrivateKey,
-)
 
+from pht_federated.protocols.secure_aggregation.models import HexString
 from pht_federated.protocols.secure_aggregation.models.secrets import (
     KeyShare,
     SecretShares,
     SeedShare,
 )
+from pht_federated.protocols.secure_aggregation.secrets import shamir
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    DEFAULT_CIPHER_SUITE,
+    KEY_SEED_BYTES,
+    PrivateKey,
+    derive_private_key_from_seed,
+)
+from pht_federated.protocols.secure_aggregation.secrets.util import load_private_key
 
 # Number of sharing key chunks
 NUM_KEY_CHUNKS = 20
 SHAMIR_SIZE = 16
-KEY_BYTES = 306
+# byte length of the serialized private sharing keys, PEM encoded for SECP384R1 and raw for X25519
+KEY_BYTES = {"secp384r1": 306, "x25519": 32}
 SEED_LENGTH = 4
+# pycryptodome shares 16 byte chunks over GF(2^128), numpy shares all chunks at once over the prime field of the shamir
+# module. The share segments of both engines are 16 bytes long, but shares of one engine can only be combined by it.
+SHAMIR_ENGINES = ("pycryptodome", "numpy")
+DEFAULT_SHAMIR_ENGINE = "pycryptodome"
+# irreducible polynomial x^128 + x^7 + x^2 + x + 1 of the GF(2^128) field pycryptodome shares the 16 byte chunks over
+GF_MODULUS = (1 << 128) | 0x87
 
 
 def create_secret_shares(
-    hex_sharing_key: str, hex_seed: str, n: int, k: int = 3
+    hex_sharing_key: str,
+    hex_seed: str,
+    n: int,
+    k: int = 3,
+    engine: str = DEFAULT_SHAMIR_ENGINE,
 ) -> SecretShares:
     """
     Create shares to distribute to the server in the second round of the protocol.
@@ -28,40 +44,55 @@ def create_secret_shares(
     :param hex_seed: 16 byte hex string representing the integer seed of the mask generator
     :param n: number of participants
     :param k: minimum number of keys necessary to recover the secrets
+    :param engine: shamir secret sharing engine, pycryptodome or numpy
     :return: SecretShares object containing the chunked key shares as well as the seed shares for each participating
         user
     """
-    key_shares = create_key_shares(hex_sharing_key, n, k)
-    seed_shares = create_seed_shares(hex_seed, n, k)
+    key_shares = create_key_shares(hex_sharing_key, n, k, engine=engine)
+    seed_shares = create_seed_shares(hex_seed, n, k, engine=engine)
 
-    return SecretShares(key_shares=key_shares, seed_shares=seed_shares)
+    # the shares are created in-process, their segments are validated by construction
+    return SecretShares.construct(key_shares=key_shares, seed_shares=seed_shares)
 
 
-def create_key_shares(hex_sharing_key: str, n: int, k: int = 3) -> List[KeyShare]:
+def create_key_shares(
+    hex_sharing_key: str, n: int, k: int = 3, engine: str = DEFAULT_SHAMIR_ENGINE
+) -> List[KeyShare]:
     """
     Create a key shares object from a hex representation of the EC private sharing key.
     :param hex_sharing_key: hex string representation of the EC private sharing key
     :param n: number of participants
     :param k: minimum number of keys necessary to recover the secret
+    :param engine: shamir secret sharing engine, pycryptodome or numpy
     :return: A KeyShares object containing the chunked sharing key shares associated with user ids
     """
     key_bytes = bytes.fromhex(hex_sharing_key)
+    if _check_engine(engine) == "numpy":
+        return [
+            KeyShare.construct(
+                shamir_index=index,
+                segments=[HexString.from_bytes(segment) for segment in segments],
+            )
+            for index, segments in shamir.split_secret(key_bytes, n, k)
+        ]
     # chunk the key
     key_chunks = _chunk_key_bytes(key_bytes)
     # create shares from chunks
     chunked_shares = _create_shares_from_chunks(key_chunks, n, k)
     # distribute the chunked shares to the users and create the KeyShares object
     key_shares = _distribute_chunked_shares(chunked_shares)
-    # print(segments)
     return key_shares
 
 
-def create_seed_shares(seed: str, n: int, k: int = 3) -> List[SeedShare]:
+def create_seed_shares(
+    seed: str, n: int, k: int = 3, engine: str = DEFAULT_SHAMIR_ENGINE
+) -> List[SeedShare]:
     """
     Create a secret shares object from a seed.
     :param seed: the seed to split
     :param n: number of participants
     :param k: minimum number of keys necessary to recover the secret
+    :param engine: shamir secret sharing engine, pycryptodome or numpy
     :return: A SecretShares object containing the chunked secret shares associated with user ids
     """
 
@@ -72,86 +103,234 @@ def create_seed_shares(seed: str, n: int, k: int = 3) -> List[SeedShare]:
             f"Seed must be {SEED_LENGTH} bytes long (8 hex characters). Found length {len(seed_bytes)}."
         )
 
+    if _check_engine(engine) == "numpy":
+        return [
+            SeedShare.construct(
+                shamir_index=index, seed=HexString.from_bytes(segments[0])
+            )
+            for index, segments in shamir.split_secret(seed_bytes, n, k)
+        ]
+
     # todo remove for better shamir solution
     seed_bytes = seed_bytes + b"\0" * (SHAMIR_SIZE - SEED_LENGTH)
     # create the secret shares
     secret_shares = Shamir.split(k=k, n=n, secret=seed_bytes, ssss=False)
     # convert to list of SeedShare models
     seed_shares = [
-        SeedShare(shamir_index=i, seed=share.hex()) for i, share in secret_shares
+        SeedShare.construct(shamir_index=i, seed=HexString.from_bytes(share))
+        for i, share in secret_shares
     ]
 
     return seed_shares
 
 
-def combine_key_shares(shares: List[KeyShare], k: int = 3) -> ECPrivateKey:
+def combine_key_shares(
+    shares: List[KeyShare],
+    k: int = 3,
+    cipher_suite: str = DEFAULT_CIPHER_SUITE,
+    engine: str = DEFAULT_SHAMIR_ENGINE,
+    key_sharing: str = "key",
+) -> PrivateKey:
     """
     Combine a list of key shares to get the recovery keys
     :param shares:
     :param k:
+    :param cipher_suite: cipher suite of the shared private key
+    :param engine: shamir secret sharing engine the shares were created with
+    :param key_sharing: key if the shares contain the serialized private key, seed if they contain the seed the
+        private key is derived from
     :return:
     """
-    if len(shares) < k:
-        raise ValueError(
-            f"Not enough shares to combine. Found {len(shares)} shares, but need at least {k}."
-        )
-
-    segmented_shares = [_process_key_segment(share) for share in shares]
-    private_bytes = _process_chunked_shares(segmented_shares)
+    return combine_key_shares_batch(
+        {0: shares},
+        k=k,
+        cipher_suite=cipher_suite,
+        engine=engine,
+        key_sharing=key_sharing,
+    )[0]
+
+
+def combine_key_shares_batch(
+    user_shares: Dict[Hashable, List[KeyShare]],
+    k: int = 3,
+    cipher_suite: str = DEFAULT_CIPHER_SUITE,
+    engine: str = DEFAULT_SHAMIR_ENGINE,
+    key_sharing: str = "key",
+) -> Dict[Hashable, PrivateKey]:
+    """
+    Combine the key shares of multiple users at once. The lagrange basis is computed once for each set of shamir
+    indices and reused for all key chunks of all users sharing this set.
+    :param user_shares: dictionary of the key shares of each user
+    :param k: minimum number of shares required for each user
+    :param cipher_suite: cipher suite of the shared private keys
+    :param engine: shamir secret sharing engine the shares were created with
+    :param key_sharing: key if the shares contain the serialized private keys, seed if they contain the seeds the
+        private keys are derived from
+    :return: dictionary of the recovered private keys by user
+    """
+    if key_sharing == "seed":
+        secret_length = KEY_SEED_BYTES
+    elif key_sharing == "key":
+        secret_length = KEY_BYTES[cipher_suite]
+    else:
+        raise ValueError(f"Unknown key sharing mode: {key_sharing}")
+
+    for shares in user_shares.values():
+        if len(shares) < k:
+            raise ValueError(
+                f"Not enough shares to combine. Found {len(shares)} shares, but need at least {k}."
+            )
+
+    secrets = {
+        user: [
+            (share.shamir_index, [segment.get_bytes() for segment in share.segments])
+            for share in shares
+        ]
+        for user, shares in user_shares.items()
+    }
 
+    _check_engine(engine)
     try:
-        private_key = serialization.load_pem_private_key(private_bytes, password=None)
+        recovered_secrets = _combine_secrets(secrets, secret_length, engine)
+        private_keys = {}
+        for user, private_bytes in recovered_secrets.items():
+            if key_sharing == "seed":
+                private_keys[user] = derive_private_key_from_seed(
+                    private_bytes, cipher_suite
+                )
+            else:
+                private_keys[user] = load_private_key(private_bytes.hex())
     except ValueError:
         raise ValueError("Could combine the shares to recover the secret key.")
 
-    return private_key
+    return private_keys
 
 
-def combine_seed_shares(shares: List[SeedShare]) -> bytes:
+def combine_seed_shares(
+    shares: List[SeedShare], engine: str = DEFAULT_SHAMIR_ENGINE
+) -> bytes:
     """
     Combine a list of seed shares to get the secret
     :param shares:
+    :param engine: shamir secret sharing engine the shares were created with
     :return:
     """
-    secret_shares = [(share.shamir_index, share.seed.get_bytes()) for share in shares]
-    secret = Shamir.combine(secret_shares, ssss=False)
-    # todo remove for better shamir solution
-    # remove padding
-    secret = secret[:SEED_LENGTH]
-    return secret
+    return combine_seed_shares_batch({0: shares}, engine=engine)[0]
 
 
-def _process_chunked_shares(chunked_shares: List[List[Tuple[int, bytes]]]) -> bytes:
+def combine_seed_shares_batch(
+    user_shares: Dict[Hashable, List[SeedShare]], engine: str = DEFAULT_SHAMIR_ENGINE
+) -> Dict[Hashable, bytes]:
     """
-    Convert the shares of a chunk of the sharing key
-    :param chunked_shares: Crypto Shamir shares of the sharing key
-    :return: the combined bytes of the key
+    Combine the seed shares of multiple users at once. The lagrange basis is computed once for each set of shamir
+    indices and all seeds sharing this set are interpolated together.
+    :param user_shares: dictionary of the seed shares of each user
+    :param engine: shamir secret sharing engine the shares were created with
+    :return: dictionary of the recovered seeds by user
     """
-    zipped_shares = zip(*chunked_shares)
-    combined_shares = [list(chunk) for chunk in zipped_shares]
+    secrets = {
+        user: [(share.shamir_index, [share.seed.get_bytes()]) for share in shares]
+        for user, shares in user_shares.items()
+    }
+    return _combine_secrets(secrets, SEED_LENGTH, _check_engine(engine))
 
-    # combine the shares
-    combined_shares = [
-        Shamir.combine(share_list, ssss=False) for share_list in combined_shares
-    ]
-    # todo improve this
-    # remove the padding
-    combined_shares[-1] = combined_shares[-1][: KEY_BYTES % SHAMIR_SIZE]
 
-    key = b"".join(list(combined_shares))
-    return key
+def _check_engine(engine: str) -> str:
+    if engine not in SHAMIR_ENGINES:
+        raise ValueError(
+            f"Unknown shamir engine: {engine}, available: {SHAMIR_ENGINES}"
+        )
+    return engine
 
 
-def _process_key_segment(key_share: KeyShare) -> List[Tuple[int, bytes]]:
+def _combine_secrets(
+    secrets: Dict[Hashable, List[Tuple[int, List[bytes]]]],
+    secret_length: int,
+    engine: str = DEFAULT_SHAMIR_ENGINE,
+) -> Dict[Hashable, bytes]:
     """
-    Turn the segments of a key share into (int, bytes) tuples to be processed by secret sharing
-    :param key_share: a users key share
-    :return: list of tuples representing the shared secrets usy by pycryptodome
+    Recover secrets from their shares
+    :param secrets: dictionary of the shares of each secret, a share is a shamir index and a list of 16 byte segments
+    :param secret_length: byte length of the secrets, the padding is removed from the combined segments
+    :param engine: shamir secret sharing engine the shares were created with
+    :return: dictionary of the recovered secrets
     """
-    shamir_shares = [
-        (key_share.shamir_index, segment.get_bytes()) for segment in key_share.segments
-    ]
-    return shamir_shares
+    if engine == "numpy":
+        return shamir.combine_secrets(secrets, secret_length)
+
+    recovered = {}
+    bases = {}
+    for key, shares in secrets.items():
+        indices = tuple(index for index, _ in shares)
+        if len(set(indices)) != len(indices):
+            raise ValueError("Duplicate share")
+        basis = bases.get(indices)
+        if basis is None:
+            basis = _gf_lagrange_basis(indices)
+            bases[indices] = basis
+
+        # interpolate each chunk of the secret at x = 0 with the basis of the share indices
+        chunks = []
+        for chunk_shares in zip(*(segments for _, segments in shares)):
+            result = 0
+            for coefficient, chunk_share in zip(basis, chunk_shares):
+                result ^= _gf_mul(coefficient, int.from_bytes(chunk_share, "big"))
+            chunks.append(result.to_bytes(SHAMIR_SIZE, "big"))
+        recovered[key] = b"".join(chunks)[:secret_length]
+    return recovered
+
+
+def _gf_lagrange_basis(indices: Tuple[int, ...]) -> List[int]:
+    """
+    Lagrange basis polynomials of the share indices evaluated at x = 0 in GF(2^128), as used by pycryptodome. Field
+    elements are integers whose bits are the coefficients of the polynomial, addition and subtraction are xor.
+    """
+    basis = []
+    for j, x_j in enumerate(indices):
+        numerator = 1
+        denominator = 1
+        for m, x_m in enumerate(indices):
+            if m != j:
+                numerator = _gf_mul(numerator, x_m)
+                denominator = _gf_mul(denominator, x_j ^ x_m)
+        basis.append(_gf_mul(numerator, _gf_inverse(denominator)))
+    return basis
+
+
+def _gf_mul(a: int, b: int) -> int:
+    """
+    Multiply two elements of GF(2^128), carry-less multiplication reduced by the field polynomial
+    """
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        a <<= 1
+        if a >> 128:
+            a ^= GF_MODULUS
+        b >>= 1
+    return product
+
+
+def _gf_inverse(a: int) -> int:
+    """
+    Multiplicative inverse of an element of GF(2^128) with the extended euclidean algorithm over GF(2)[x]
+    """
+    if a == 0:
+        raise ValueError("Inversion of zero")
+    r0, r1 = GF_MODULUS, a
+    s0, s1 = 0, 1
+    while r1:
+        # polynomial division of r0 by r1
+        quotient = 0
+        remainder = r0
+        while remainder.bit_length() >= r1.bit_length():
+            shift = remainder.bit_length() - r1.bit_length()
+            quotient ^= 1 << shift
+            remainder ^= r1 << shift
+        r0, r1 = r1, remainder
+        s0, s1 = s1, s0 ^ _gf_mul(quotient, s1)
+    return s0
 
 
 def _distribute_chunked_shares(
@@ -164,19 +343,22 @@ def _distribute_chunked_shares(
     """
     # create dictionary with user ids as key and the hex conversion of the initial share as initial value
     segment_dict = {
-        user_id: [first_chunk.hex()] for user_id, first_chunk in chunked_shares[0]
+        user_id: [HexString.from_bytes(first_chunk)]
+        for user_id, first_chunk in chunked_shares[0]
     }
 
     # Start from index 1 as the first item has already been processed
     for chunk_shares in chunked_shares[1:]:
         for user_id, share in chunk_shares:
             # append the hex conversion of the share to the list of segments
-            segment_dict[user_id].append(share.hex())
+            segment_dict[user_id].append(HexString.from_bytes(share))
 
     # convert the dictionary to a list of Keyshare
     key_shares = []
     for user_id, share_segment in segment_dict.items():
-        key_shares.append(KeyShare(shamir_index=user_id, segments=share_segment))
+        key_shares.append(
+            KeyShare.construct(shamir_index=user_id, segments=share_segment)
+        )
 
     return key_shares
 
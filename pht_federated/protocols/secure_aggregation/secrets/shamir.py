@@ -0,0 +1,191 @@
+import os
+from functools import lru_cache
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+# Mersenne prime field, products of two field elements fit into 64 bit integers
+FIELD_PRIME = 2**31 - 1
+# each field element encodes 3 bytes of the secret
+SECRET_BYTES_PER_ELEMENT = 3
+# a 16 byte share segment holds 4 little endian uint32 field elements, like the 16 byte segments of pycryptodome
+SEGMENT_BYTES = 16
+ELEMENTS_PER_SEGMENT = SEGMENT_BYTES // 4
+
+
+def split_secret(secret: bytes, n: int, k: int) -> List[Tuple[int, List[bytes]]]:
+    """
+    Split a secret into n shares, any k of which can be combined to recover the secret. The secret is encoded into
+    field elements and the random polynomials of all elements are evaluated at all n share indices at once.
+
+    :param secret: the secret bytes
+    :param n: number of shares
+    :param k: minimum number of shares required to recover the secret
+    :return: list of (shamir index, list of 16 byte segments) tuples, with shamir indices 1 to n
+    """
+    if not 1 <= k <= n:
+        raise ValueError(f"Invalid threshold k={k} for n={n} shares")
+    if n >= FIELD_PRIME:
+        raise ValueError(f"Number of shares must be smaller than {FIELD_PRIME}")
+
+    elements = _encode_secret(secret)
+    # the constant term of each polynomial is the secret element, the other coefficients are random
+    coefficients = _random_field_elements((k - 1, len(elements)))
+
+    # evaluate the polynomials at x = 1..n with horner's method, shape (n, n_elements)
+    x = np.arange(1, n + 1, dtype=np.uint64)[:, None]
+    y = np.zeros((n, len(elements)), dtype=np.uint64)
+    for coefficient in coefficients[::-1]:
+        y = (y * x + coefficient) % FIELD_PRIME
+    y = (y * x + elements) % FIELD_PRIME
+
+    share_bytes = y.astype("<u4").tobytes()
+    share_length = len(elements) * 4
+    shares = []
+    for i in range(n):
+        share = share_bytes[i * share_length : (i + 1) * share_length]
+        segments = [
+            share[j : j + SEGMENT_BYTES] for j in range(0, share_length, SEGMENT_BYTES)
+        ]
+        shares.append((i + 1, segments))
+    return shares
+
+
+def combine_secret(shares: List[Tuple[int, List[bytes]]], secret_length: int) -> bytes:
+    """
+    Recover the secret from a list of shares by lagrange interpolation at x = 0. All given shares are used, the
+    lagrange coefficients of a set of shamir indices are computed once and cached.
+
+    :param shares: list of (shamir index, list of 16 byte segments) tuples
+    :param secret_length: byte length of the secret
+    :return: the secret bytes
+    """
+    if not shares:
+        raise ValueError("No shares given")
+
+    indices = tuple(index for index, _ in shares)
+    if len(set(indices)) != len(indices):
+        raise ValueError("Duplicate shamir indices")
+
+    y = np.stack([_decode_share(segments) for _, segments in shares])
+    n_elements = -(-secret_length // SECRET_BYTES_PER_ELEMENT)
+    if y.shape[1] < n_elements:
+        raise ValueError("Shares are too short for the secret length")
+
+    elements = combine_elements(indices, y[:, :n_elements])
+    return _decode_secret(elements, secret_length)
+
+
+def combine_secrets(
+    secrets: Dict[Hashable, List[Tuple[int, List[bytes]]]], secret_length: int
+) -> Dict[Hashable, bytes]:
+    """
+    Recover multiple secrets of the same length at once. The secrets are grouped by the shamir indices of their shares,
+    the lagrange coefficients are computed once per group and all secrets of a group are interpolated together.
+
+    :param secrets: dictionary of the shares of each secret
+    :param secret_length: byte length of the secrets
+    :return: dictionary of the recovered secrets with the keys of the given shares
+    """
+    n_elements = -(-secret_length // SECRET_BYTES_PER_ELEMENT)
+    groups = {}
+    for key, shares in secrets.items():
+        if not shares:
+            raise ValueError(f"No shares given for secret {key}")
+        shares = sorted(shares, key=lambda share: share[0])
+        indices = tuple(index for index, _ in shares)
+        if len(set(indices)) != len(indices):
+            raise ValueError(f"Duplicate shamir indices for secret {key}")
+        groups.setdefault(indices, []).append((key, shares))
+
+    recovered = {}
+    for indices, group in groups.items():
+        # shape (n_shares, n_secrets, n_elements)
+        y = np.stack(
+            [
+                np.stack([_decode_share(shares[i][1]) for _, shares in group])
+                for i in range(len(indices))
+            ]
+        )
+        if y.shape[2] < n_elements:
+            raise ValueError("Shares are too short for the secret length")
+        elements = combine_elements(indices, y[:, :, :n_elements])
+        for (key, _), secret_elements in zip(group, elements):
+            recovered[key] = _decode_secret(secret_elements, secret_length)
+    return recovered
+
+
+def combine_elements(indices: Tuple[int, ...], y: np.ndarray) -> np.ndarray:
+    """
+    Interpolate the polynomials at x = 0 from their values at the given indices
+    :param indices: shamir indices of the shares
+    :param y: field elements of the shares, shape (len(indices), ...)
+    :return: the constant terms of the polynomials
+    """
+    coefficients = lagrange_coefficients(tuple(indices))
+    result = np.zeros(y.shape[1:], dtype=np.uint64)
+    for coefficient, values in zip(coefficients, y):
+        result = (result + np.uint64(coefficient) * values) % FIELD_PRIME
+    return result
+
+
+@lru_cache(maxsize=1024)
+def lagrange_coefficients(indices: Tuple[int, ...]) -> Tuple[int, ...]:
+    """
+    Lagrange basis polynomials of the given indices evaluated at x = 0
+    """
+    coefficients = []
+    for i, x_i in enumerate(indices):
+        numerator = 1
+        denominator = 1
+        for j, x_j in enumerate(indices):
+            if i != j:
+                numerator = numerator * x_j % FIELD_PRIME
+                denominator = denominator * (x_j - x_i) % FIELD_PRIME
+        coefficients.append(
+            numerator * pow(denominator, FIELD_PRIME - 2, FIELD_PRIME) % FIELD_PRIME
+        )
+    return tuple(coefficients)
+
+
+def _encode_secret(secret: bytes) -> np.ndarray:
+    # pad to a multiple of the element size and of the elements per segment
+    n_elements = -(-len(secret) // SECRET_BYTES_PER_ELEMENT)
+    n_elements += -n_elements % ELEMENTS_PER_SEGMENT
+    padded = secret.ljust(n_elements * SECRET_BYTES_PER_ELEMENT, b"\0")
+    chunks = np.frombuffer(padded, dtype=np.uint8).reshape(-1, 3).astype(np.uint64)
+    return chunks[:, 0] | (chunks[:, 1] << 8) | (chunks[:, 2] << 16)
+
+
+def _decode_secret(elements: np.ndarray, secret_length: int) -> bytes:
+    if np.any(elements >= 2 ** (8 * SECRET_BYTES_PER_ELEMENT)):
+        raise ValueError("Could not combine the shares to recover the secret.")
+    secret = elements.astype("<u4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return secret[:secret_length]
+
+
+def _decode_share(segments: List[bytes]) -> np.ndarray:
+    share_bytes = b"".join(segments)
+    if len(share_bytes) % 4:
+        raise ValueError("Invalid share length")
+    y = np.frombuffer(share_bytes, dtype="<u4").astype(np.uint64)
+    if np.any(y >= FIELD_PRIME):
+        raise ValueError("Share contains values outside of the field")
+    return y
+
+
+def _random_field_elements(shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    Uniformly random field elements from the os random source
+    """
+    size = int(np.prod(shape))
+    elements = np.frombuffer(os.urandom(4 * size), dtype="<u4") & 0x7FFFFFFF
+    elements = elements.astype(np.uint64)
+    # reject the single 31 bit value outside of the field
+    invalid = elements == FIELD_PRIME
+    while np.any(invalid):
+        elements[invalid] = (
+            np.frombuffer(os.urandom(4 * int(invalid.sum())), dtype="<u4") & 0x7FFFFFFF
+        )
+        invalid = elements == FIELD_PRIME
+    return elements.reshape(shape)
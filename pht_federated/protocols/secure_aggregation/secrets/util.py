@@ -1,19 +1,198 @@
-from cryptography.hazmat.primitives.asymmetric.ec import (
-    EllipticCurvePrivateKey,
-    EllipticCurvePublicKey,
+import base64
+from functools import lru_cache
+from typing import Dict, List, NamedTuple
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.x25519 import (
+    X25519PrivateKey,
+    X25519PublicKey,
 )
 from cryptography.hazmat.primitives.serialization import (
     load_pem_private_key,
     load_pem_public_key,
 )
 
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    PrivateKey,
+    PublicKey,
+)
+
+# number of parsed public keys kept in the process wide cache
+PUBLIC_KEY_CACHE_SIZE = 4096
+# length of raw X25519 keys, SECP384R1 keys are PEM encoded and always longer
+X25519_KEY_BYTES = 32
+# public key encodings, hex encoded PEM/raw keys or base64 encoded compressed points/raw keys
+KEY_ENCODINGS = ("hex", "compact")
+# lengths of the base64 encoded compact keys (32 byte X25519 keys and 49 byte compressed SECP384R1 points), these never
+# match the length of a hex encoded key
+COMPACT_KEY_LENGTHS = (44, 68)
+
+
+class ParticipantKeys(NamedTuple):
+    """
+    Parsed public keys of a participant
+    """
+
+    cipher_public_key: PublicKey
+    sharing_public_key: PublicKey
+
 
-def load_public_key(public_key_hex: str) -> EllipticCurvePublicKey:
-    public_key_bytes = bytes.fromhex(public_key_hex)
+def _parse_public_key(public_key_str: str) -> PublicKey:
+    if len(public_key_str) in COMPACT_KEY_LENGTHS:
+        public_key_bytes = base64.b64decode(public_key_str)
+        if len(public_key_bytes) == X25519_KEY_BYTES:
+            return X25519PublicKey.from_public_bytes(public_key_bytes)
+        return ec.EllipticCurvePublicKey.from_encoded_point(
+            ec.SECP384R1(), public_key_bytes
+        )
+
+    public_key_bytes = bytes.fromhex(public_key_str)
+    if len(public_key_bytes) == X25519_KEY_BYTES:
+        return X25519PublicKey.from_public_bytes(public_key_bytes)
     return load_pem_public_key(public_key_bytes)
 
 
-def load_private_key(private_key_hex: str) -> EllipticCurvePrivateKey:
+_cached_parse_public_key = lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)(_parse_public_key)
+
+
+def load_public_key(public_key_str: str) -> PublicKey:
+    """
+    Parse a public key in one of the key encodings. Hex encoded keys are either PEM encoded SECP384R1 keys or raw X25519
+    keys, compact keys are base64 encoded compressed SECP384R1 points or raw X25519 keys. Parsed keys are kept in a
+    process wide LRU cache keyed by the encoded key.
+    :param public_key_str: hex or compact encoded public key
+    :return:
+    """
+    return _cached_parse_public_key(public_key_str)
+
+
+def set_public_key_cache_size(maxsize: int):
+    """
+    Replace the public key cache with an empty cache of the given size
+    :param maxsize: maximum number of cached keys, 0 disables the cache
+    """
+    global _cached_parse_public_key
+    _cached_parse_public_key = lru_cache(maxsize=maxsize)(_parse_public_key)
+
+
+def public_key_cache_info():
+    """
+    :return: hits, misses, maxsize and current size of the public key cache
+    """
+    return _cached_parse_public_key.cache_info()
+
+
+def clear_public_key_cache():
+    _cached_parse_public_key.cache_clear()
+
+
+def load_participant_keys(
+    participants: List[BroadCastClientKeys],
+) -> Dict[str, ParticipantKeys]:
+    """
+    Parse the public keys of the participants of a round into a lookup table
+    :param participants: participants and their public keys broadcast by the server
+    :return: dictionary of the parsed keys by client id
+    """
+    return {
+        participant.client_id: ParticipantKeys(
+            cipher_public_key=load_public_key(participant.broadcast.cipher_public_key),
+            sharing_public_key=load_public_key(
+                participant.broadcast.sharing_public_key
+            ),
+        )
+        for participant in participants
+    }
+
+
+def get_participant_keys(
+    participant: BroadCastClientKeys,
+    participant_keys: Dict[str, ParticipantKeys] = None,
+) -> ParticipantKeys:
+    """
+    Look up the parsed keys of a participant in the table, or parse them when the participant is not in the table
+    :param participant: the participant and its public keys
+    :param participant_keys: optional lookup table of parsed keys by client id
+    :return:
+    """
+    if participant_keys is not None:
+        keys = participant_keys.get(participant.client_id)
+        if keys is not None:
+            return keys
+    return load_participant_keys([participant])[participant.client_id]
+
+
+def load_private_key(private_key_hex: str) -> PrivateKey:
+    """
+    Parse a hex encoded private key, either a PEM encoded SECP384R1 key or a raw X25519 key
+    :param private_key_hex: hex encoded private key
+    :return:
+    """
     private_key_bytes = bytes.fromhex(private_key_hex)
+    if len(private_key_bytes) == X25519_KEY_BYTES:
+        return X25519PrivateKey.from_private_bytes(private_key_bytes)
     private_key = load_pem_private_key(private_key_bytes, password=None)
     return private_key
+
+
+def serialize_public_key(public_key: PublicKey) -> str:
+    """
+    Serialize a public key to hex, raw bytes for X25519 and PEM for SECP384R1 keys
+    """
+    if isinstance(public_key, X25519PublicKey):
+        return public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw,
+        ).hex()
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).hex()
+
+
+def encode_public_key(public_key: PublicKey, key_encoding: str = "hex") -> str:
+    """
+    Encode a public key for transmission
+    :param public_key: SECP384R1 or X25519 public key
+    :param key_encoding: hex for hex encoded PEM/raw keys, compact for base64 encoded compressed points/raw keys
+    :return:
+    """
+    if key_encoding == "hex":
+        return serialize_public_key(public_key)
+    elif key_encoding == "compact":
+        if isinstance(public_key, X25519PublicKey):
+            public_bytes = public_key.public_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PublicFormat.Raw,
+            )
+        else:
+            public_bytes = public_key.public_bytes(
+                encoding=serialization.Encoding.X962,
+                format=serialization.PublicFormat.CompressedPoint,
+            )
+        return base64.b64encode(public_bytes).decode("ascii")
+    else:
+        raise ValueError(
+            f"Unknown key encoding: {key_encoding}, available: {KEY_ENCODINGS}"
+        )
+
+
+def serialize_private_key(private_key: PrivateKey) -> str:
+    """
+    Serialize a private key to hex, raw bytes for X25519 and PEM (PKCS8) for SECP384R1 keys
+    """
+    if isinstance(private_key, X25519PrivateKey):
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption(),
+        ).hex()
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).hex()
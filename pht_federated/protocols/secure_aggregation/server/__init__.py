@@ -1 +1,3 @@
+from .incremental import IncrementalAggregator  # noqa: F401
+from .routing import CipherRouter  # noqa: F401
 from .server_protocol import ServerProtocol  # noqa: F401
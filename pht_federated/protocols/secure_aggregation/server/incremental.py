@@ -0,0 +1,192 @@
+import threading
+from typing import List, Optional, Union
+
+import numpy as np
+
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    MaskedInput,
+    UnmaskShares,
+)
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    AggregatedParameters,
+    BroadCastClientKeys,
+    Round4Participant,
+    ServerUnmaskBroadCast,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+from pht_federated.protocols.secure_aggregation.secrets.masking import (
+    DEFAULT_CHUNK_SIZE,
+    mask_dtype,
+)
+from pht_federated.protocols.secure_aggregation.server.server_protocol import (
+    MaskedInputData,
+    ServerProtocol,
+    masked_input_array,
+    merge_manifests,
+)
+
+
+class IncrementalAggregator:
+    """
+    Aggregates the masked inputs of a single round of the protocol as they arrive. Each masked input is added to a
+    running sum when it is uploaded and can be dropped afterwards, so the memory of the server is bounded by the size
+    of the model instead of the number of participants. Once the unmask shares have been received, the masks are
+    removed from the sum.
+    """
+
+    def __init__(
+        self,
+        client_key_broadcasts: List[BroadCastClientKeys],
+        settings: SecureAggregationSettings = None,
+        input_size: int = None,
+        manifest: BlockManifest = None,
+    ):
+        """
+        :param client_key_broadcasts: keys submitted by the users in round 1 of the current iteration
+        :param settings: settings of the protocol, need to match the settings used by the clients
+        :param input_size: optional size of the inputs to allocate the sum upfront, otherwise it is allocated when
+            the first masked input arrives
+        :param manifest: optional layout of named parameter blocks in the inputs, taken from the masked input
+            messages if not given
+        """
+        self.protocol = ServerProtocol(settings=settings)
+        self.settings = self.protocol.settings
+        self.client_key_broadcasts = client_key_broadcasts
+        self.dtype = mask_dtype(self.settings.mask_mode)
+        self.manifest = manifest
+        if input_size is None and manifest is not None:
+            input_size = manifest.size
+        self.masked_sum = (
+            np.zeros(input_size, dtype=self.dtype) if input_size is not None else None
+        )
+        # users whose masked input has been added, in the order of arrival
+        self.participants: List[Union[int, str]] = []
+
+        self._registered = {str(bc.client_id) for bc in client_key_broadcasts}
+        self._added = set()
+        self._finished = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def restore(
+        cls,
+        client_key_broadcasts: List[BroadCastClientKeys],
+        masked_sum: Optional[np.ndarray],
+        participants: List[Union[int, str]],
+        settings: SecureAggregationSettings = None,
+        manifest: BlockManifest = None,
+    ) -> "IncrementalAggregator":
+        """
+        Continue the aggregation of a round from a running sum that has been persisted, e.g. by a server that stores
+        the sum after each upload
+        :param client_key_broadcasts: keys submitted by the users in round 1 of the current iteration
+        :param masked_sum: running sum of the masked inputs of the participants, None if no input has been added
+        :param participants: users whose masked inputs are part of the running sum, in the order of arrival
+        :param settings: settings of the protocol, need to match the settings used by the clients
+        :param manifest: layout of named parameter blocks in the inputs, if any
+        :return: aggregator continuing from the running sum
+        """
+        if (masked_sum is None) != (len(participants) == 0):
+            raise ValueError("The running sum does not match the participants")
+        aggregator = cls(client_key_broadcasts, settings=settings, manifest=manifest)
+        unknown = {str(p) for p in participants} - aggregator._registered
+        if unknown:
+            raise ValueError(
+                f"Users {sorted(unknown)} did not register keys in round 1"
+            )
+        if masked_sum is not None:
+            # copy the sum, it is updated in place
+            aggregator.masked_sum = np.array(masked_sum, dtype=aggregator.dtype)
+        aggregator.participants = list(participants)
+        aggregator._added = {str(p) for p in participants}
+        return aggregator
+
+    def add(self, user_id: Union[int, str], masked_input: MaskedInputData):
+        """
+        Add the masked input of a user to the running sum
+        :param user_id: id of the user that submitted the masked input
+        :param masked_input: masked input message, array or buffer of the masked values
+        """
+        values = masked_input_array(masked_input, self.dtype)
+        with self._lock:
+            if self._finished:
+                raise ValueError("The aggregation of this round has already finished")
+            if str(user_id) not in self._registered:
+                raise ValueError(f"User {user_id} did not register keys in round 1")
+            if str(user_id) in self._added:
+                raise ValueError(f"Masked input of user {user_id} already added")
+            manifest = merge_manifests(self.manifest, masked_input)
+            if manifest is not None and manifest.size != len(values):
+                raise ValueError(
+                    f"Masked input of size {len(values)} does not match the size of the manifest {manifest.size}"
+                )
+
+            if self.masked_sum is None:
+                self.masked_sum = np.zeros(len(values), dtype=self.dtype)
+            elif len(values) != len(self.masked_sum):
+                raise ValueError(
+                    f"Masked input of size {len(values)} does not match the size of the sum {len(self.masked_sum)}"
+                )
+            # in the integer modes the sum wraps around mod 2^n
+            np.add(self.masked_sum, values, out=self.masked_sum)
+
+            self.manifest = manifest
+            self._added.add(str(user_id))
+            self.participants.append(user_id)
+
+    def add_masked_input(self, masked_input: MaskedInput):
+        """
+        Add a masked input message to the running sum
+        """
+        self.add(masked_input.user_id, masked_input)
+
+    @property
+    def n_inputs(self) -> int:
+        return len(self.participants)
+
+    def unmask_broadcast(self) -> ServerUnmaskBroadCast:
+        """
+        Broadcast the users whose masked inputs have been added as the participants of the unmasking round
+        """
+        participants = [
+            Round4Participant(user_id=user_id) for user_id in self.participants
+        ]
+        return ServerUnmaskBroadCast(participants=participants)
+
+    def finalize(
+        self,
+        unmask_shares: List[UnmaskShares],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        n_workers: int = 1,
+        n_processes: int = 1,
+    ) -> AggregatedParameters:
+        """
+        Remove the masks from the running sum with the unmask shares received in round 4. No further masked inputs
+        can be added afterwards.
+        :param unmask_shares: unmask shares submitted by the users in the current iteration
+        :param chunk_size: number of items unmasked at once
+        :param n_workers: number of threads used to generate the reverse mask chunks
+        :param n_processes: number of processes recovering the masks of dropped users
+        :return: Aggregated parameters to be sent back to the users
+        """
+        with self._lock:
+            if self._finished:
+                raise ValueError("The aggregation of this round has already finished")
+            if self.masked_sum is None:
+                raise ValueError("No masked inputs to aggregate")
+            self._finished = True
+
+        # in float mode the sum can be unmasked in place
+        unmasked_sum = self.protocol.unmask_sum(
+            self.masked_sum,
+            self.client_key_broadcasts,
+            unmask_shares,
+            out=self.masked_sum if self.settings.mask_mode == "float" else None,
+            chunk_size=chunk_size,
+            n_workers=n_workers,
+            n_processes=n_processes,
+        )
+        return AggregatedParameters(params=unmasked_sum, manifest=self.manifest)
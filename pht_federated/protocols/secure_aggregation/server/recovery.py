@@ -0,0 +1,262 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import Manager, shared_memory
+from typing import ContextManager, Dict, Hashable, Iterable, List, Set, Tuple
+
+import numpy as np
+
+from pht_federated.protocols.secure_aggregation.models.secrets import KeyShare
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.secrets.graph import neighbourhood
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    DEFAULT_CIPHER_SUITE,
+)
+from pht_federated.protocols.secure_aggregation.secrets.masking import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MASK_MODE,
+    DEFAULT_PRG,
+    _signed_peers,
+    add_mask_streams,
+    create_generator,
+    mask_dtype,
+    shared_mask_seed,
+)
+from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
+    DEFAULT_SHAMIR_ENGINE,
+    combine_key_shares_batch,
+)
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    load_private_key,
+    load_public_key,
+    serialize_private_key,
+)
+
+
+def dropout_peers(
+    dropped_users: Set[Hashable],
+    client_key_broadcasts: List[BroadCastClientKeys],
+    survivors: Set[Hashable],
+    graph_degree: int = None,
+) -> Dict[Hashable, List[Tuple[int, BroadCastClientKeys]]]:
+    """
+    Find the peers whose shared masks with the dropped users remain in the masked sum. Only the masks shared with
+    neighbours that submitted a masked input are part of the sum, the masks between two dropped users never entered
+    it. The neighbourhoods are computed on the round 1 participant list, the same list the clients masked with.
+
+    :param dropped_users: ids of the users that dropped out before submitting a masked input
+    :param client_key_broadcasts: keys submitted by the users in round 1, in the order of the server key broadcast
+    :param survivors: ids of the users whose masked inputs are part of the sum
+    :param graph_degree: degree of the communication graph, None for the complete graph
+    :return: dictionary of the dropped users and their surviving peers, together with the sign the recovered shared
+        mask is added to the masked sum with
+    """
+    overlap = dropped_users & survivors
+    if overlap:
+        raise ValueError(
+            f"Users {sorted(overlap)} submitted a masked input, their sharing keys must not be recovered"
+        )
+    registered = {bc.client_id for bc in client_key_broadcasts}
+    unknown = dropped_users - registered
+    if unknown:
+        raise ValueError(f"Users {sorted(unknown)} did not register keys in round 1")
+
+    peers = {}
+    for user_id in dropped_users:
+        # the surviving peer applied the shared mask with the opposite sign of the dropped user, adding it with the
+        # sign the dropped user would have applied it with cancels it as if its masked input had been submitted
+        peers[user_id] = [
+            (sign, peer)
+            for sign, peer in _signed_peers(
+                user_id, neighbourhood(user_id, client_key_broadcasts, graph_degree)
+            )
+            if peer.client_id in survivors
+        ]
+    return peers
+
+
+def check_key_shares(
+    user_key_shares: Dict[Hashable, List[KeyShare]],
+    users: Iterable[Hashable],
+    threshold: int,
+):
+    """
+    Check that enough key shares have been submitted to recover the sharing keys of the dropped users. Combining fewer
+    shares than the threshold the keys were split with does not fail, but recovers a wrong key.
+    :param user_key_shares: key shares of the sharing keys of the dropped users
+    :param users: dropped users whose sharing keys are recovered
+    :param threshold: minimum number of shares the clients split their sharing keys with
+    """
+    for user_id in users:
+        if len(user_key_shares.get(user_id, [])) < threshold:
+            raise ValueError(
+                f"Not enough key shares to recover the sharing key of {user_id}"
+            )
+
+
+def recover_dropout_masks(
+    n_params: int,
+    user_key_shares: Dict[Hashable, List[KeyShare]],
+    peers: Dict[Hashable, List[Tuple[int, BroadCastClientKeys]]],
+    prg: str = DEFAULT_PRG,
+    mode: str = DEFAULT_MASK_MODE,
+    cipher_suite: str = DEFAULT_CIPHER_SUITE,
+    shamir_engine: str = DEFAULT_SHAMIR_ENGINE,
+    key_sharing: str = "key",
+    threshold: int = 3,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    n_processes: int = 2,
+    executor: Executor = None,
+) -> np.ndarray:
+    """
+    Recover the sharing keys of the dropped users and expand their shared masks with the surviving peers in parallel.
+    The sharing keys are combined in batches of users, afterwards the (user, peer) pairs are split into one batch per
+    worker. Each batch expands its masks chunk by chunk and adds the chunks into a single accumulator in shared memory
+    under a lock, so only one sum sized buffer is allocated independent of the number of workers.
+
+    :param n_params: size of the masked inputs
+    :param user_key_shares: key shares of the sharing keys of the dropped users
+    :param peers: surviving peers of the dropped users and the signs of the shared masks, see dropout_peers
+    :param prg: name of the pseudo random generator used to expand the shared seeds
+    :param mode: masking mode
+    :param cipher_suite: cipher suite of the sharing keys
+    :param shamir_engine: shamir secret sharing engine used by the clients
+    :param key_sharing: whether the clients shared their sharing keys or the seeds the keys are derived from
+    :param threshold: minimum number of shares the clients split their sharing keys with
+    :param chunk_size: number of items drawn from the generators at once
+    :param n_processes: number of worker processes, if no executor is given
+    :param executor: optional executor to run the batches with, takes precedence over n_processes, the work is split
+        into one batch per worker of the executor
+    :return: array in the dtype of the masking mode, adding it to the masked sum removes the shared masks of the
+        dropped users
+    """
+    check_key_shares(user_key_shares, peers, threshold)
+    dtype = mask_dtype(mode)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_processes)
+    n_batches = max(_executor_workers(executor, default=n_processes), 1)
+
+    accumulator = shared_memory.SharedMemory(
+        create=True, size=max(n_params * dtype.itemsize, 1)
+    )
+    # the lock is shared with the workers of any executor through a manager process
+    manager = Manager()
+    try:
+        # recover the sharing keys, the keys are passed between processes serialized
+        users = list(peers)
+        key_batches = [
+            {user_id: user_key_shares[user_id] for user_id in users[i::n_batches]}
+            for i in range(n_batches)
+        ]
+        sharing_keys = {}
+        for batch_keys in executor.map(
+            _recover_sharing_keys,
+            [batch for batch in key_batches if batch],
+            repeat(cipher_suite),
+            repeat(shamir_engine),
+            repeat(key_sharing),
+            repeat(threshold),
+        ):
+            sharing_keys.update(batch_keys)
+
+        # expand the shared masks, all batches of (user, peer) pairs add into the same accumulator
+        pairs = [
+            (sharing_keys[user_id], sign, peer.broadcast.sharing_public_key)
+            for user_id, user_peers in peers.items()
+            for sign, peer in user_peers
+        ]
+        np.ndarray((n_params,), dtype=dtype, buffer=accumulator.buf)[:] = 0
+        pair_batches = [pairs[i::n_batches] for i in range(n_batches)]
+        list(
+            executor.map(
+                _expand_shared_masks,
+                repeat(accumulator.name),
+                repeat(manager.Lock()),
+                [batch for batch in pair_batches if batch],
+                repeat(n_params),
+                repeat(dtype.str),
+                repeat(prg),
+                repeat(mode),
+                repeat(chunk_size),
+            )
+        )
+        # copy the correction out of the shared memory before releasing it
+        correction = np.ndarray((n_params,), dtype=dtype, buffer=accumulator.buf).copy()
+    finally:
+        manager.shutdown()
+        accumulator.close()
+        accumulator.unlink()
+        if own_executor:
+            executor.shutdown()
+    return correction
+
+
+def _executor_workers(executor: Executor, default: int = 1) -> int:
+    """
+    Get the number of workers of an executor
+    :param executor: thread or process pool executor
+    :param default: number of workers assumed for executors that do not expose it
+    :return: number of workers
+    """
+    # both executors of the standard library store the number of workers they were created with
+    return getattr(executor, "_max_workers", default)
+
+
+def _recover_sharing_keys(
+    user_key_shares: Dict[Hashable, List[KeyShare]],
+    cipher_suite: str,
+    shamir_engine: str,
+    key_sharing: str,
+    threshold: int,
+) -> Dict[Hashable, str]:
+    """
+    Combine the key shares of a batch of users, returning the serialized sharing keys
+    """
+    sharing_keys = combine_key_shares_batch(
+        user_key_shares,
+        k=threshold,
+        cipher_suite=cipher_suite,
+        engine=shamir_engine,
+        key_sharing=key_sharing,
+    )
+    return {
+        user_id: serialize_private_key(key) for user_id, key in sharing_keys.items()
+    }
+
+
+def _expand_shared_masks(
+    accumulator_name: str,
+    lock: ContextManager,
+    pairs: List[Tuple[str, int, str]],
+    n_params: int,
+    dtype: str,
+    prg: str,
+    mode: str,
+    chunk_size: int,
+):
+    """
+    Add the signed shared masks of a batch of (sharing key, sign, public key) pairs into the shared accumulator. The
+    masks are summed chunk by chunk in a local buffer, which is added to the accumulator while holding the lock.
+    """
+    accumulator = shared_memory.SharedMemory(name=accumulator_name)
+    try:
+        out = np.ndarray((n_params,), dtype=np.dtype(dtype), buffer=accumulator.buf)
+        streams = []
+        for sharing_key, sign, public_key in pairs:
+            shared_seed = shared_mask_seed(
+                load_private_key(sharing_key), load_public_key(public_key)
+            )
+            streams.append((sign, create_generator(shared_seed, prg=prg)))
+        buffer = np.empty(min(chunk_size, n_params), dtype=np.dtype(dtype))
+        for start in range(0, n_params, chunk_size):
+            chunk = buffer[: min(chunk_size, n_params - start)]
+            chunk[:] = 0
+            add_mask_streams(chunk, streams, mode=mode)
+            # integer accumulators wrap around mod 2^n
+            with lock:
+                out[start : start + len(chunk)] += chunk
+        del out
+    finally:
+        accumulator.close()
@@ -0,0 +1,68 @@
+from typing import Dict, Iterable, List, Union
+
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    ShareKeysMessage,
+)
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    ServerCipherBroadcast,
+    UserCipher,
+)
+
+
+class CipherRouter:
+    """
+    Index of the ciphers submitted in round 2 of the protocol by their recipient. The ciphers of all users are sorted
+    into their recipients' buckets once when the round closes, afterwards the cipher broadcast of each user is served
+    from its bucket instead of scanning the ciphers of all users again.
+    """
+
+    def __init__(self, shared_ciphers: Iterable[ShareKeysMessage] = ()):
+        """
+        :param shared_ciphers: share keys messages received in round 2
+        """
+        self.senders: List[Union[int, str]] = []
+        self._sender_ids = set()
+        self._recipient_ciphers: Dict[str, List[UserCipher]] = {}
+        for message in shared_ciphers:
+            self.add(message)
+
+    def add(self, message: ShareKeysMessage):
+        """
+        Sort the ciphers of a share keys message into the buckets of their recipients
+        :param message: share keys message of a user
+        """
+        if str(message.client_id) in self._sender_ids:
+            raise ValueError(f"Ciphers of user {message.client_id} already added")
+        self._sender_ids.add(str(message.client_id))
+        self.senders.append(message.client_id)
+
+        for cipher in message.ciphers:
+            # don't route ciphers a user addressed to itself
+            if cipher.recipient == message.client_id:
+                continue
+            # the ciphers have been validated when the message was parsed
+            user_cipher = UserCipher.construct(
+                sender=message.client_id,
+                receiver=cipher.recipient,
+                envelope=cipher.envelope,
+                cipher=cipher.cipher,
+            )
+            self._recipient_ciphers.setdefault(str(cipher.recipient), []).append(
+                user_cipher
+            )
+
+    def ciphers(self, client_id: Union[int, str]) -> List[UserCipher]:
+        """
+        Get the ciphers addressed to a user, in the order the senders were added
+        :param client_id: id of the recipient
+        :return: list of ciphers addressed to the user
+        """
+        return list(self._recipient_ciphers.get(str(client_id), []))
+
+    def broadcast(self, client_id: Union[int, str]) -> ServerCipherBroadcast:
+        """
+        Broadcast the ciphers addressed to a specific user
+        :param client_id: the user id to which the ciphers are addressed
+        :return: ServerCipherBroadcast containing all ciphers addressed to the user in the current iteration
+        """
+        return ServerCipherBroadcast.construct(ciphers=self.ciphers(client_id))
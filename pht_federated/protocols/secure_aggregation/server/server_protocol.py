@@ -1,8 +1,10 @@
 import uuid
-from typing import List, Tuple, Union
+from concurrent.futures import Executor
+from typing import Dict, Hashable, List, Optional, Tuple, Union
 
 import numpy as np
 
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
 from pht_federated.protocols.secure_aggregation.models.client_messages import (
     MaskedInput,
     ShareKeysMessage,
@@ -10,6 +12,10 @@ from pht_federated.protocols.secure_aggregation.models.client_messages import (
     UnmaskSeedShare,
     UnmaskShares,
 )
+from pht_federated.protocols.secure_aggregation.models.secrets import (
+    KeyShare,
+    SeedShare,
+)
 from pht_federated.protocols.secure_aggregation.models.server_messages import (
     AggregatedParameters,
     BroadCastClientKeys,
@@ -17,56 +23,135 @@ from pht_federated.protocols.secure_aggregation.models.server_messages import (
     ServerCipherBroadcast,
     ServerKeyBroadcast,
     ServerUnmaskBroadCast,
-    UserCipher,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    DEFAULT_CIPHER_SUITE,
+    SharedKeyCache,
 )
 from pht_federated.protocols.secure_aggregation.secrets.masking import (
-    expand_seed,
-    generate_shared_mask,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_PRG,
+    MaskGenerator,
+    add_mask_streams,
+    create_generator,
+    decode_fixed_point,
     integer_seed_from_hex,
+    mask_dtype,
+    shared_mask_seed,
 )
 from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
-    combine_key_shares,
-    combine_seed_shares,
+    DEFAULT_SHAMIR_ENGINE,
+    combine_key_shares_batch,
+    combine_seed_shares_batch,
 )
 from pht_federated.protocols.secure_aggregation.secrets.util import load_public_key
+from pht_federated.protocols.secure_aggregation.server.recovery import (
+    check_key_shares,
+    dropout_peers,
+    recover_dropout_masks,
+)
+from pht_federated.protocols.secure_aggregation.server.routing import CipherRouter
+
+# a masked input message, an array of masked values or a buffer containing the masked values in the dtype of the
+# masking mode
+MaskedInputData = Union[MaskedInput, np.ndarray, bytes, bytearray, memoryview]
+
+
+def masked_input_array(masked_input: MaskedInputData, dtype: np.dtype) -> np.ndarray:
+    """
+    Get the masked values of a masked input as an array of the given dtype, without copying arrays and buffers that
+    already have the dtype
+    :param masked_input: masked input message, array or buffer
+    :param dtype: dtype of the masking mode
+    :return: one dimensional array of the masked values
+    """
+    if isinstance(masked_input, MaskedInput):
+        masked_input = masked_input.masked_input
+    if isinstance(masked_input, (bytes, bytearray, memoryview)):
+        return np.frombuffer(masked_input, dtype=dtype)
+    return np.asarray(masked_input, dtype=dtype)
+
+
+def merge_manifests(
+    manifest: Optional[BlockManifest], masked_input: MaskedInputData
+) -> Optional[BlockManifest]:
+    """
+    Check that the block manifest of a masked input matches the manifest of the previous inputs
+    :param manifest: manifest of the previous masked inputs, if any
+    :param masked_input: masked input message, array or buffer, only messages carry a manifest
+    :return: the manifest of the aggregated inputs
+    """
+    if not isinstance(masked_input, MaskedInput) or masked_input.manifest is None:
+        return manifest
+    if manifest is None:
+        return masked_input.manifest
+    if masked_input.manifest != manifest:
+        raise ValueError(
+            f"Block manifest of the masked input of {masked_input.user_id} does not match the other inputs"
+        )
+    return manifest
 
 
-def _recover_shared_masks(
-    user_key_shares: dict,
-    client_key_broadcasts: List[BroadCastClientKeys],
-    mask_size: int = 100,
-) -> np.ndarray:
+def _recover_shared_mask_streams(
+    user_key_shares: Dict[Hashable, List[KeyShare]],
+    peers: Dict[Hashable, List[Tuple[int, BroadCastClientKeys]]],
+    prg: str = DEFAULT_PRG,
+    cache: SharedKeyCache = None,
+    cipher_suite: str = DEFAULT_CIPHER_SUITE,
+    shamir_engine: str = DEFAULT_SHAMIR_ENGINE,
+    key_sharing: str = "key",
+    threshold: int = 3,
+) -> List[Tuple[int, MaskGenerator]]:
     """
-    Use a dictionary of key shares to recover the shared masks
+    Use a dictionary of key shares to recover the generators of the shared masks between the dropped users and their
+    surviving peers
     :param user_key_shares: dictionary containing a users key shares key: user_id, value: key shares for that user's
     sharing key
-    :param client_key_broadcasts: List of public keys submitted by the clients
-    :param mask_size: the size of the mask to generate
-    :return: a numpy arra of size mask_size containing the recovered shared masks between users that dropped out before
-    round 2.
+    :param peers: surviving peers of the dropped users and the signs of the shared masks, see dropout_peers
+    :param prg: name of the pseudo random generator used to expand the shared seeds
+    :param cache: optional cache of derived shared keys
+    :param cipher_suite: cipher suite of the sharing keys
+    :param shamir_engine: shamir secret sharing engine used by the clients
+    :param key_sharing: whether the clients shared their sharing keys or the seeds the keys are derived from
+    :param threshold: minimum number of shares the clients split their sharing keys with
+    :return: list of (sign, generator) tuples of the recovered shared masks of the users that dropped out before
+    round 2, the sign is the one the masks are added to the unmasked sum with.
     """
-    reverse_shared_mask = np.zeros(mask_size)
-    for broad_cast in client_key_broadcasts:
-        sharing_key_shares = user_key_shares[broad_cast.client_id]
-        recovered_sharing_key = combine_key_shares(
-            sharing_key_shares, k=len(client_key_broadcasts) - 1
-        )
+    # recover the sharing keys of the dropped users in one batch
+    check_key_shares(user_key_shares, peers, threshold)
+    recovered_sharing_keys = combine_key_shares_batch(
+        {user_id: user_key_shares[user_id] for user_id in peers},
+        k=threshold,
+        cipher_suite=cipher_suite,
+        engine=shamir_engine,
+        key_sharing=key_sharing,
+    )
 
-        for receiver_broadcast in client_key_broadcasts:
-            if receiver_broadcast.client_id != broad_cast.client_id:
-                sharing_public_key = load_public_key(
-                    receiver_broadcast.broadcast.sharing_public_key
-                )
-                reverse_shared_mask += generate_shared_mask(
-                    private_key=recovered_sharing_key,
-                    public_key=sharing_public_key,
-                    n_items=mask_size,
-                )
+    streams = []
+    for user_id, user_peers in peers.items():
+        recovered_sharing_key = recovered_sharing_keys[user_id]
+        for sign, peer in user_peers:
+            sharing_public_key = load_public_key(peer.broadcast.sharing_public_key)
+            shared_seed = shared_mask_seed(
+                recovered_sharing_key, sharing_public_key, cache=cache
+            )
+            streams.append((sign, create_generator(shared_seed, prg=prg)))
 
-    return reverse_shared_mask
+    return streams
 
 
 class ServerProtocol:
+    def __init__(self, settings: SecureAggregationSettings = None):
+        """
+        :param settings: settings of the protocol, need to match the settings used by the clients
+        """
+        self.settings = settings if settings else SecureAggregationSettings()
+        # shared keys derived while recovering the masks of dropped users, cleared after unmasking
+        self.key_cache = SharedKeyCache()
+
     @staticmethod
     def broadcast_keys(
         protocol_id: Union[uuid.UUID, str],
@@ -80,8 +165,9 @@ class ServerProtocol:
         :param client_keys: list of client key broadcasts submitted to the server
         :return: server broadcast containing the client keys
         """
-        return ServerKeyBroadcast(
-            protocol_id=protocol_id, round_id=round_id, participants=client_keys
+        # the client keys have been validated when they were submitted
+        return ServerKeyBroadcast.construct(
+            protocol_id=protocol_id, round_id=round_id, participants=list(client_keys)
         )
 
     @staticmethod
@@ -90,30 +176,22 @@ class ServerProtocol:
         shared_ciphers: List[ShareKeysMessage],
     ) -> ServerCipherBroadcast:
         """
-        Broadcast a list of ciphers addressed to a specific user
+        Broadcast a list of ciphers addressed to a specific user. To serve the broadcasts of all users, index the
+        ciphers once with route_ciphers instead.
         :param shared_ciphers: list of ciphers received in round 2
         :param client_id: the user id to which the ciphers are addressed
         :return: ServerCipherBroadcast containing all ciphers addressed to the user in the current iteration
         """
-        user_ciphers = []
-        # iterate over all ciphers received in the previous round
-        for message in shared_ciphers:
-            # don't add the user's own cipher
-            if message.client_id == client_id:
-                pass
-            else:
-                # from cipher submitted by other users get the cipher addressed to the user
-                for cipher in message.ciphers:
-                    if cipher.recipient == client_id:
-                        user_cipher = UserCipher(
-                            sender=message.client_id,
-                            receiver=client_id,
-                            cipher=cipher.cipher,
-                        )
-
-                        user_ciphers.append(user_cipher)
-
-        return ServerCipherBroadcast(ciphers=user_ciphers)
+        return CipherRouter(shared_ciphers).broadcast(client_id)
+
+    @staticmethod
+    def route_ciphers(shared_ciphers: List[ShareKeysMessage]) -> CipherRouter:
+        """
+        Index the ciphers received in round 2 by their recipient, to serve the cipher broadcasts of all users
+        :param shared_ciphers: list of ciphers received in round 2
+        :return: CipherRouter serving the cipher broadcast of each user
+        """
+        return CipherRouter(shared_ciphers)
 
     @staticmethod
     def broadcast_unmask_participants(
@@ -127,26 +205,101 @@ class ServerProtocol:
         """
         # todo add signatures
         participants = [
-            Round4Participant(user_id=mask_in.user_id) for mask_in in masked_inputs
+            Round4Participant.construct(user_id=mask_in.user_id)
+            for mask_in in masked_inputs
         ]
-        return ServerUnmaskBroadCast(participants=participants)
+        return ServerUnmaskBroadCast.construct(participants=participants)
 
     def aggregate_masked_inputs(
         self,
         client_key_broadcasts: List[BroadCastClientKeys],
-        masked_inputs: List[MaskedInput],
+        masked_inputs: List[MaskedInputData],
         unmask_shares: List[UnmaskShares],
+        n_processes: int = 1,
+        executor: Executor = None,
+        manifest: BlockManifest = None,
     ) -> AggregatedParameters:
         """
         Aggregate the masked inputs received in round 3 and unmask shares received in round 4. Use this to generate
         reverse masks to aggregate the masked inputs resulting in the unmasked sum of the masked inputs.
 
         :param client_key_broadcasts: keys submitted by the users in the current iteration
-        :param masked_inputs: masked inputs submitted by the users in the current iteration
+        :param masked_inputs: masked inputs submitted by the users in the current iteration, as messages, arrays or
+            buffers of the masked values
         :param unmask_shares: unmask shares submitted by the users in the current iteration
+        :param n_processes: number of processes recovering the masks of dropped users
+        :param executor: optional executor to recover the masks of dropped users with
+        :param manifest: optional layout of named parameter blocks in the inputs, taken from the masked input
+            messages if not given
         :return: Aggregated parameters to be sent back to the users
         """
 
+        mode = self.settings.mask_mode
+        dtype = mask_dtype(mode)
+
+        # sum the masked inputs into a single accumulator, in the integer modes the sum wraps around mod 2^n
+        masked_sum = None
+        for masked_input in masked_inputs:
+            manifest = merge_manifests(manifest, masked_input)
+            values = masked_input_array(masked_input, dtype)
+            if masked_sum is None:
+                masked_sum = np.zeros(len(values), dtype=dtype)
+            elif len(values) != len(masked_sum):
+                raise ValueError(
+                    f"Masked inputs must have the same size, found {len(values)} and {len(masked_sum)}"
+                )
+            np.add(masked_sum, values, out=masked_sum)
+        if masked_sum is None:
+            raise ValueError("No masked inputs to aggregate")
+        if manifest is not None and manifest.size != len(masked_sum):
+            raise ValueError(
+                f"Masked inputs of size {len(masked_sum)} do not match the size of the manifest {manifest.size}"
+            )
+
+        # in float mode the sum can be unmasked in place
+        unmasked_sum = self.unmask_sum(
+            masked_sum,
+            client_key_broadcasts,
+            unmask_shares,
+            out=masked_sum if mode == "float" else None,
+            n_processes=n_processes,
+            executor=executor,
+        )
+
+        return AggregatedParameters(params=unmasked_sum, manifest=manifest)
+
+    def unmask_sum(
+        self,
+        masked_sum: np.ndarray,
+        client_key_broadcasts: List[BroadCastClientKeys],
+        unmask_shares: List[UnmaskShares],
+        out: np.ndarray = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        n_workers: int = 1,
+        n_processes: int = 1,
+        executor: Executor = None,
+    ) -> np.ndarray:
+        """
+        Remove the masks from the sum of the masked inputs block-wise. The reverse masks are generated chunk by chunk
+        from the recovered seeds, so only chunk sized buffers are allocated in addition to the sum and the output.
+
+        :param masked_sum: sum of the masked inputs, with the dtype of the masking mode
+        :param client_key_broadcasts: keys submitted by the users in the current iteration
+        :param unmask_shares: unmask shares submitted by the users in the current iteration
+        :param out: optional buffer of the size of the sum to write the unmasked sum to, in float mode this can be the
+            masked sum itself
+        :param chunk_size: number of items unmasked at once
+        :param n_workers: number of threads used to generate the reverse mask chunks
+        :param n_processes: if larger than one, the masks of dropped users are recovered by a pool of this many
+            processes, which add the masks into a single shared accumulator of the size of the sum
+        :param executor: optional executor to recover the masks of dropped users with, takes precedence over
+            n_processes, the work is split between all of its workers
+        :return: the unmasked sum, decoded into floats in the integer masking modes
+        """
+        mode = self.settings.mask_mode
+        if out is None:
+            out = np.empty(len(masked_sum), dtype=np.float64)
+
         # extract seed and key shares from the submitted unmask shares
         seed_shares = []
         key_shares = []
@@ -154,62 +307,101 @@ class ServerProtocol:
             seed_shares.extend(unmask_share.seed_shares)
             key_shares.extend(unmask_share.key_shares)
 
-        input_size = len(masked_inputs[0].masked_input)
-        # sum the masked inputs
-        masked_sum = np.zeros(input_size)
-        for masked_input in masked_inputs:
-            masked_sum += masked_input.masked_input
+        user_seed_shares, user_key_shares = self._group_shares(seed_shares, key_shares)
+        # only the shared masks of dropped users with surviving peers are part of the sum
+        peers = dropout_peers(
+            set(user_key_shares),
+            client_key_broadcasts,
+            set(user_seed_shares),
+            graph_degree=self.settings.graph_degree,
+        )
 
-        # generate the reverse masks
-        reverse_mask, reverse_shared_mask = self._generate_reverse_mask(
-            seed_shares, key_shares, client_key_broadcasts, mask_size=input_size
+        streams = self._reverse_mask_streams(
+            user_seed_shares,
+            prg=self.settings.prg,
+            shamir_engine=self.settings.shamir_engine,
         )
-        # subtract the seed based mask
-        unmasked_sum = masked_sum - reverse_mask
-        # for each dropped out user (if any) add the recovered shared mask
-        if reverse_shared_mask:
-            unmasked_sum += reverse_shared_mask
+        correction = None
+        if peers and (n_processes > 1 or executor is not None):
+            correction = recover_dropout_masks(
+                len(masked_sum),
+                user_key_shares,
+                peers,
+                prg=self.settings.prg,
+                mode=mode,
+                cipher_suite=self.settings.cipher_suite,
+                shamir_engine=self.settings.shamir_engine,
+                key_sharing=self.settings.key_sharing,
+                threshold=self.settings.threshold,
+                chunk_size=chunk_size,
+                n_processes=n_processes,
+                executor=executor,
+            )
+        elif peers:
+            streams.extend(
+                _recover_shared_mask_streams(
+                    user_key_shares,
+                    peers,
+                    prg=self.settings.prg,
+                    cache=self.key_cache,
+                    cipher_suite=self.settings.cipher_suite,
+                    shamir_engine=self.settings.shamir_engine,
+                    key_sharing=self.settings.key_sharing,
+                    threshold=self.settings.threshold,
+                )
+            )
+        # the shared seeds have been derived, the keys are not needed after the round
+        self.key_cache.clear()
 
-        return AggregatedParameters(params=list(unmasked_sum))
+        for start in range(0, len(masked_sum), chunk_size):
+            chunk = masked_sum[start : start + chunk_size].copy()
+            add_mask_streams(chunk, streams, mode=mode, n_workers=n_workers)
+            if correction is not None:
+                chunk += correction[start : start + chunk_size]
+            # decode the fixed point sum
+            if mode != "float":
+                chunk = decode_fixed_point(chunk, mode, self.settings.fixed_point_scale)
+            out[start : start + chunk_size] = chunk
+
+        return out
 
     @staticmethod
-    def _generate_reverse_mask(
+    def _group_shares(
         seed_shares: List[UnmaskSeedShare],
         key_shares: List[UnmaskKeyShare],
-        client_key_broadcasts: List[BroadCastClientKeys],
-        mask_size: int = 100,
-    ) -> Tuple[np.ndarray, Union[np.ndarray, None]]:
+    ) -> Tuple[Dict[Hashable, List[SeedShare]], Dict[Hashable, List[KeyShare]]]:
         """
-        Generate the reverse mask to unmask the sum of masked inputs
-        :param seed_shares: shamir shares of the seed for all participants
-        :param key_shares: shamir shares of the sharing key for all participants that dropped out in before round 2
-        :param client_key_broadcasts: list of public keys broadcast by the clients in round 1
-        :param mask_size: the size of the revers mask to generate
-        :return:
+        Group the submitted seed and key shares by the user they belong to. Seed shares are submitted for the users
+        whose masked inputs are part of the sum, key shares for the users that dropped out before submitting theirs.
+        :param seed_shares: shamir shares of the seeds of the surviving users
+        :param key_shares: shamir shares of the sharing keys of the dropped users
+        :return: dictionaries of the seed shares and key shares per user
         """
-        user_seed_shares = {bc.client_id: [] for bc in client_key_broadcasts}
-        user_key_shares = {bc.client_id: [] for bc in client_key_broadcasts}
-
-        # aggregate the seed shares and key shares
+        user_seed_shares = {}
+        user_key_shares = {}
         for share in seed_shares:
-            user_seed_shares[share.user_id].append(share.seed_share)
+            user_seed_shares.setdefault(share.user_id, []).append(share.seed_share)
         for share in key_shares:
-            user_key_shares[share.user_id].append(share.key_share)
+            user_key_shares.setdefault(share.user_id, []).append(share.key_share)
+        return user_seed_shares, user_key_shares
 
-        # expand the combined random seed into the user masks
-        seeds = [
-            integer_seed_from_hex(combine_seed_shares(shares).hex())
-            for user_id, shares in user_seed_shares.items()
+    @staticmethod
+    def _reverse_mask_streams(
+        user_seed_shares: Dict[Hashable, List[SeedShare]],
+        prg: str = DEFAULT_PRG,
+        shamir_engine: str = DEFAULT_SHAMIR_ENGINE,
+    ) -> List[Tuple[int, MaskGenerator]]:
+        """
+        Generate the generators of the reverse private masks of the surviving users
+        :param user_seed_shares: shamir shares of the seeds per surviving user
+        :param prg: name of the pseudo random generator used to expand the seeds
+        :param shamir_engine: shamir secret sharing engine used by the clients
+        :return: list of (sign, generator) tuples, adding the generated masks with their sign to the masked sum
+        removes the private masks
+        """
+        # subtract the masks expanded from the random seeds, combined in one batch
+        seeds = combine_seed_shares_batch(user_seed_shares, engine=shamir_engine)
+        return [
+            (-1, create_generator(integer_seed_from_hex(seed.hex()), prg=prg))
+            for seed in seeds.values()
         ]
-        # subtract the expanded user seeds
-        reverse_mask = np.zeros(mask_size)
-        for seed in seeds:
-            reverse_mask += expand_seed(seed, mask_size)
-
-        if len(key_shares) > 0:
-            reverse_shared_mask = _recover_shared_masks(
-                user_key_shares, client_key_broadcasts, mask_size
-            )
-            return reverse_mask, reverse_shared_mask
-        else:
-            return reverse_mask, None
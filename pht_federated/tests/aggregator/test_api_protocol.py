@@ -2,14 +2,31 @@
 import time
 import uuid
 
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 
 from pht_federated.aggregator.api.dependencies import get_db
 from pht_federated.aggregator.app import app
+from pht_federated.aggregator.services.secure_aggregation.service import (
+    secure_aggregation,
+)
+from pht_federated.aggregator.services.secure_aggregation.steps import aggregation
 from pht_federated.protocols.secure_aggregation.client.client_protocol import (
     ClientProtocol,
 )
+from pht_federated.protocols.secure_aggregation.models.binary import (
+    BINARY_MEDIA_TYPE,
+)
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    AggregatedParameters,
+    ServerCipherBroadcast,
+    ServerKeyBroadcast,
+    ServerUnmaskBroadCast,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
 from pht_federated.tests.aggregator.test_db import override_get_db
 
 app.dependency_overrides[get_db] = override_get_db
@@ -241,6 +258,42 @@ def test_register_for_protocol():
     assert response.json()["currently_registered"] == 2
 
 
+def test_register_compact_keys():
+    data = {"name": "Test Protocol"}
+    response = client.post("/api/protocol", json=data)
+    protocol_id = response.json()["id"]
+
+    response = client.put(
+        f"/api/protocol/{protocol_id}/settings", json={"key_encoding": "compact"}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["key_encoding"] == "compact"
+
+    # hex encoded keys are rejected
+    keys, broadcast = ClientProtocol().setup()
+    response = client.post(
+        f"/api/protocol/{protocol_id}/register", json=broadcast.dict()
+    )
+    assert response.status_code == 400, response.text
+
+    client_protocol = ClientProtocol(
+        settings=SecureAggregationSettings(key_encoding="compact")
+    )
+    broadcasts = []
+    for _ in range(3):
+        keys, broadcast = client_protocol.setup()
+        broadcasts.append(broadcast)
+        response = client.post(
+            f"/api/protocol/{protocol_id}/register", json=broadcast.dict()
+        )
+        assert response.status_code == 200, response.text
+
+    response = client.get(f"/api/protocol/{protocol_id}/keyBroadcasts")
+    assert response.status_code == 200, response.text
+    key_broadcast = ServerKeyBroadcast(**response.json())
+    assert [p.broadcast for p in key_broadcast.participants] == broadcasts
+
+
 def test_get_protocol_settings():
     # create a protocol
     data = {"name": "Test Protocol"}
@@ -369,12 +422,35 @@ def test_get_protocol_status():
 
     response = client.get(f"/api/protocol/{protocol_id}/status")
     assert response.status_code == 200, response.text
+    assert response.json()["round_status"] == {
+        "step": 0,
+        "registered": 1,
+        "key_shares": 0,
+        "masked_inputs": 0,
+        "unmask_shares": 0,
+    }
 
     # invalid protocol
     response = client.get(f"/api/protocol/{uuid.uuid4()}/status")
     assert response.status_code == 404, response.text
 
 
+def test_get_ciphers_before_key_shares():
+    protocol_id, client_keys = setup_protocol_with_registration()
+
+    # the ciphers are only broadcast once the key shares have been collected
+    response = client.get(
+        f"/api/protocol/{protocol_id}/ciphers", params={"client_id": "user-1"}
+    )
+    assert response.status_code == 400, response.text
+
+    # invalid protocol
+    response = client.get(
+        f"/api/protocol/{uuid.uuid4()}/ciphers", params={"client_id": "user-1"}
+    )
+    assert response.status_code == 404, response.text
+
+
 def test_share_keys():
     protocol_id, client_keys = setup_protocol_with_registration()
 
@@ -394,3 +470,229 @@ def test_share_keys():
     response = client.post(
         f"/api/protocol/{protocol_id}/shareKeys", json=key_shares.dict()
     )
+
+
+def setup_protocol_with_key_shares(settings: SecureAggregationSettings):
+    # create a protocol with the given settings
+    data = {"name": "Test Protocol Round"}
+    response = client.post("/api/protocol", json=data)
+    protocol_id = response.json()["id"]
+    response = client.put(
+        f"/api/protocol/{protocol_id}/settings",
+        json=settings.dict(exclude={"graph_degree"}),
+    )
+    assert response.status_code == 200, response.text
+
+    client_protocol = ClientProtocol(settings=settings)
+    clients = {}
+    for _ in range(5):
+        keys, broadcast = client_protocol.setup()
+        response = client.post(
+            f"/api/protocol/{protocol_id}/register", json=broadcast.dict()
+        )
+        assert response.status_code == 200, response.text
+        clients[response.json()["client_id"]] = keys
+
+    response = client.post(f"/api/protocol/{protocol_id}/advance")
+    assert response.status_code == 200, response.text
+
+    key_broadcast = ServerKeyBroadcast(
+        **client.get(f"/api/protocol/{protocol_id}/keyBroadcasts").json()
+    )
+    seeds = {}
+    for client_id, keys in clients.items():
+        seeds[client_id], share_keys = client_protocol.process_key_broadcast(
+            client_id, keys, key_broadcast, k=settings.threshold
+        )
+        response = client.post(
+            f"/api/protocol/{protocol_id}/shareKeys", json=share_keys.dict()
+        )
+        assert response.status_code == 200, response.text
+
+    return protocol_id, client_protocol, clients, key_broadcast, seeds
+
+
+def fail_aggregation(*args, **kwargs):
+    raise ValueError("Not enough key shares")
+
+
+@pytest.mark.parametrize("mask_mode", ["float", "uint64"])
+def test_protocol_round(mask_mode, monkeypatch):
+    settings = SecureAggregationSettings(
+        cipher_envelope="aes-gcm", shamir_engine="numpy", mask_mode=mask_mode
+    )
+    (
+        protocol_id,
+        client_protocol,
+        clients,
+        key_broadcast,
+        seeds,
+    ) = setup_protocol_with_key_shares(settings)
+
+    # the round advances once all registered clients shared their keys
+    status = client.get(f"/api/protocol/{protocol_id}/status").json()
+    assert status["round_status"]["step"] == 2
+    assert status["round_status"]["key_shares"] == 5
+
+    # the last client drops out before submitting its masked input
+    dropped = list(clients)[-1]
+    cipher_broadcasts = {}
+    inputs = []
+    for i, (client_id, keys) in enumerate(clients.items()):
+        response = client.get(
+            f"/api/protocol/{protocol_id}/ciphers", params={"client_id": client_id}
+        )
+        assert response.status_code == 200, response.text
+        cipher_broadcasts[client_id] = ServerCipherBroadcast(**response.json())
+        if client_id == dropped:
+            continue
+
+        user_input = np.random.random(1000)
+        inputs.append(user_input)
+        masked_input = client_protocol.process_cipher_broadcast(
+            user_id=client_id,
+            keys=keys,
+            cipher_broadcast=cipher_broadcasts[client_id],
+            participants=key_broadcast.participants,
+            input=user_input,
+            seed=seeds[client_id],
+        )
+        # upload the masked inputs as binary messages and as JSON
+        if i % 2 == 0:
+            response = client.post(
+                f"/api/protocol/{protocol_id}/maskedInput",
+                content=masked_input.binary(),
+                headers={"content-type": BINARY_MEDIA_TYPE},
+            )
+        else:
+            response = client.post(
+                f"/api/protocol/{protocol_id}/maskedInput",
+                content=masked_input.base64_json(),
+                headers={"content-type": "application/json"},
+            )
+        assert response.status_code == 200, response.text
+
+        # masked inputs are only accepted once
+        if i == 0:
+            response = client.post(
+                f"/api/protocol/{protocol_id}/maskedInput",
+                content=masked_input.binary(),
+                headers={"content-type": BINARY_MEDIA_TYPE},
+            )
+            assert response.status_code == 400, response.text
+
+        # the running sum is kept between the uploads, a worker without it restores it from the database
+        assert key_broadcast.round_id in secure_aggregation._aggregators
+        if i == 1:
+            secure_aggregation._aggregators.evict([key_broadcast.round_id])
+
+    # the unmask broadcast is only available after the masked inputs have been collected
+    response = client.get(f"/api/protocol/{protocol_id}/unmaskBroadcast")
+    assert response.status_code == 400, response.text
+    response = client.post(f"/api/protocol/{protocol_id}/advance")
+    assert response.status_code == 200, response.text
+    assert response.json()["round_status"]["masked_inputs"] == 4
+
+    response = client.get(f"/api/protocol/{protocol_id}/unmaskBroadcast")
+    assert response.status_code == 200, response.text
+    unmask_broadcast = ServerUnmaskBroadCast(**response.json())
+    assert dropped not in {p.user_id for p in unmask_broadcast.participants}
+
+    response = client.get(f"/api/protocol/{protocol_id}/results")
+    assert response.status_code == 400, response.text
+
+    participants = [client_id for client_id in clients if client_id != dropped]
+    for i, client_id in enumerate(participants):
+        unmask_shares = client_protocol.process_unmask_broadcast(
+            user_id=client_id,
+            keys=clients[client_id],
+            cipher_broadcast=cipher_broadcasts[client_id],
+            unmask_broadcast=unmask_broadcast,
+            participants=key_broadcast.participants,
+        )
+        if i == len(participants) - 1:
+            # if the aggregation fails, the shares completing the round are not stored and can be submitted again
+            with monkeypatch.context() as m:
+                m.setattr(aggregation, "aggregate_round", fail_aggregation)
+                response = client.post(
+                    f"/api/protocol/{protocol_id}/unmaskShares",
+                    content=unmask_shares.json(),
+                )
+            assert response.status_code == 400, response.text
+            status = client.get(f"/api/protocol/{protocol_id}/status").json()
+            assert status["round_status"]["step"] == 3
+            assert status["round_status"]["unmask_shares"] == i
+
+        response = client.post(
+            f"/api/protocol/{protocol_id}/unmaskShares", content=unmask_shares.json()
+        )
+        assert response.status_code == 200, response.text
+
+    # the round is aggregated once all participants submitted their unmask shares
+    status = client.get(f"/api/protocol/{protocol_id}/status").json()
+    assert status["round_status"]["step"] == 4
+    assert status["round_status"]["unmask_shares"] == 4
+    assert key_broadcast.round_id not in secure_aggregation._aggregators
+    assert key_broadcast.round_id not in secure_aggregation._key_broadcasts
+
+    expected = np.sum(inputs, axis=0)
+    # exact cancellation of the masks, in the integer modes the fixed point rounding remains
+    atol = len(inputs) / (2 * settings.fixed_point_scale)
+    response = client.get(f"/api/protocol/{protocol_id}/results")
+    assert response.status_code == 200, response.text
+    results = AggregatedParameters.parse_raw(response.content)
+    assert np.allclose(results.params, expected, atol=atol)
+
+    response = client.get(
+        f"/api/protocol/{protocol_id}/results",
+        headers={"accept": BINARY_MEDIA_TYPE},
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == BINARY_MEDIA_TYPE
+    results = AggregatedParameters.parse_binary(response.content)
+    assert np.allclose(results.params, expected, atol=atol)
+
+
+def test_evict_round_caches():
+    protocol_id, _, clients, key_broadcast, _ = setup_protocol_with_key_shares(
+        SecureAggregationSettings()
+    )
+    response = client.get(
+        f"/api/protocol/{protocol_id}/ciphers", params={"client_id": list(clients)[0]}
+    )
+    assert response.status_code == 200, response.text
+    assert key_broadcast.round_id in secure_aggregation._cipher_routers
+
+    # the cached data of the rounds is removed when the protocol is deleted
+    db = next(override_get_db())
+    secure_aggregation.evict_rounds(db, protocol_id)
+    assert key_broadcast.round_id not in secure_aggregation._cipher_routers
+
+
+def test_masked_input_errors():
+    protocol_id, client_keys = setup_protocol_with_registration()
+
+    masked_input = {"user_id": "1", "masked_input": [1.0, 2.0]}
+    # masked inputs are only accepted after the keys have been shared
+    response = client.post(
+        f"/api/protocol/{protocol_id}/maskedInput", json=masked_input
+    )
+    assert response.status_code == 400, response.text
+
+    # invalid messages
+    response = client.post(
+        f"/api/protocol/{protocol_id}/maskedInput",
+        content=b"invalid",
+        headers={"content-type": BINARY_MEDIA_TYPE},
+    )
+    assert response.status_code == 422, response.text
+    response = client.post(
+        f"/api/protocol/{protocol_id}/maskedInput", json={"user_id": "1"}
+    )
+    assert response.status_code == 422, response.text
+
+    # invalid protocol
+    response = client.post(
+        f"/api/protocol/{uuid.uuid4()}/maskedInput", json=masked_input
+    )
+    assert response.status_code == 404, response.text
@@ -0,0 +1,19 @@
+from pht_federated.aggregator.storage.cache.rounds import RoundCache
+
+
+def test_round_cache():
+    cache = RoundCache(maxsize=2)
+    assert cache.get(1) is None
+
+    cache.set(1, "round 1")
+    cache.set(2, "round 2")
+    assert cache.get(1) == "round 1"
+    # the least recently used round is evicted
+    cache.set(3, "round 3")
+    assert len(cache) == 2
+    assert 2 not in cache
+    assert cache.get(1) == "round 1"
+    assert cache.get(3) == "round 3"
+
+    cache.evict([1, 3, 4])
+    assert len(cache) == 0
@@ -0,0 +1,136 @@
+import time
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+from pht_federated.aggregator.api.dependencies import get_db
+from pht_federated.aggregator.app import app
+from pht_federated.aggregator.schemas.protocol import ProtocolStatus, RoundStatus
+from pht_federated.aggregator.services.secure_aggregation.service import (
+    secure_aggregation,
+)
+from pht_federated.aggregator.storage.cache.status import (
+    InMemoryStatusCache,
+    RedisStatusCache,
+    create_status_cache,
+)
+from pht_federated.protocols.secure_aggregation.client.client_protocol import (
+    ClientProtocol,
+)
+from pht_federated.tests.aggregator.test_db import override_get_db
+
+app.dependency_overrides[get_db] = override_get_db
+
+client = TestClient(app)
+
+
+def test_in_memory_status_cache():
+    cache = InMemoryStatusCache(ttl=0.05)
+    status = ProtocolStatus(
+        protocol_id="protocol",
+        status="active",
+        active_round=1,
+        round_status=RoundStatus(step=1, registered=3),
+    )
+    assert cache.get_status("protocol") is None
+
+    cache.set_status(status)
+    assert cache.get_status("protocol") == status
+    cache.invalidate("protocol")
+    assert cache.get_status("protocol") is None
+
+    # expired entries are not served
+    cache.set_status(status)
+    time.sleep(0.1)
+    assert cache.get_status("protocol") is None
+
+
+def test_redis_status_cache():
+    server = fakeredis.FakeServer()
+    cache = RedisStatusCache(client=fakeredis.FakeRedis(server=server), ttl=10)
+    status = ProtocolStatus(
+        protocol_id="protocol",
+        status="active",
+        active_round=1,
+        round_status=RoundStatus(step=1, registered=3),
+    )
+    assert cache.get_status("protocol") is None
+
+    cache.set_status(status)
+    assert cache.get_status("protocol") == status
+    assert 0 < cache.client.ttl(cache.key("protocol")) <= 10
+    cache.invalidate("protocol")
+    assert cache.get_status("protocol") is None
+
+    # connection errors are treated as cache misses
+    server.connected = False
+    cache.set_status(status)
+    cache.invalidate("protocol")
+    assert cache.get_status("protocol") is None
+
+
+def test_create_status_cache(monkeypatch):
+    monkeypatch.delenv("AGGREGATOR_REDIS_URL", raising=False)
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    assert isinstance(create_status_cache(), InMemoryStatusCache)
+
+    # the in memory cache is not shared between workers
+    monkeypatch.setenv("WEB_CONCURRENCY", "2")
+    with pytest.raises(ValueError):
+        create_status_cache()
+
+    monkeypatch.setenv("AGGREGATOR_REDIS_URL", "redis://localhost:6379/0")
+    assert isinstance(create_status_cache(), RedisStatusCache)
+
+
+def test_status_write_through():
+    response = client.post("/api/protocol", json={"name": "Test Status Cache"})
+    protocol_id = response.json()["id"]
+
+    client_protocol = ClientProtocol()
+    for i in range(3):
+        keys, broadcast = client_protocol.setup()
+        response = client.post(
+            f"/api/protocol/{protocol_id}/register", json=broadcast.dict()
+        )
+        assert response.status_code == 200, response.text
+        # the registration updates the cached status
+        cached = secure_aggregation.cached_status(protocol_id)
+        assert cached.round_status.registered == i + 1
+
+    response = client.post(f"/api/protocol/{protocol_id}/advance")
+    assert response.status_code == 200, response.text
+    assert secure_aggregation.cached_status(protocol_id).round_status.step == 1
+
+    # the status is served from the cache
+    cached = secure_aggregation.cached_status(protocol_id)
+    secure_aggregation.status_cache.set_status(cached.copy(update={"status": "cached"}))
+    response = client.get(f"/api/protocol/{protocol_id}/status")
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "cached"
+
+    # a miss reads the status from the database and caches it again
+    secure_aggregation.status_cache.invalidate(protocol_id)
+    response = client.get(f"/api/protocol/{protocol_id}/status")
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "active"
+    assert response.json()["round_status"]["registered"] == 3
+    assert secure_aggregation.cached_status(protocol_id) == ProtocolStatus(
+        **response.json()
+    )
+
+    # updating the protocol invalidates the cached status
+    secure_aggregation.status_cache.set_status(cached.copy(update={"status": "cached"}))
+    response = client.put(
+        f"/api/protocol/{protocol_id}", json={"name": "Test Status Cache Updated"}
+    )
+    assert response.status_code == 200, response.text
+    assert secure_aggregation.cached_status(protocol_id) is None
+    response = client.get(f"/api/protocol/{protocol_id}/status")
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "active"
+
+    response = client.delete(f"/api/protocol/{protocol_id}")
+    assert response.status_code == 200, response.text
+    assert secure_aggregation.cached_status(protocol_id) is None
@@ -0,0 +1,98 @@
+import json
+
+import numpy as np
+import pytest
+
+from pht_federated.protocols.secure_aggregation.models.blocks import BlockManifest
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    MaskedInput,
+)
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    AggregatedParameters,
+)
+from pht_federated.protocols.secure_aggregation.models.util import (
+    decode_array_base64,
+    encode_array_base64,
+    pack_array,
+    unpack_array,
+)
+
+
+@pytest.mark.parametrize(
+    "array",
+    [
+        np.random.random(101),
+        np.random.random((3, 5)).astype(">f4"),
+        np.random.randint(0, 2**63, 17, dtype=np.uint64),
+        np.arange(12, dtype=np.int32).reshape(2, 3, 2)[:, ::2],
+        np.zeros(0),
+    ],
+)
+def test_pack_array(array):
+    packed = pack_array(array)
+    unpacked = unpack_array(packed)
+    assert unpacked.shape == array.shape
+    assert unpacked.dtype.byteorder in "<=|"
+    assert np.array_equal(unpacked, array)
+
+    # the values are a view of the buffer
+    buffer = bytearray(packed)
+    view = unpack_array(buffer)
+    if view.size:
+        view.reshape(-1)[0] = 1
+        assert unpack_array(buffer).reshape(-1)[0] == 1
+
+    decoded = decode_array_base64(json.loads(json.dumps(encode_array_base64(array))))
+    assert np.array_equal(decoded, array)
+
+
+def test_pack_array_errors():
+    packed = pack_array(np.random.random(10))
+    with pytest.raises(ValueError):
+        unpack_array(packed[:-1])
+    with pytest.raises(ValueError):
+        unpack_array(b"XXXX" + packed[4:])
+    with pytest.raises(ValueError):
+        unpack_array(packed[:5])
+    with pytest.raises(ValueError):
+        pack_array(np.array(["a", "b"]))
+    with pytest.raises(ValueError):
+        decode_array_base64({"dtype": "<f8", "shape": [3], "data": "AAAA"})
+
+
+def test_binary_messages():
+    manifest = BlockManifest.from_tensors({"a": np.zeros((2, 3)), "b": np.zeros(4)})
+    masked_input = MaskedInput(
+        user_id="user-1",
+        masked_input=np.random.randint(0, 2**64 - 1, 10, dtype=np.uint64),
+        manifest=manifest,
+    )
+
+    binary = masked_input.binary()
+    # raw values instead of decimal text
+    large_input = MaskedInput(user_id="user-1", masked_input=np.random.random(1000))
+    assert len(large_input.binary()) < len(large_input.json()) / 2
+    for decoded in [
+        MaskedInput.parse_binary(binary),
+        MaskedInput.parse_raw(masked_input.base64_json()),
+    ]:
+        assert decoded.user_id == masked_input.user_id
+        assert decoded.manifest == manifest
+        assert isinstance(decoded.masked_input, np.ndarray)
+        assert decoded.masked_input.dtype == np.uint64
+        assert np.array_equal(decoded.masked_input, masked_input.masked_input)
+    # the JSON list form is still available
+    assert np.array_equal(
+        MaskedInput.parse_raw(masked_input.json()).masked_input,
+        masked_input.masked_input,
+    )
+
+    params = AggregatedParameters(params=np.random.random(10), manifest=manifest)
+    decoded = AggregatedParameters.parse_binary(params.binary())
+    assert np.array_equal(decoded.params, params.params)
+    assert np.shares_memory(decoded.blocks()["b"], decoded.params)
+
+    with pytest.raises(ValueError):
+        AggregatedParameters.parse_binary(params.binary()[:-8])
+    with pytest.raises(ValueError):
+        AggregatedParameters.parse_binary(b"PHTX" + params.binary()[4:])
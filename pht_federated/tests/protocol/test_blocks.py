@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from pht_federated.protocols.secure_aggregation.models.blocks import (
+    BlockManifest,
+    ParameterBlock,
+)
+
+
+def test_block_manifest():
+    tensors = {
+        "weight": np.random.random((3, 4)).astype(np.float32),
+        "bias": np.random.random(4),
+        "steps": np.arange(6, dtype=np.int64).reshape(2, 3),
+    }
+    manifest = BlockManifest.from_tensors(tensors)
+    assert [block.name for block in manifest.blocks] == ["weight", "bias", "steps"]
+    assert [block.dtype for block in manifest.blocks] == ["float32", "float64", "int64"]
+    assert manifest.size == 22
+    assert manifest.offsets() == [(0, 12), (12, 16), (16, 22)]
+
+    flat = manifest.flatten(tensors)
+    assert flat.dtype == np.float64
+    assert np.array_equal(flat[12:16], tensors["bias"])
+
+    # the blocks are views of the flat vector
+    blocks = manifest.unflatten(flat)
+    for name, tensor in tensors.items():
+        assert blocks[name].shape == tensor.shape
+        assert np.shares_memory(blocks[name], flat)
+        assert np.allclose(blocks[name], tensor)
+
+    cast = manifest.unflatten(flat, cast=True)
+    assert cast["weight"].dtype == np.float32
+    assert cast["steps"].dtype == np.int64
+    assert np.shares_memory(cast["bias"], flat)
+
+    # the manifest survives serialization
+    assert BlockManifest.parse_raw(manifest.json()) == manifest
+
+    with pytest.raises(ValueError):
+        manifest.flatten({"weight": tensors["weight"], "bias": tensors["bias"]})
+    with pytest.raises(ValueError):
+        manifest.flatten({**tensors, "bias": np.zeros(5)})
+    with pytest.raises(ValueError):
+        manifest.unflatten(flat[:-1])
+
+
+def test_parameter_block_validation():
+    assert ParameterBlock(name="a", shape=[2, 0]).size == 0
+    assert ParameterBlock(name="a", shape=[], dtype="f4").dtype == "float32"
+    with pytest.raises(ValueError):
+        ParameterBlock(name="a", shape=[-1])
+    with pytest.raises(ValueError):
+        ParameterBlock(name="a", shape=[1], dtype="complex128")
+    with pytest.raises(ValueError):
+        ParameterBlock(name="a", shape=[1], dtype="not a dtype")
+    with pytest.raises(ValueError):
+        BlockManifest(
+            blocks=[
+                ParameterBlock(name="a", shape=[1]),
+                ParameterBlock(name="a", shape=[2]),
+            ]
+        )
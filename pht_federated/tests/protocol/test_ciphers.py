@@ -1,16 +1,39 @@
+import base64
+import os
 import uuid
 
+import pytest
+
 from pht_federated.protocols.secure_aggregation import ClientProtocol
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    ShareKeysMessage,
+)
+from pht_federated.protocols.secure_aggregation.models.secrets import (
+    Cipher,
+    EncryptedCipher,
+)
 from pht_federated.protocols.secure_aggregation.models.server_messages import (
     BroadCastClientKeys,
     ServerKeyBroadcast,
 )
-from pht_federated.protocols.secure_aggregation.secrets.ciphers import decrypt_cipher
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+from pht_federated.protocols.secure_aggregation.models.util import HexString
+from pht_federated.protocols.secure_aggregation.secrets.ciphers import (
+    decrypt_cipher,
+    pack_cipher,
+    unpack_cipher,
+)
+from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
+    create_secret_shares,
+)
 from pht_federated.protocols.secure_aggregation.secrets.util import load_public_key
 
 
-def test_ciphers():
-    protocol = ClientProtocol()
+@pytest.mark.parametrize("envelope", ["fernet", "aes-gcm"])
+def test_ciphers(envelope):
+    protocol = ClientProtocol(SecureAggregationSettings(cipher_envelope=envelope))
     keys_1, broadcast_1 = protocol.setup()
     keys_2, broadcast_2 = protocol.setup()
 
@@ -35,6 +58,9 @@ def test_ciphers():
     cipher = share_msg_1.ciphers[0]
 
     assert cipher.recipient == receiver
+    assert cipher.envelope == envelope
+    # the message survives serialization
+    assert ShareKeysMessage.parse_raw(share_msg_1.json()) == share_msg_1
 
     decrypted_cipher = decrypt_cipher(
         recipient=receiver,
@@ -42,11 +68,88 @@ def test_ciphers():
         sender_key=load_public_key(broadcast_1.cipher_public_key),
         sender=sender,
         encrypted_cypher=cipher.cipher,
+        envelope=envelope,
     )
 
     assert decrypted_cipher.sender == sender
     assert decrypted_cipher.recipient == receiver
     assert decrypted_cipher.key_share
 
+    if envelope == "aes-gcm":
+        # tampered ciphers are rejected
+        tampered = bytearray(base64.b64decode(cipher.cipher))
+        tampered[-1] ^= 1
+        with pytest.raises(ValueError):
+            decrypt_cipher(
+                recipient=receiver,
+                recipient_key=keys_2.cipher_key,
+                sender_key=load_public_key(broadcast_1.cipher_public_key),
+                sender=sender,
+                encrypted_cypher=base64.b64encode(tampered).decode(),
+                envelope=envelope,
+            )
+
     print(share_msg_1)
     print(share_msg_2)
+
+
+def test_pack_cipher():
+    shares = create_secret_shares(os.urandom(306).hex(), os.urandom(4).hex(), 5, 3)
+    cipher = Cipher(
+        sender="sender-ä",
+        recipient="recipient",
+        key_share=shares.key_shares[2],
+        seed_share=shares.seed_shares[2],
+    )
+    packed = pack_cipher(cipher)
+    # raw share bytes instead of hex encoded JSON
+    assert len(packed) < len(cipher.json()) / 2
+    assert unpack_cipher(packed) == cipher
+
+    # the unpacked cipher is constructed without validation, it has to match the parsed cipher
+    unpacked = unpack_cipher(packed)
+    parsed = Cipher.parse_raw(unpacked.json())
+    assert parsed == unpacked
+    assert parsed.key_share.segments[0].get_bytes() == (
+        unpacked.key_share.segments[0].get_bytes()
+    )
+
+    with pytest.raises(ValueError):
+        unpack_cipher(packed[:-1])
+    with pytest.raises(ValueError):
+        unpack_cipher(packed[:4])
+
+
+def test_encrypted_cipher_encoding():
+    EncryptedCipher(recipient="a", cipher="abcd")
+    EncryptedCipher(recipient="a", cipher="q83v", envelope="aes-gcm")
+    with pytest.raises(ValueError):
+        EncryptedCipher(recipient="a", cipher="q83v")
+    with pytest.raises(ValueError):
+        EncryptedCipher(recipient="a", cipher="not base64!", envelope="aes-gcm")
+
+
+def test_hex_string():
+    value = os.urandom(16)
+    hex_string = HexString.from_bytes(value)
+    assert hex_string == value.hex()
+    assert hex_string.get_bytes() == value
+
+    # validated strings are decoded once and kept
+    validated = HexString.validate(value.hex())
+    assert isinstance(validated, HexString)
+    assert validated.__dict__["_bytes"] == value
+    assert HexString.validate(validated) is validated
+    assert HexString.validate(value) == hex_string
+
+    # strings created without validation are decoded lazily
+    assert HexString(value.hex()).get_bytes() == value
+    # but are validated when passed to a model
+    assert HexString.validate(HexString(value.hex())) == hex_string
+    with pytest.raises(ValueError):
+        HexString.validate(HexString("zz"))
+
+    with pytest.raises(ValueError):
+        HexString.validate("not hex")
+    with pytest.raises(ValueError):
+        HexString.validate(1234)
@@ -1,8 +1,12 @@
+import os
+
 import pytest
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
 
 from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
+from pht_federated.protocols.secure_aggregation.secrets.util import load_public_key
 
 
 def test_client_keys_init():
@@ -90,3 +94,64 @@ def test_client_keys_key_broadcast():
             verification_keys=["1", "2"],
         )
         keys.key_broadcast()
+
+
+def test_client_keys_x25519():
+    keys = ClientKeys(cipher_suite="x25519")
+    assert keys.cipher_suite == "x25519"
+    assert isinstance(keys.cipher_key, X25519PrivateKey)
+    # raw 32 byte keys
+    assert len(bytes.fromhex(keys.hex_cipher_key)) == 32
+    assert len(bytes.fromhex(keys.hex_sharing_key_public)) == 32
+
+    loaded_keys = ClientKeys(keys.hex_cipher_key, keys.hex_sharing_key)
+    assert loaded_keys.cipher_suite == "x25519"
+    assert loaded_keys.hex_cipher_key == keys.hex_cipher_key
+    assert loaded_keys.hex_sharing_key_public == keys.hex_sharing_key_public
+
+    # keys of different suites can not be mixed
+    with pytest.raises(ValueError):
+        ClientKeys(keys.cipher_key, ec.generate_private_key(ec.SECP384R1()))
+    with pytest.raises(ValueError):
+        ClientKeys(cipher_suite="unknown")
+
+
+@pytest.mark.parametrize("cipher_suite", ["secp384r1", "x25519"])
+def test_compact_key_broadcast(cipher_suite):
+    keys = ClientKeys(cipher_suite=cipher_suite)
+    hex_broadcast = keys.key_broadcast()
+    broadcast = keys.key_broadcast(key_encoding="compact")
+    assert broadcast.key_encoding == "compact"
+    assert len(broadcast.cipher_public_key) < len(hex_broadcast.cipher_public_key)
+
+    for encoded in [broadcast.sharing_public_key, hex_broadcast.sharing_public_key]:
+        public_key = load_public_key(encoded)
+        assert public_key.public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ) == keys.sharing_key_public.public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+
+    with pytest.raises(ValueError):
+        keys.key_broadcast(key_encoding="unknown")
+
+
+@pytest.mark.parametrize("cipher_suite", ["secp384r1", "x25519"])
+def test_client_keys_sharing_key_seed(cipher_suite):
+    seed = os.urandom(32).hex()
+    keys = ClientKeys(cipher_suite=cipher_suite, sharing_key_seed=seed)
+    assert keys.hex_sharing_key_seed == seed
+    assert keys.cipher_suite == cipher_suite
+
+    # the sharing key is derived deterministically from the seed
+    loaded_keys = ClientKeys(keys.hex_cipher_key, sharing_key_seed=seed)
+    assert loaded_keys.hex_sharing_key == keys.hex_sharing_key
+
+    with pytest.raises(ValueError):
+        ClientKeys().hex_sharing_key_seed
+    with pytest.raises(ValueError):
+        ClientKeys(sharing_key=keys.sharing_key, sharing_key_seed=seed)
+    with pytest.raises(ValueError):
+        ClientKeys(sharing_key_seed=os.urandom(16))
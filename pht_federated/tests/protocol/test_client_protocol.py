@@ -1,5 +1,6 @@
 # flake8: noqa
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pytest
@@ -13,7 +14,12 @@ from pht_federated.protocols.secure_aggregation.secrets.ciphers import decrypt_c
 from pht_federated.protocols.secure_aggregation.secrets.masking import (
     _generate_private_mask,
 )
-from pht_federated.protocols.secure_aggregation.secrets.util import load_public_key
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    clear_public_key_cache,
+    load_public_key,
+    public_key_cache_info,
+    set_public_key_cache_size,
+)
 
 
 @pytest.fixture
@@ -90,6 +96,47 @@ def test_protocol_process_keys_from_server(key_broadcast):
         protocol.process_key_broadcast("test", keys[0], duplicate_cipher)
 
 
+def test_public_key_cache(key_broadcast):
+    server_broadcast, keys = key_broadcast
+    public_key_hex = server_broadcast.participants[0].broadcast.cipher_public_key
+
+    clear_public_key_cache()
+    public_key = load_public_key(public_key_hex)
+    assert load_public_key(public_key_hex) is public_key
+    info = public_key_cache_info()
+    assert info.hits == 1 and info.misses == 1
+
+    set_public_key_cache_size(1)
+    assert public_key_cache_info().maxsize == 1
+    load_public_key(public_key_hex)
+    load_public_key(server_broadcast.participants[1].broadcast.cipher_public_key)
+    assert public_key_cache_info().currsize == 1
+    assert public_key_cache_info().misses == 2
+
+    set_public_key_cache_size(4096)
+
+
+def test_participant_keys(key_broadcast):
+    protocol = ClientProtocol()
+    server_broadcast, keys = key_broadcast
+
+    participant_keys = protocol.participant_keys(server_broadcast.participants)
+    assert set(participant_keys) == {p.client_id for p in server_broadcast.participants}
+    assert (
+        participant_keys["user-1"].sharing_public_key.public_numbers()
+        == keys[1].sharing_key.public_key().public_numbers()
+    )
+    # the table is reused while the participants don't change
+    assert (
+        protocol.participant_keys(list(server_broadcast.participants))
+        is participant_keys
+    )
+    assert (
+        protocol.participant_keys(server_broadcast.participants[:3])
+        is not participant_keys
+    )
+
+
 def test_share_keys(key_broadcast):
     protocol = ClientProtocol()
     server_broadcast, keys = key_broadcast
@@ -103,6 +150,66 @@ def test_share_keys(key_broadcast):
         seed, msg = protocol.process_key_broadcast("test", keys[0], wrong_num_keys)
 
 
+def test_share_keys_parallel(key_broadcast):
+    protocol = ClientProtocol()
+    server_broadcast, keys = key_broadcast
+    recipients = [p.client_id for p in server_broadcast.participants[1:]]
+
+    _, msg = protocol.process_key_broadcast(
+        "user-0", keys[0], server_broadcast, n_workers=3
+    )
+    assert [cipher.recipient for cipher in msg.ciphers] == recipients
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        _, msg = protocol.process_key_broadcast(
+            "user-0", keys[0], server_broadcast, executor=executor
+        )
+    assert [cipher.recipient for cipher in msg.ciphers] == recipients
+
+    for cipher, participant, participant_keys in zip(
+        msg.ciphers, server_broadcast.participants[1:], keys[1:]
+    ):
+        decrypted = decrypt_cipher(
+            recipient=participant.client_id,
+            recipient_key=participant_keys.cipher_key,
+            sender="user-0",
+            sender_key=keys[0].cipher_key_public,
+            encrypted_cypher=cipher.cipher,
+        )
+        assert decrypted.recipient == participant.client_id
+
+
+def test_decrypt_ciphers_parallel(key_broadcast):
+    protocol = ClientProtocol()
+    server_broadcast, keys = key_broadcast
+    share_messages = [
+        protocol.process_key_broadcast(f"user-{i}", key, server_broadcast)[1]
+        for i, key in enumerate(keys)
+    ]
+    ciphers = ServerProtocol.broadcast_cyphers("user-0", share_messages).ciphers
+
+    for n_workers in [1, 3]:
+        decrypted = ClientProtocol._decrypt_ciphers(
+            "user-0",
+            keys[0],
+            ciphers[::-1],
+            server_broadcast.participants,
+            n_workers=n_workers,
+        )
+        assert [c.sender for c in decrypted] == [c.sender for c in ciphers[::-1]]
+        assert all(c.recipient == "user-0" for c in decrypted)
+
+    # ciphers from senders outside of the participants are rejected
+    unknown_sender = ciphers[0].copy(update={"sender": "unknown"})
+    with pytest.raises(ValueError):
+        ClientProtocol._decrypt_ciphers(
+            "user-0",
+            keys[0],
+            [unknown_sender, *ciphers[1:]],
+            server_broadcast.participants,
+        )
+
+
 def test_masking(cipher_broadcast):
     broadcast, keys, seeds, share_messages = cipher_broadcast
 
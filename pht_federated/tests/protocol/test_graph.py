@@ -0,0 +1,59 @@
+import pytest
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol
+from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    BroadCastClientKeys,
+)
+from pht_federated.protocols.secure_aggregation.secrets.graph import (
+    neighbourhood,
+    neighbours,
+)
+
+
+@pytest.fixture
+def participants():
+    msg = ClientProtocol().setup()[1]
+    return [
+        BroadCastClientKeys(client_id=f"user-{i}", broadcast=msg) for i in range(10)
+    ]
+
+
+def _ids(broadcasts):
+    return [p.client_id for p in broadcasts]
+
+
+def test_complete_graph(participants):
+    assert neighbourhood("user-3", participants) == participants
+    assert neighbourhood("user-3", participants, degree=9) == participants
+    assert _ids(neighbours("user-3", participants)) == [
+        f"user-{i}" for i in range(10) if i != 3
+    ]
+
+
+@pytest.mark.parametrize("degree", [1, 2, 4, 6])
+def test_sparse_graph(participants, degree):
+    expected_degree = 2 * ((degree + 1) // 2)
+    adjacency = {}
+    for participant in participants:
+        peers = neighbours(participant.client_id, participants, degree=degree)
+        assert len(peers) == expected_degree
+        adjacency[participant.client_id] = set(_ids(peers))
+
+    # the graph is undirected
+    for client_id, peers in adjacency.items():
+        for peer in peers:
+            assert client_id in adjacency[peer]
+
+    # the neighbourhood keeps the order of the participant list and wraps around
+    assert _ids(neighbourhood("user-0", participants, degree=2)) == [
+        "user-0",
+        "user-1",
+        "user-9",
+    ]
+
+
+def test_graph_errors(participants):
+    with pytest.raises(ValueError):
+        neighbourhood("unknown", participants, degree=2)
+    with pytest.raises(ValueError):
+        neighbourhood("user-0", participants, degree=0)
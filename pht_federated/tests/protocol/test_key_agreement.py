@@ -1,5 +1,11 @@
+import os
+
+import pytest
+
 from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
 from pht_federated.protocols.secure_aggregation.secrets.key_agreement import (
+    SharedKeyCache,
+    derive_private_key_from_seed,
     derive_shared_key,
 )
 
@@ -13,3 +19,73 @@ def test_key_derivation():
 
     assert shared_key_1 == shared_key_2
     assert len(shared_key_1) == 32
+
+    keys_1 = ClientKeys(cipher_suite="x25519")
+    keys_2 = ClientKeys(cipher_suite="x25519")
+
+    shared_key_1 = derive_shared_key(keys_1.cipher_key, keys_2.cipher_key_public)
+    shared_key_2 = derive_shared_key(keys_2.cipher_key, keys_1.cipher_key_public)
+
+    assert shared_key_1 == shared_key_2
+    assert len(shared_key_1) == 32
+
+
+def test_shared_key_cache():
+    keys_1 = ClientKeys()
+    keys_2 = ClientKeys()
+    keys_3 = ClientKeys()
+    cache = SharedKeyCache(maxsize=2)
+
+    shared_key = derive_shared_key(
+        keys_1.cipher_key, keys_2.cipher_key_public, cache=cache
+    )
+    assert shared_key == derive_shared_key(keys_1.cipher_key, keys_2.cipher_key_public)
+    assert cache.stats == {"hits": 0, "misses": 1, "hit_rate": 0.0, "size": 1}
+
+    # both sides of the key pair share the cache entry
+    assert shared_key == cache.derive(keys_2.cipher_key, keys_1.cipher_key_public)
+    assert cache.hits == 1
+
+    # length and info are part of the cache key
+    short_key = cache.derive(keys_1.cipher_key, keys_2.cipher_key_public, length=4)
+    assert short_key == derive_shared_key(
+        keys_1.cipher_key, keys_2.cipher_key_public, length=4
+    )
+    info_key = cache.derive(keys_1.cipher_key, keys_2.cipher_key_public, info=b"test")
+    assert info_key != shared_key
+    assert cache.misses == 3
+
+    # least recently used keys are evicted
+    assert len(cache) == 2
+    cache.derive(keys_1.cipher_key, keys_3.cipher_key_public)
+    assert len(cache) == 2
+    cache.derive(keys_1.cipher_key, keys_2.cipher_key_public, info=b"test")
+    assert cache.hits == 2
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.hit_rate == 2 / 6
+    cache.reset_stats()
+    assert cache.hit_rate == 0.0
+
+
+@pytest.mark.parametrize("cipher_suite", ["secp384r1", "x25519"])
+def test_derive_private_key_from_seed(cipher_suite):
+    seed = os.urandom(32)
+    private_key = derive_private_key_from_seed(seed, cipher_suite)
+    other_key = derive_private_key_from_seed(os.urandom(32), cipher_suite)
+
+    # the same seed always derives the same key
+    shared_key = derive_shared_key(private_key, other_key.public_key())
+    assert shared_key == derive_shared_key(
+        derive_private_key_from_seed(seed, cipher_suite), other_key.public_key()
+    )
+    assert shared_key != derive_shared_key(
+        derive_private_key_from_seed(os.urandom(32), cipher_suite),
+        other_key.public_key(),
+    )
+
+    with pytest.raises(ValueError):
+        derive_private_key_from_seed(seed[:16], cipher_suite)
+    with pytest.raises(ValueError):
+        derive_private_key_from_seed(seed, "unknown")
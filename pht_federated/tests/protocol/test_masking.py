@@ -12,7 +12,11 @@ from pht_federated.protocols.secure_aggregation.models.server_messages import (
 )
 from pht_federated.protocols.secure_aggregation.secrets.masking import (
     _generate_private_mask,
+    apply_mask_chunked,
+    create_generator,
     create_mask,
+    decode_fixed_point,
+    encode_fixed_point,
     expand_seed,
     generate_random_seed,
     generate_shared_mask,
@@ -69,6 +73,72 @@ def test_generate_private_mask():
     assert np.round(np.sum(mask_1 - mask_3), 10) != 0.0
 
 
+@pytest.mark.parametrize("prg", ["mt19937", "pcg64", "philox", "aes-ctr"])
+def test_expand_seed_prg(prg):
+    seed = integer_seed_from_hex(generate_random_seed())
+
+    mask_1 = expand_seed(seed, 1000, prg=prg)
+    mask_2 = expand_seed(seed, 1000, prg=prg)
+    assert np.array_equal(mask_1, mask_2)
+    assert mask_1.min() >= 0.0 and mask_1.max() < 1.0
+
+    # drawing from the generator in steps yields the same stream
+    generator = create_generator(seed, prg=prg)
+    stepped = np.concatenate([generator.random(300), generator.random(700)])
+    assert np.array_equal(mask_1, stepped)
+
+    assert not np.array_equal(mask_1, expand_seed(seed + 1, 1000, prg=prg))
+
+
+def test_expand_seed_global_state():
+    seed = integer_seed_from_hex(generate_random_seed())
+
+    # the default engine keeps the stream of the global generator without reseeding it
+    np.random.seed(seed)
+    legacy_mask = np.random.random(100)
+    np.random.seed(0)
+    state = np.random.get_state()[1].copy()
+
+    assert np.array_equal(expand_seed(seed, 100), legacy_mask)
+    assert np.array_equal(np.random.get_state()[1], state)
+
+    with pytest.raises(ValueError):
+        expand_seed(seed, 100, prg="unknown")
+
+
+@pytest.mark.parametrize("mode", ["uint32", "uint64"])
+def test_fixed_point_encoding(mode):
+    values = np.random.random(1000) * 200 - 100
+    encoded = encode_fixed_point(values, mode, scale=2**12)
+    assert encoded.dtype == np.dtype(mode)
+    assert (
+        np.abs(decode_fixed_point(encoded, mode, scale=2**12) - values).max()
+        <= 2**-13
+    )
+
+    # sums wrap around in the ring and decode to the sum of the values
+    encoded_sum = encoded + encode_fixed_point(-2 * values, mode, scale=2**12)
+    assert np.allclose(
+        decode_fixed_point(encoded_sum, mode, scale=2**12), -values, atol=2**-11
+    )
+
+
+@pytest.mark.parametrize("mode", ["uint32", "uint64"])
+def test_ring_mask_removal(mode):
+    seeds = [integer_seed_from_hex(generate_random_seed()) for _ in range(10)]
+    masked = encode_fixed_point(np.arange(100) - 50.0, mode)
+
+    for seed in seeds:
+        mask = expand_seed(seed, 100, prg="philox", mode=mode)
+        assert mask.dtype == np.dtype(mode)
+        masked += mask
+    for seed in seeds:
+        masked -= expand_seed(seed, 100, prg="philox", mode=mode)
+
+    # masks cancel out exactly
+    assert np.array_equal(decode_fixed_point(masked, mode), np.arange(100) - 50.0)
+
+
 def test_generate_seed():
     for i in range(1000):
         seed = generate_random_seed()
@@ -88,6 +158,93 @@ def test_create_mask(cipher_broadcast):
     assert len(mask) == 100
 
 
+@pytest.mark.parametrize("n_workers", [2, 4, 8])
+def test_create_mask_parallel(key_broadcast, n_workers):
+    broadcast, keys = key_broadcast
+    seed = generate_random_seed()
+
+    mask = create_mask(
+        user_id="user-2",
+        participants=broadcast.participants,
+        user_keys=keys[2],
+        n_params=1000,
+        seed=seed,
+    )
+    parallel_mask = create_mask(
+        user_id="user-2",
+        participants=broadcast.participants,
+        user_keys=keys[2],
+        n_params=1000,
+        seed=seed,
+        n_workers=n_workers,
+    )
+
+    assert np.allclose(mask, parallel_mask)
+
+
+@pytest.mark.parametrize("prg", ["mt19937", "philox"])
+@pytest.mark.parametrize("mode", ["float", "uint64"])
+def test_apply_mask_chunked(key_broadcast, prg, mode):
+    broadcast, keys = key_broadcast
+    seed = generate_random_seed()
+    input = np.random.random(1000)
+
+    mask = create_mask(
+        user_id="user-2",
+        participants=broadcast.participants,
+        user_keys=keys[2],
+        n_params=1000,
+        seed=seed,
+        prg=prg,
+        mode=mode,
+    )
+    if mode == "float":
+        expected = mask + input
+    else:
+        expected = mask + encode_fixed_point(input, mode)
+
+    for chunk_size, n_workers in [(1000, 1), (128, 1), (97, 3)]:
+        masked_input = apply_mask_chunked(
+            input,
+            user_id="user-2",
+            user_keys=keys[2],
+            participants=broadcast.participants,
+            seed=seed,
+            chunk_size=chunk_size,
+            prg=prg,
+            mode=mode,
+            n_workers=n_workers,
+        )
+        assert masked_input.dtype == expected.dtype
+        assert np.allclose(masked_input, expected)
+
+    # in float mode the input can be masked in place
+    out = input.copy() if mode == "float" else np.empty(1000, dtype=mode)
+    apply_mask_chunked(
+        out if mode == "float" else input,
+        user_id="user-2",
+        user_keys=keys[2],
+        participants=broadcast.participants,
+        seed=seed,
+        out=out,
+        chunk_size=100,
+        prg=prg,
+        mode=mode,
+    )
+    assert np.allclose(out, expected)
+
+    with pytest.raises(ValueError):
+        apply_mask_chunked(
+            input,
+            user_id="user-2",
+            user_keys=keys[2],
+            participants=broadcast.participants,
+            seed=seed,
+            out=np.empty(10),
+            mode=mode,
+        )
+
+
 def test_private_mask_removal():
     seeds = [os.urandom(4).hex() for _ in range(100)]
 
@@ -130,7 +287,8 @@ def test_shared_mask_removal():
     assert np.round(np.sum(mask), 10) == 0.0
 
 
-def test_generate_user_mask_removal():
+@pytest.mark.parametrize("prg", ["mt19937", "pcg64", "philox", "aes-ctr"])
+def test_generate_user_mask_removal(prg):
     protocol = ClientProtocol()
     server_protocol = ServerProtocol()
 
@@ -158,9 +316,9 @@ def test_generate_user_mask_removal():
         protocol_id="test", round_id=0, client_keys=client_key_broadcasts
     )
 
-    private_mask_1 = _generate_private_mask(seed_1, 100)
-    private_mask_2 = _generate_private_mask(seed_2, 100)
-    private_mask_3 = _generate_private_mask(seed_3, 100)
+    private_mask_1 = _generate_private_mask(seed_1, 100, prg=prg)
+    private_mask_2 = _generate_private_mask(seed_2, 100, prg=prg)
+    private_mask_3 = _generate_private_mask(seed_3, 100, prg=prg)
 
     user_mask_1 = create_mask(
         user_id=user_1,
@@ -168,6 +326,7 @@ def test_generate_user_mask_removal():
         participants=server_key_broadcast.participants,
         seed=seed_1,
         n_params=100,
+        prg=prg,
     )
 
     user_mask_2 = create_mask(
@@ -176,6 +335,7 @@ def test_generate_user_mask_removal():
         participants=server_key_broadcast.participants,
         seed=seed_2,
         n_params=100,
+        prg=prg,
     )
 
     user_mask_3 = create_mask(
@@ -184,6 +344,7 @@ def test_generate_user_mask_removal():
         participants=server_key_broadcast.participants,
         seed=seed_3,
         n_params=100,
+        prg=prg,
     )
 
     mask = (
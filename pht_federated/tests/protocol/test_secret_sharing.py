@@ -6,12 +6,19 @@ from cryptography.hazmat.primitives import serialization
 
 from pht_federated.protocols.secure_aggregation.models import HexString
 from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
+from pht_federated.protocols.secure_aggregation.secrets import shamir
 from pht_federated.protocols.secure_aggregation.secrets.secret_sharing import (
+    _combine_secrets,
     combine_key_shares,
+    combine_key_shares_batch,
     combine_seed_shares,
+    combine_seed_shares_batch,
     create_secret_shares,
     create_seed_shares,
 )
+from pht_federated.protocols.secure_aggregation.secrets.util import (
+    serialize_private_key,
+)
 
 
 def test_shamir_library():
@@ -26,6 +33,25 @@ def test_shamir_library():
     assert recovered != test_bytes
 
 
+def test_combine_secrets_pycryptodome():
+    # the local GF(2^128) interpolation recovers the chunks shared by pycryptodome like its own combine
+    chunks = [os.urandom(16) for _ in range(3)]
+    chunk_shares = [Shamir.split(4, 9, chunk, ssss=False) for chunk in chunks]
+    for selection in [slice(0, 4), slice(5, 9), slice(1, 9, 2)]:
+        shares = [
+            (share[0][0], [chunk_share[1] for chunk_share in share])
+            for share in zip(*(s[selection] for s in chunk_shares))
+        ]
+        recovered = _combine_secrets({0: shares}, 48, engine="pycryptodome")[0]
+        assert recovered == b"".join(chunks)
+        assert recovered == b"".join(
+            Shamir.combine(s[selection], ssss=False) for s in chunk_shares
+        )
+
+    with pytest.raises(ValueError):
+        _combine_secrets({0: shares + shares[:1]}, 48, engine="pycryptodome")
+
+
 def test_create_key_shares():
     keys = ClientKeys()
     shares = keys.create_key_shares(10, 3)
@@ -55,6 +81,18 @@ def test_combine_key_shares():
     print(byte_shares)
 
 
+def test_combine_key_shares_x25519():
+    keys = ClientKeys(cipher_suite="x25519")
+    shares = keys.create_key_shares(10, 3)
+    assert len(shares[0].segments) == 2
+
+    combined_key = combine_key_shares(shares[:3], cipher_suite="x25519")
+    assert (
+        combined_key.public_key().public_bytes_raw()
+        == keys.sharing_key_public.public_bytes_raw()
+    )
+
+
 def test_combine_key_shares_invalid_shares():
     keys = ClientKeys()
     shares = keys.create_key_shares(10, 6)
@@ -100,3 +138,129 @@ def test_create_secret_shares():
 
     assert shares.key_shares
     assert shares.seed_shares
+
+
+def test_numpy_shamir():
+    secret = os.urandom(50)
+    shares = shamir.split_secret(secret, 10, 4)
+    assert [index for index, _ in shares] == list(range(1, 11))
+    # 17 field elements padded to 20, 4 elements per segment
+    assert all(len(segments) == 5 for _, segments in shares)
+    assert all(len(segment) == 16 for _, segments in shares for segment in segments)
+
+    assert shamir.combine_secret(shares[:4], 50) == secret
+    assert shamir.combine_secret(shares[3:], 50) == secret
+    assert shamir.combine_secret(shares[::-3], 50) == secret
+
+    # too few shares interpolate a random polynomial
+    with pytest.raises(ValueError):
+        shamir.combine_secret(shares[:3], 50)
+
+    with pytest.raises(ValueError):
+        shamir.combine_secret(shares[:3] + shares[:1], 50)
+
+    with pytest.raises(ValueError):
+        shamir.split_secret(secret, 3, 4)
+
+
+@pytest.mark.parametrize("cipher_suite", ["secp384r1", "x25519"])
+def test_combine_key_shares_numpy(cipher_suite):
+    keys = ClientKeys(cipher_suite=cipher_suite)
+    shares = keys.create_key_shares(10, 3)
+    numpy_shares = create_secret_shares(
+        keys.hex_sharing_key, os.urandom(4).hex(), 10, 3, engine="numpy"
+    ).key_shares
+    assert len(numpy_shares) == 10
+    assert all(
+        len(segment.get_bytes()) == 16
+        for share in numpy_shares
+        for segment in share.segments
+    )
+
+    for share_list in [shares, numpy_shares]:
+        engine = "numpy" if share_list is numpy_shares else "pycryptodome"
+        combined_key = combine_key_shares(
+            share_list[2:5], cipher_suite=cipher_suite, engine=engine
+        )
+        assert combined_key.public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ) == keys.sharing_key_public.public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+
+    with pytest.raises(ValueError):
+        combine_key_shares(numpy_shares[:2], engine="numpy")
+
+    # corrupt one of the segments
+    numpy_shares[0].segments[0] = HexString(os.urandom(16).hex())
+    with pytest.raises(ValueError):
+        combine_key_shares(numpy_shares[:3], cipher_suite=cipher_suite, engine="numpy")
+
+    with pytest.raises(ValueError):
+        combine_key_shares(shares, engine="unknown")
+
+
+def test_mask_seed_sharing_numpy():
+    seed = os.urandom(4).hex()
+    shares = create_seed_shares(seed, 10, 3, engine="numpy")
+    assert len(shares) == 10
+    assert all(len(share.seed.get_bytes()) == 16 for share in shares)
+
+    assert combine_seed_shares(shares[-3:], engine="numpy").hex() == seed
+
+
+@pytest.mark.parametrize("engine", ["pycryptodome", "numpy"])
+@pytest.mark.parametrize("cipher_suite", ["secp384r1", "x25519"])
+def test_combine_key_seed_shares(engine, cipher_suite):
+    keys = ClientKeys(cipher_suite=cipher_suite, sharing_key_seed=os.urandom(32))
+    shares = create_secret_shares(
+        keys.hex_sharing_key_seed, os.urandom(4).hex(), 10, 3, engine=engine
+    ).key_shares
+    # the 32 byte seed fits into 2 (pycryptodome) or 3 (numpy) segments
+    assert len(shares[0].segments) <= 3
+
+    combined_key = combine_key_shares(
+        shares[4:7], cipher_suite=cipher_suite, engine=engine, key_sharing="seed"
+    )
+    assert serialize_private_key(combined_key) == keys.hex_sharing_key
+
+    with pytest.raises(ValueError):
+        combine_key_shares(shares, key_sharing="unknown")
+
+
+@pytest.mark.parametrize("engine", ["pycryptodome", "numpy"])
+def test_combine_shares_batch(engine):
+    seeds = [os.urandom(4).hex() for _ in range(6)]
+    keys = [ClientKeys() for _ in range(6)]
+    user_shares = [
+        create_secret_shares(key.hex_sharing_key, seed, 8, 3, engine=engine)
+        for key, seed in zip(keys, seeds)
+    ]
+
+    # users with the same and with different sets of shamir indices, in any order
+    seed_shares = {
+        f"user_{i}": (
+            shares.seed_shares[:4] if i % 2 else shares.seed_shares[-3:][::-1]
+        )
+        for i, shares in enumerate(user_shares)
+    }
+    combined_seeds = combine_seed_shares_batch(seed_shares, engine=engine)
+    assert [combined_seeds[f"user_{i}"].hex() for i in range(6)] == seeds
+    for user, shares in seed_shares.items():
+        assert combine_seed_shares(shares, engine=engine) == combined_seeds[user]
+
+    key_shares = {
+        f"user_{i}": shares.key_shares[i : i + 3]
+        for i, shares in enumerate(user_shares)
+    }
+    combined_keys = combine_key_shares_batch(key_shares, engine=engine)
+    assert [serialize_private_key(combined_keys[f"user_{i}"]) for i in range(6)] == [
+        key.hex_sharing_key for key in keys
+    ]
+
+    with pytest.raises(ValueError):
+        combine_key_shares_batch(key_shares, k=4, engine=engine)
+    with pytest.raises(ValueError):
+        combine_seed_shares_batch({"user_0": seed_shares["user_0"] * 2}, engine=engine)
@@ -1,11 +1,201 @@
-from pht_federated.protocols.secure_aggregation import ServerProtocol
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, List
+
+import numpy as np
+import pytest
+
+from pht_federated.protocols.secure_aggregation import ClientProtocol, ServerProtocol
 from pht_federated.protocols.secure_aggregation.models.client_keys import ClientKeys
+from pht_federated.protocols.secure_aggregation.models.client_messages import (
+    MaskedInput,
+    ShareKeysMessage,
+    UnmaskKeyShare,
+    UnmaskShares,
+)
+from pht_federated.protocols.secure_aggregation.models.secrets import EncryptedCipher
 from pht_federated.protocols.secure_aggregation.models.server_messages import (
+    AggregatedParameters,
     BroadCastClientKeys,
+    ServerCipherBroadcast,
     ServerKeyBroadcast,
+    ServerUnmaskBroadCast,
+)
+from pht_federated.protocols.secure_aggregation.models.settings import (
+    SecureAggregationSettings,
+)
+from pht_federated.protocols.secure_aggregation.server import (
+    CipherRouter,
+    IncrementalAggregator,
 )
 
 
+class CountingExecutor(ThreadPoolExecutor):
+    """
+    Thread pool counting the submitted calls of each function
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = Counter()
+
+    def submit(self, fn, *args, **kwargs):
+        self.calls[fn.__name__] += 1
+        return super().submit(fn, *args, **kwargs)
+
+
+@dataclass
+class ProtocolRound:
+    """
+    Messages of a protocol round run between a client and a server protocol
+    """
+
+    client_protocol: ClientProtocol
+    server_protocol: ServerProtocol
+    user_ids: List[str]
+    keys: Dict[str, ClientKeys]
+    broadcasts: List[BroadCastClientKeys]
+    key_broadcast: ServerKeyBroadcast
+    seeds: Dict[str, Any]
+    share_messages: List[ShareKeysMessage]
+    cipher_router: CipherRouter
+    cipher_broadcasts: Dict[str, ServerCipherBroadcast]
+    inputs: Dict[str, Any]
+    masked_inputs: List[MaskedInput]
+    unmask_broadcast: ServerUnmaskBroadCast
+    unmask_shares: List[UnmaskShares]
+
+    def aggregate(self, **kwargs) -> AggregatedParameters:
+        return self.server_protocol.aggregate_masked_inputs(
+            client_key_broadcasts=self.broadcasts,
+            masked_inputs=kwargs.pop("masked_inputs", self.masked_inputs),
+            unmask_shares=kwargs.pop("unmask_shares", self.unmask_shares),
+            **kwargs,
+        )
+
+
+def run_protocol_round(
+    settings: SecureAggregationSettings,
+    n_users: int,
+    create_input: Callable[[], Any],
+    dropped: Collection[str] = (),
+    k: int = 2,
+) -> ProtocolRound:
+    """
+    Run a protocol round up to the collection of the unmask shares
+    :param settings: settings of the client and server protocol
+    :param n_users: number of users, with the ids user-0 to user-{n_users - 1}
+    :param create_input: function creating the input of a user
+    :param dropped: users dropping out after sharing their keys
+    :param k: minimum number of shares required to recover the secrets of a user
+    :return: messages of the round
+    """
+    client_protocol = ClientProtocol(settings=settings)
+    server_protocol = ServerProtocol(settings=settings)
+
+    user_ids = [f"user-{i}" for i in range(n_users)]
+    keys = {}
+    broadcasts = []
+    for user_id in user_ids:
+        keys[user_id], msg = client_protocol.setup()
+        broadcasts.append(BroadCastClientKeys(client_id=user_id, broadcast=msg))
+    key_broadcast = server_protocol.broadcast_keys("test", 1, broadcasts)
+
+    seeds = {}
+    share_messages = []
+    for user_id in user_ids:
+        seeds[user_id], msg = client_protocol.process_key_broadcast(
+            user_id, keys[user_id], key_broadcast, k=k
+        )
+        share_messages.append(msg)
+
+    cipher_router = server_protocol.route_ciphers(share_messages)
+    cipher_broadcasts = {}
+    inputs = {}
+    masked_inputs = []
+    for user_id in user_ids:
+        cipher_broadcasts[user_id] = cipher_router.broadcast(user_id)
+        if user_id in dropped:
+            continue
+        inputs[user_id] = create_input()
+        masked_inputs.append(
+            client_protocol.process_cipher_broadcast(
+                user_id=user_id,
+                keys=keys[user_id],
+                cipher_broadcast=cipher_broadcasts[user_id],
+                participants=key_broadcast.participants,
+                input=inputs[user_id],
+                seed=seeds[user_id],
+            )
+        )
+
+    unmask_broadcast = server_protocol.broadcast_unmask_participants(masked_inputs)
+    unmask_shares = [
+        client_protocol.process_unmask_broadcast(
+            user_id=user_id,
+            keys=keys[user_id],
+            cipher_broadcast=cipher_broadcasts[user_id],
+            unmask_broadcast=unmask_broadcast,
+            participants=key_broadcast.participants,
+        )
+        for user_id in inputs
+    ]
+    return ProtocolRound(
+        client_protocol=client_protocol,
+        server_protocol=server_protocol,
+        user_ids=user_ids,
+        keys=keys,
+        broadcasts=broadcasts,
+        key_broadcast=key_broadcast,
+        seeds=seeds,
+        share_messages=share_messages,
+        cipher_router=cipher_router,
+        cipher_broadcasts=cipher_broadcasts,
+        inputs=inputs,
+        masked_inputs=masked_inputs,
+        unmask_broadcast=unmask_broadcast,
+        unmask_shares=unmask_shares,
+    )
+
+
+def create_vector_input():
+    return np.random.random(100) - 0.5
+
+
+def mask_dtype(settings: SecureAggregationSettings) -> np.dtype:
+    return np.dtype(np.float64 if settings.mask_mode == "float" else settings.mask_mode)
+
+
+def test_cipher_router():
+    share_messages = [
+        ShareKeysMessage(
+            client_id=sender,
+            ciphers=[
+                EncryptedCipher(recipient=recipient, cipher=f"{s:02x}{r:02x}")
+                for r, recipient in enumerate(["a", "b", "c"])
+            ],
+        )
+        for s, sender in enumerate(["a", "b", "c"])
+    ]
+    router = CipherRouter(share_messages[:2])
+    router.add(share_messages[2])
+    assert router.senders == ["a", "b", "c"]
+
+    broadcast = router.broadcast("b")
+    assert [(c.sender, c.receiver, c.cipher) for c in broadcast.ciphers] == [
+        ("a", "b", "0001"),
+        ("c", "b", "0201"),
+    ]
+    assert broadcast == ServerProtocol.broadcast_cyphers("b", share_messages)
+    # the broadcast survives serialization
+    assert ServerCipherBroadcast.parse_raw(broadcast.json()) == broadcast
+    assert router.broadcast("unknown").ciphers == []
+
+    with pytest.raises(ValueError):
+        router.add(share_messages[0])
+
+
 def test_server_protocol_broadcast_keys():
     protocol = ServerProtocol()
 
@@ -19,3 +209,347 @@ def test_server_protocol_broadcast_keys():
 
     broadcast = protocol.broadcast_keys("test", 1, broadcasts)
     assert isinstance(broadcast, ServerKeyBroadcast)
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        SecureAggregationSettings(),
+        SecureAggregationSettings(prg="philox"),
+        SecureAggregationSettings(prg="aes-ctr"),
+        SecureAggregationSettings(mask_mode="uint32", fixed_point_scale=2**10),
+        SecureAggregationSettings(prg="pcg64", mask_mode="uint64"),
+        SecureAggregationSettings(graph_degree=2),
+        SecureAggregationSettings(mask_mode="uint32", graph_degree=3),
+        SecureAggregationSettings(cipher_suite="x25519"),
+        SecureAggregationSettings(cipher_suite="x25519", graph_degree=2),
+        SecureAggregationSettings(key_encoding="compact"),
+        SecureAggregationSettings(cipher_suite="x25519", key_encoding="compact"),
+        SecureAggregationSettings(shamir_engine="numpy"),
+        SecureAggregationSettings(key_sharing="seed"),
+        SecureAggregationSettings(cipher_envelope="aes-gcm"),
+        SecureAggregationSettings(
+            cipher_suite="x25519", cipher_envelope="aes-gcm", graph_degree=2
+        ),
+        SecureAggregationSettings(
+            cipher_suite="x25519", key_sharing="seed", shamir_engine="numpy"
+        ),
+        SecureAggregationSettings(
+            cipher_suite="x25519", shamir_engine="numpy", graph_degree=3
+        ),
+    ],
+)
+def test_server_protocol_aggregate(settings):
+    protocol_round = run_protocol_round(settings, 7, create_vector_input)
+
+    aggregated = protocol_round.aggregate()
+    expected = np.sum(list(protocol_round.inputs.values()), axis=0)
+    if settings.mask_mode == "float":
+        assert np.allclose(aggregated.params, expected)
+    else:
+        # exact cancellation of the masks, only the fixed point rounding remains
+        assert np.abs(np.array(aggregated.params) - expected).max() <= 7 / (
+            2 * settings.fixed_point_scale
+        )
+
+
+# settings covering the masking modes, PRGs and key sharing variants of the focused tests
+SETTINGS = [
+    SecureAggregationSettings(),
+    SecureAggregationSettings(mask_mode="uint32", fixed_point_scale=2**10),
+    SecureAggregationSettings(prg="pcg64", mask_mode="uint64", graph_degree=2),
+    SecureAggregationSettings(
+        cipher_suite="x25519", key_sharing="seed", shamir_engine="numpy"
+    ),
+]
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_server_protocol_route_ciphers(settings):
+    protocol_round = run_protocol_round(settings, 5, create_vector_input)
+
+    # the indexed ciphers give the same broadcast as filtering the share messages
+    for user_id in protocol_round.user_ids:
+        assert protocol_round.cipher_broadcasts[
+            user_id
+        ] == protocol_round.server_protocol.broadcast_cyphers(
+            user_id, protocol_round.share_messages
+        )
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_server_protocol_chunked_masking(settings):
+    protocol_round = run_protocol_round(settings, 5, create_vector_input)
+
+    # block-wise masking produces the same masked input
+    for masked_input in protocol_round.masked_inputs:
+        user_id = masked_input.user_id
+        chunked_masked_input = protocol_round.client_protocol.process_cipher_broadcast(
+            user_id=user_id,
+            keys=protocol_round.keys[user_id],
+            cipher_broadcast=protocol_round.cipher_broadcasts[user_id],
+            participants=protocol_round.key_broadcast.participants,
+            input=protocol_round.inputs[user_id],
+            seed=protocol_round.seeds[user_id],
+            chunk_size=32,
+        )
+        assert np.allclose(masked_input.masked_input, chunked_masked_input.masked_input)
+
+    # unmask the sum block-wise with multiple workers
+    aggregated = protocol_round.aggregate()
+    dtype = mask_dtype(settings)
+    masked_sum = np.sum(
+        [
+            np.asarray(mi.masked_input, dtype=dtype)
+            for mi in protocol_round.masked_inputs
+        ],
+        axis=0,
+        dtype=dtype,
+    )
+    unmasked_sum = protocol_round.server_protocol.unmask_sum(
+        masked_sum,
+        protocol_round.broadcasts,
+        protocol_round.unmask_shares,
+        chunk_size=17,
+        n_workers=2,
+    )
+    assert np.allclose(unmasked_sum, aggregated.params)
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_server_protocol_transport(settings):
+    protocol_round = run_protocol_round(settings, 5, create_vector_input)
+    masked_inputs = protocol_round.masked_inputs
+    aggregated = protocol_round.aggregate()
+
+    # masked inputs as arrays, buffers and messages parsed from JSON give the same result
+    masked_values = [
+        np.asarray(mi.masked_input, dtype=mask_dtype(settings)) for mi in masked_inputs
+    ]
+    for inputs_data in [
+        masked_values,
+        [values.tobytes() for values in masked_values],
+        [MaskedInput.parse_raw(mi.json()) for mi in masked_inputs],
+        [MaskedInput.parse_binary(mi.binary()) for mi in masked_inputs],
+        [MaskedInput.parse_raw(mi.base64_json()) for mi in masked_inputs],
+    ]:
+        aggregated_data = protocol_round.aggregate(masked_inputs=inputs_data)
+        assert np.array_equal(aggregated_data.params, aggregated.params)
+
+    # the parameters are kept as an array and only converted to a list in JSON
+    assert isinstance(aggregated.params, np.ndarray)
+    assert np.allclose(
+        AggregatedParameters.parse_raw(aggregated.json()).params, aggregated.params
+    )
+    assert np.array_equal(
+        AggregatedParameters.parse_binary(aggregated.binary()).params,
+        aggregated.params,
+    )
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_incremental_aggregator(settings):
+    protocol_round = run_protocol_round(settings, 5, create_vector_input)
+    broadcasts = protocol_round.broadcasts
+    masked_inputs = protocol_round.masked_inputs
+    unmask_shares = protocol_round.unmask_shares
+    unmask_broadcast = protocol_round.unmask_broadcast
+    aggregated = protocol_round.aggregate()
+
+    # adding the masked inputs one by one as they arrive gives the same result
+    aggregator = IncrementalAggregator(broadcasts, settings=settings)
+    for masked_input in masked_inputs[::-1]:
+        aggregator.add_masked_input(masked_input)
+    assert aggregator.n_inputs == len(masked_inputs)
+    assert aggregator.unmask_broadcast() == unmask_broadcast.copy(
+        update={"participants": unmask_broadcast.participants[::-1]}
+    )
+    with pytest.raises(ValueError):
+        aggregator.add_masked_input(masked_inputs[0])
+    with pytest.raises(ValueError):
+        aggregator.add(
+            "unknown",
+            np.asarray(masked_inputs[0].masked_input, dtype=mask_dtype(settings)),
+        )
+
+    # continuing from a persisted running sum gives the same result
+    partial = IncrementalAggregator(broadcasts, settings=settings)
+    for masked_input in masked_inputs[:2]:
+        partial.add_masked_input(masked_input)
+    restored = IncrementalAggregator.restore(
+        broadcasts,
+        masked_sum=np.frombuffer(partial.masked_sum.tobytes(), dtype=partial.dtype),
+        participants=partial.participants,
+        settings=settings,
+    )
+    with pytest.raises(ValueError):
+        restored.add_masked_input(masked_inputs[0])
+    for masked_input in masked_inputs[2:]:
+        restored.add_masked_input(masked_input)
+    assert np.allclose(restored.finalize(unmask_shares).params, aggregated.params)
+    with pytest.raises(ValueError):
+        IncrementalAggregator.restore(
+            broadcasts, masked_sum=None, participants=partial.participants
+        )
+
+    incremental = aggregator.finalize(unmask_shares)
+    assert np.allclose(incremental.params, aggregated.params)
+    with pytest.raises(ValueError):
+        aggregator.finalize(unmask_shares)
+
+
+DROPOUT_SETTINGS = [
+    SecureAggregationSettings(threshold=2),
+    SecureAggregationSettings(prg="pcg64", mask_mode="uint64", threshold=2),
+    SecureAggregationSettings(mask_mode="uint32", graph_degree=3, threshold=2),
+    SecureAggregationSettings(
+        cipher_suite="x25519",
+        key_sharing="seed",
+        shamir_engine="numpy",
+        threshold=2,
+    ),
+]
+
+
+def run_dropout_round(settings: SecureAggregationSettings) -> ProtocolRound:
+    # two neighbouring users drop out after sharing their keys, in the complete graph one more, every survivor keeps
+    # enough neighbours to recover its seed
+    dropped = {"user-1", "user-2"}
+    if settings.graph_degree is None:
+        dropped.add("user-5")
+    return run_protocol_round(
+        settings,
+        8,
+        lambda: np.random.random(50) - 0.5,
+        dropped=dropped,
+        k=settings.threshold,
+    )
+
+
+@pytest.mark.parametrize("settings", DROPOUT_SETTINGS)
+def test_server_protocol_dropouts(settings):
+    protocol_round = run_dropout_round(settings)
+    dropped = set(protocol_round.user_ids) - set(protocol_round.inputs)
+
+    # key shares are only revealed for the dropped users
+    for shares in protocol_round.unmask_shares:
+        assert {share.user_id for share in shares.key_shares} <= dropped
+        assert not {share.user_id for share in shares.seed_shares} & dropped
+
+    expected = np.sum(list(protocol_round.inputs.values()), axis=0)
+    tolerance = (
+        1e-8
+        if settings.mask_mode == "float"
+        else len(protocol_round.user_ids) / (2 * settings.fixed_point_scale)
+    )
+    aggregated = protocol_round.aggregate()
+    assert np.abs(aggregated.params - expected).max() <= tolerance
+
+
+@pytest.mark.parametrize("settings", DROPOUT_SETTINGS)
+def test_server_protocol_dropouts_parallel(settings):
+    protocol_round = run_dropout_round(settings)
+    aggregated = protocol_round.aggregate()
+
+    # recovering the masks of the dropped users with a pool of workers gives the same result, the work is split
+    # between all workers of the executor
+    with CountingExecutor(max_workers=2) as executor:
+        parallel = protocol_round.aggregate(executor=executor)
+    assert np.allclose(parallel.params, aggregated.params)
+    assert executor.calls["_expand_shared_masks"] == 2
+
+    aggregator = IncrementalAggregator(protocol_round.broadcasts, settings=settings)
+    for masked_input in protocol_round.masked_inputs:
+        aggregator.add_masked_input(masked_input)
+    incremental = aggregator.finalize(protocol_round.unmask_shares, n_processes=2)
+    assert np.allclose(incremental.params, aggregated.params)
+
+
+@pytest.mark.parametrize("settings", DROPOUT_SETTINGS)
+def test_server_protocol_dropouts_key_shares(settings):
+    protocol_round = run_dropout_round(settings)
+    unmask_shares = protocol_round.unmask_shares
+
+    # the sharing key of a user whose masked input is part of the sum is never recovered
+    survivor_shares = unmask_shares[0].copy(deep=True)
+    survivor_shares.key_shares.append(
+        UnmaskKeyShare(
+            user_id=survivor_shares.seed_shares[0].user_id,
+            key_share=survivor_shares.key_shares[0].key_share,
+        )
+    )
+    with pytest.raises(ValueError):
+        protocol_round.aggregate(unmask_shares=[survivor_shares] + unmask_shares[1:])
+
+    # with fewer key shares than the threshold the sharing keys of the dropped users can not be recovered
+    too_few_shares = [unmask_shares[0]] + [
+        shares.copy(update={"key_shares": []}) for shares in unmask_shares[1:]
+    ]
+    with pytest.raises(ValueError, match="Not enough key shares"):
+        protocol_round.aggregate(unmask_shares=too_few_shares)
+    with pytest.raises(ValueError, match="Not enough key shares"):
+        protocol_round.aggregate(unmask_shares=too_few_shares, n_processes=2)
+
+
+def create_state_dict():
+    return {
+        "layer.weight": np.random.random((4, 3)).astype(np.float32) - 0.5,
+        "layer.bias": np.random.random(3) - 0.5,
+        "scale": np.random.random((2, 1, 2)) - 0.5,
+    }
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        SecureAggregationSettings(),
+        SecureAggregationSettings(mask_mode="uint64", prg="aes-ctr"),
+    ],
+)
+def test_server_protocol_blocks(settings):
+    # each client aggregates a state dict of several tensors in one round
+    protocol_round = run_protocol_round(settings, 4, create_state_dict)
+    state_dicts = list(protocol_round.inputs.values())
+    for masked_input in protocol_round.masked_inputs:
+        assert masked_input.manifest.size == 12 + 3 + 4
+    # the manifest is sent along with the masked input
+    masked_inputs = [
+        MaskedInput.parse_raw(mi.json()) for mi in protocol_round.masked_inputs
+    ]
+
+    aggregated = protocol_round.aggregate(masked_inputs=masked_inputs)
+    aggregator = IncrementalAggregator(protocol_round.broadcasts, settings=settings)
+    for masked_input in masked_inputs:
+        aggregator.add_masked_input(masked_input)
+    incremental = aggregator.finalize(protocol_round.unmask_shares)
+
+    for params in [
+        aggregated,
+        incremental,
+        AggregatedParameters.parse_raw(aggregated.json()),
+    ]:
+        blocks = params.blocks()
+        assert list(blocks) == ["layer.weight", "layer.bias", "scale"]
+        for name, block in blocks.items():
+            # the blocks are views of the aggregated parameters in the original layout
+            if isinstance(params.params, np.ndarray):
+                assert np.shares_memory(block, params.params)
+            assert np.allclose(
+                block, np.sum([sd[name] for sd in state_dicts], axis=0), atol=1e-4
+            )
+        assert params.blocks(cast=True)["layer.weight"].dtype == np.float32
+
+    # inputs with different layouts are not aggregated
+    other = masked_inputs[0].copy(
+        update={
+            "manifest": masked_inputs[0].manifest.copy(
+                update={"blocks": masked_inputs[0].manifest.blocks[::-1]}
+            )
+        }
+    )
+    with pytest.raises(ValueError):
+        protocol_round.aggregate(masked_inputs=[other] + masked_inputs[1:])
+    aggregator = IncrementalAggregator(protocol_round.broadcasts, settings=settings)
+    aggregator.add_masked_input(masked_inputs[1])
+    with pytest.raises(ValueError):
+        aggregator.add_masked_input(other)